@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 from src.components import sidebar, file_upload, analysis, report, comparison_table
 from src.utils import file_utils
 from src.config import settings
+from src.services import telemetry, ai_service
 
 # --- Конфигурация страницы --- 
 # Вызываем самой первой командой Streamlit!
@@ -57,6 +58,12 @@ if "selected_comparison_model" not in st.session_state:
     default_comparison_model = settings.AVAILABLE_MODELS.get("GPT-4.5 Preview", list(settings.AVAILABLE_MODELS.values())[0])
     st.session_state.selected_comparison_model = default_comparison_model
 
+if "stage_tiering" not in st.session_state:
+    st.session_state.stage_tiering = settings.STAGE_TIERING_ENABLED
+
+if "stage_config" not in st.session_state:
+    st.session_state.stage_config = {}
+
 # Настройка корпоративной темы Devent
 st.markdown(
     f"""
@@ -334,6 +341,11 @@ def initialize_session_state():
         # Устанавливаем модель по умолчанию для сравнения КП
         default_comparison_model = settings.AVAILABLE_MODELS.get("GPT-4.5 Preview", list(settings.AVAILABLE_MODELS.values())[0])
         st.session_state.selected_comparison_model = default_comparison_model
+    # Модели, лимиты ответа и SLO задержки по этапам (переопределения settings.STAGE_MODELS в сессии)
+    if "stage_tiering" not in st.session_state:
+        st.session_state.stage_tiering = settings.STAGE_TIERING_ENABLED
+    if "stage_config" not in st.session_state:
+        st.session_state.stage_config = {}
 
 def render_sidebar():
     """Отображает боковое меню в корпоративном стиле Devent."""
@@ -447,6 +459,43 @@ def render_sidebar():
             st.session_state.selected_comparison_model = new_comparison_model_id
             st.info(f"✅ Модель сравнения изменена на: {selected_comparison_model_name}")
         
+        # --- Модели по этапам: быстрые модели для извлечения данных, сильные - для сравнения ---
+        st.session_state.stage_tiering = st.toggle(
+            "Подбирать модель по этапам",
+            value=st.session_state.stage_tiering,
+            key="stage_tiering_toggle",
+            help="Каждый этап анализа использует свою модель, лимит ответа и целевую задержку. "
+                 "Если выключено, все этапы используют модели, выбранные выше."
+        )
+        if st.session_state.stage_tiering:
+            model_ids = list(settings.AVAILABLE_MODELS.values())
+            with st.expander("Настройки этапов"):
+                for stage, label in settings.STAGE_LABELS.items():
+                    config = ai_service.get_stage_config(stage)
+                    st.markdown(f"**{label}**")
+                    stage_model_name = st.selectbox(
+                        "Модель",
+                        options=model_display_names,
+                        index=model_ids.index(config["model"]) if config["model"] in model_ids else 0,
+                        key=f"stage_model_{stage}"
+                    )
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        max_tokens = st.number_input(
+                            "Лимит ответа", min_value=256, max_value=16000, step=256,
+                            value=int(config["max_tokens"]), key=f"stage_max_tokens_{stage}"
+                        )
+                    with col2:
+                        latency_slo = st.number_input(
+                            "SLO, с", min_value=1.0, max_value=600.0, step=5.0,
+                            value=float(config["latency_slo_sec"]), key=f"stage_slo_{stage}"
+                        )
+                    st.session_state.stage_config[stage] = {
+                        "model": settings.AVAILABLE_MODELS[stage_model_name],
+                        "max_tokens": int(max_tokens),
+                        "latency_slo_sec": float(latency_slo),
+                    }
+        
         st.divider()
         
         # Блок навигации
@@ -523,7 +572,7 @@ def main():
     
     # --- Основное содержимое страницы --- 
     main_container = st.container()
-    with main_container:
+    with main_container, telemetry.span(f"render.{st.session_state.current_step}"):
         if st.session_state.current_step == "upload":
             file_upload.render_upload_section()
         elif st.session_state.current_step == "analysis":
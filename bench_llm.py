@@ -0,0 +1,120 @@
+"""
+Нагрузочная проверка слоя провайдеров (ai_service) на локальном поддельном сервере.
+Запускает fake_llm_server.py в фоне, направляет на него SDK провайдеров и отправляет
+пачку одновременных запросов всех этапов анализа. Выводит перцентили задержки, пропускную
+способность, ошибки, а также статистику объединения запросов, планировщика и хеджирования.
+
+Запуск: python bench_llm.py --requests 300 --latency-dist lognormal --latency-mean 1 --error-429 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import urllib.request
+
+import fake_llm_server
+
+STAGES = ("summary", "comparison", "recommendation", "comparative_report")
+
+def _percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+def main():
+    parser = fake_llm_server.build_arg_parser()
+    parser.description = "Нагрузочная проверка ai_service на поддельном сервере провайдеров"
+    parser.set_defaults(port=0, quiet=True)
+    parser.add_argument("--requests", type=int, default=200, help="Число запросов")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="Доля повторяющихся запросов (проверка объединения)")
+    parser.add_argument("--model", default="claude-3-5-sonnet-20240620", help="Основная модель")
+    parser.add_argument("--hedge", action="store_true", help="Включить хеджирование запросов")
+    parser.add_argument("--max-concurrent", type=int, help="Лимит одновременных запросов планировщика")
+    parser.add_argument("--max-queue", type=int, help="Глубина очереди планировщика")
+    args = parser.parse_args()
+
+    server = fake_llm_server.run_server(
+        args.host,
+        args.port,
+        latency_dist=args.latency_dist,
+        latency_mean=args.latency_mean,
+        latency_sigma=args.latency_sigma,
+        chunk_delay=args.chunk_delay,
+        error_429=args.error_429,
+        error_5xx=args.error_5xx,
+        retry_after=args.retry_after,
+        quiet=args.quiet,
+    )
+    host, port = server.server_address
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://{host}:{port}"
+
+    # SDK читают адреса из окружения при создании клиентов (клиенты ai_service создаются лениво)
+    os.environ.update({
+        "ANTHROPIC_BASE_URL": base_url,
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "ANTHROPIC_API_KEY": "test",
+        "OPENAI_API_KEY": "test",
+    })
+    from src.config import settings
+    from src.models import schemas
+    from src.services import ai_service, hedging, request_coalescing, structured_output, admission
+
+    if args.max_concurrent:
+        settings.ADMISSION_MAX_CONCURRENT = args.max_concurrent
+    if args.max_queue:
+        settings.ADMISSION_MAX_QUEUE = args.max_queue
+
+    stage_schemas = {
+        "summary": schemas.KPSummary,
+        "comparison": schemas.TZKPComparison,
+        "recommendation": schemas.Recommendation,
+    }
+
+    async def _one(index: int):
+        stage = STAGES[index % len(STAGES)]
+        # Часть запросов повторяет предыдущие - одновременные дубли должны объединяться
+        key = random.randrange(max(1, index)) if random.random() < args.duplicates else index
+        schema_cls = stage_schemas.get(stage)
+        json_schema = structured_output.build_json_schema(schema_cls) if schema_cls else None
+        return await ai_service.get_ai_completion_async(
+            f"Запрос #{key}: проанализируй документ", "Верни ответ на русском языке.",
+            args.model, stage, args.hedge, json_schema=json_schema
+        )
+
+    async def _run():
+        return await asyncio.gather(*[_one(i) for i in range(args.requests)], return_exceptions=True)
+
+    started = time.monotonic()
+    results = ai_service.run_sync(_run())
+    elapsed = time.monotonic() - started
+
+    completions = [r for r in results if not isinstance(r, Exception)]
+    errors = [r for r in results if isinstance(r, Exception)]
+    latencies = [c.latency for c in completions if not c.coalesced]
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        server_stats = json.loads(response.read())
+
+    print(f"Запросов: {args.requests}, успешно: {len(completions)}, ошибок: {len(errors)}, время: {elapsed:.2f} с, "
+          f"{args.requests / elapsed:.1f} запр/с")
+    print(f"Задержка (без объединенных): p50 {_percentile(latencies, 0.5):.3f} с, p95 {_percentile(latencies, 0.95):.3f} с, "
+          f"max {max(latencies, default=0):.3f} с")
+    served = {}
+    for completion in completions:
+        served[completion.model_id] = served.get(completion.model_id, 0) + 1
+    print(f"Ответили модели: {served}")
+    print(f"Сервер: {server_stats}")
+    print(f"Объединение запросов: {request_coalescing.coalescer.stats()}")
+    print(f"Планировщик: {admission.scheduler.stats()}")
+    if args.hedge:
+        print(f"Хеджирование: {hedging.policy.stats()}")
+    for error in errors[:5]:
+        print(f"  - {type(error).__name__}: {error}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
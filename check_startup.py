@@ -0,0 +1,52 @@
+"""
+Отладочный скрипт для измерения времени холодного старта.
+Импортирует модули приложения в чистом процессе и проверяет, что SDK провайдеров
+не загружаются до первого запроса к модели и время укладывается в бюджет.
+
+Запуск: python check_startup.py
+"""
+import json
+import subprocess
+import sys
+
+from src.config import settings
+
+# Модули, через которые проходит каждый новый воркер Streamlit
+MODULES = [
+    "src.services.ai_service",
+    "src.components.analysis",
+    "src.components.comparison_table",
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "sdk_loaded": [m for m in ("anthropic", "openai") if m in sys.modules]}}))
+"""
+
+def measure_cold_start(runs: int = 3) -> dict:
+    """Запускает импорт в новом процессе несколько раз и возвращает лучшее время."""
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(modules=MODULES)],
+            capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        results.append(json.loads(output))
+    return min(results, key=lambda r: r["elapsed"])
+
+if __name__ == "__main__":
+    result = measure_cold_start()
+    print(f"[INFO] Время импорта: {result['elapsed']:.2f} с (бюджет {settings.COLD_START_BUDGET_SEC:.2f} с)")
+    ok = True
+    if result["sdk_loaded"]:
+        print(f"[ERROR] SDK загружены при импорте: {', '.join(result['sdk_loaded'])}")
+        ok = False
+    if result["elapsed"] > settings.COLD_START_BUDGET_SEC:
+        print("[ERROR] Превышен бюджет холодного старта")
+        ok = False
+    print("[DONE] Проверка пройдена." if ok else "[DONE] Проверка не пройдена.")
+    sys.exit(0 if ok else 1)
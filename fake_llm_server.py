@@ -0,0 +1,605 @@
+"""
+Локальный поддельный сервер API провайдеров для проверки без реальных ключей.
+Реализует Anthropic Messages и OpenAI Chat Completions (включая потоковую передачу SSE),
+пакетные API Anthropic (Message Batches) и OpenAI (Files + Batch) и возвращает валидные
+по схемам ответы для каждого типа запроса ai_service. Задержка ответа задается
+распределением, а ошибки 429/5xx можно внедрять с заданной вероятностью, чтобы проверять
+параллельность, повторы, хеджирование и кеширование на ноутбуке.
+
+Запуск:
+    python fake_llm_server.py --port 8765 --latency-dist lognormal --latency-mean 2 --error-429 0.05
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 OPENAI_BASE_URL=http://127.0.0.1:8765/v1 \\
+        ANTHROPIC_API_KEY=test OPENAI_API_KEY=test streamlit run app.py
+
+Счетчики запросов и внедренных ошибок: GET /stats. Нагрузочная проверка: python bench_llm.py
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Заготовленные ответы по схемам из src/models/schemas.py
+CANNED_PAYLOADS = {
+    "KPSummary": {
+        "company_name": "ТестСофт",
+        "tech_stack": "Python, Django, React, PostgreSQL",
+        "pricing": "Фиксированная цена: 4 800 000 руб.",
+        "timeline": "6 месяцев (3 этапа)",
+    },
+    "TZKPComparison": {
+        "compliance_score": 78,
+        "missing_requirements": ["Интеграция с SSO", "Резервное копирование данных"],
+        "additional_features": ["Мобильное приложение"],
+    },
+    "Recommendation": {
+        "strength": ["Высокий балл соответствия", "Современный стек технологий"],
+        "weakness": ["Не описана интеграция с SSO"],
+        "summary": "Предложение в целом соответствует ТЗ, требуется уточнение по интеграциям.",
+    },
+    "SectionComparison": {
+        "compliance": 80,
+        "details": "Основные требования раздела покрыты, не описана интеграция с SSO.",
+        "missing_requirements": ["Интеграция с SSO"],
+        "additional_features": ["Мобильное приложение"],
+    },
+    "AdditionalFileDigest": {
+        "summary": "Протокол встречи с участниками тендера.",
+        "general_findings": ["Срок запуска сдвинут на месяц"],
+        "vendor_findings": [
+            {"vendor": "ООО «ТестСофт»", "finding": "Ранее успешно внедрил похожую систему", "impact": 1},
+        ],
+    },
+    "PairwiseVerdict": {
+        "winner": 1,
+        "reason": "Первое КП полнее покрывает требования ТЗ при сопоставимой стоимости.",
+    },
+}
+
+# Признаки схемы в системной инструкции для запросов без явного имени схемы (json_object)
+SCHEMA_MARKERS = [
+    ("vendor_findings", "AdditionalFileDigest"),
+    ("winner", "PairwiseVerdict"),
+    ("compliance_score", "TZKPComparison"),
+    ("compliance", "SectionComparison"),
+    ("strength", "Recommendation"),
+    ("company_name", "KPSummary"),
+]
+
+# Ответ на запросы без схемы (сравнительный и аналитический отчеты)
+CANNED_REPORT = (
+    "## Сравнительный анализ\n\n"
+    "Предложение ТестСофт лучше всего соответствует требованиям ТЗ (78%). "
+    "Основные риски связаны с интеграцией SSO и резервным копированием.\n\n"
+    "## Рекомендация\n\n"
+    "Рекомендуется продолжить переговоры с ТестСофт при условии уточнения сроков интеграций."
+)
+
+STATE = {
+    "lock": threading.Lock(),
+    "files": {},
+    "openai_batches": {},
+    "anthropic_batches": {},
+    "prompt_cache": set(),  # Префиксы с отметкой cache_control, уже встречавшиеся в запросах
+    "stats": {"requests": 0, "streamed": 0, "errors_429": 0, "errors_5xx": 0, "partial": 0, "repairs": 0, "in_flight": 0, "max_in_flight": 0},
+    "last_repair_prompt": None,
+}
+CONFIG = {
+    "batch_delay": 2.0,
+    "latency_dist": "fixed",  # fixed | uniform | lognormal
+    "latency_mean": 0.2,       # Средняя задержка до первого токена, сек
+    "latency_sigma": 0.5,      # Разброс: доля от среднего для uniform, sigma для lognormal
+    "chunk_delay": 0.01,       # Задержка между фрагментами ответа, сек
+    "chunk_size": 24,          # Символов в одном фрагменте потока
+    "error_429": 0.0,          # Вероятность ответа 429
+    "error_5xx": 0.0,          # Вероятность ответа 5xx
+    "retry_after": 1,          # Заголовок retry-after для 429, сек
+    "partial_rate": 0.0,       # Вероятность ответа по схеме без последнего поля (проверка дозапроса полей)
+    "model_latency": {},       # Фиксированная задержка отдельных моделей, сек (проверка хеджирования)
+    "quiet": False,
+}
+
+def sample_latency(model_id: str = None) -> float:
+    """Задержка до первого токена: заданная для модели или по выбранному распределению."""
+    if model_id in CONFIG["model_latency"]:
+        return CONFIG["model_latency"][model_id]
+    mean = CONFIG["latency_mean"]
+    if CONFIG["latency_dist"] == "uniform":
+        spread = mean * CONFIG["latency_sigma"]
+        return max(0.0, random.uniform(mean - spread, mean + spread))
+    if CONFIG["latency_dist"] == "lognormal" and mean > 0:
+        # Параметры подобраны так, чтобы среднее совпадало с latency_mean; хвост задается sigma
+        sigma = CONFIG["latency_sigma"]
+        return random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+    return mean
+
+def _count(name: str, delta: int = 1):
+    with STATE["lock"]:
+        stats = STATE["stats"]
+        stats[name] += delta
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+
+def _chunks(text: str) -> list:
+    size = CONFIG["chunk_size"]
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+def _example_value(schema: dict):
+    """Значение по умолчанию для свойства JSON Schema."""
+    value_type = schema.get("type")
+    if value_type == "array":
+        return [_example_value(schema.get("items", {"type": "string"}))]
+    if value_type == "integer":
+        return 75
+    if value_type == "number":
+        return 7.5
+    if value_type == "object":
+        return {}
+    return "Тестовое значение"
+
+def canned_payload(schema_name: str = None, schema: dict = None, system_prompt: str = "") -> dict:
+    """
+    Подбирает ответ по имени схемы (включая схемы дозапроса *Repair) или по системной инструкции.
+    Если передана JSON Schema, в ответ попадают только ее свойства.
+    """
+    base_name = (schema_name or "").replace("Repair", "")
+    if base_name not in CANNED_PAYLOADS:
+        base_name = next((name for marker, name in SCHEMA_MARKERS if marker in (system_prompt or "")), None)
+    payload = dict(CANNED_PAYLOADS.get(base_name, {}))
+    if schema and schema.get("properties"):
+        payload = {
+            key: payload.get(key, _example_value(prop))
+            for key, prop in schema["properties"].items()
+        }
+    if (schema_name or "").endswith("Repair"):
+        _count("repairs")
+    elif len(payload) > 1 and random.random() < CONFIG["partial_rate"]:
+        _count("partial")
+        payload.pop(list(payload)[-1])
+    return payload or None
+
+def canned_text(system_prompt: str = "", prompt: str = "") -> str:
+    """Текстовый ответ для запросов без схемы: JSON, если инструкция его требует, иначе отчет в Markdown."""
+    payload = canned_payload(system_prompt=system_prompt)
+    if payload is None and "JSON" in (system_prompt or "") + (prompt or ""):
+        payload = {"result": "ok"}
+    return json.dumps(payload, ensure_ascii=False) if payload is not None else CANNED_REPORT
+
+def _estimate_tokens(value) -> int:
+    return max(1, len(json.dumps(value, ensure_ascii=False)) // 3)
+
+def _text_blocks(content) -> list:
+    """Текст сообщения: строка или текстовые блоки (content blocks Anthropic)."""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return [block for block in content or [] if block.get("type") == "text"]
+
+def _user_prompt(messages: list) -> str:
+    contents = [m.get("content") for m in messages or [] if m.get("role") == "user"]
+    return "".join(block["text"] for block in _text_blocks(contents[-1])) if contents else ""
+
+def _prompt_cache_usage(messages: list) -> dict:
+    """Учет кеша промптов Anthropic: префикс до блока с cache_control читается из кеша при повторе."""
+    prefix = ""
+    for message in messages or []:
+        for block in _text_blocks(message.get("content")):
+            prefix += block["text"]
+            if block.get("cache_control"):
+                tokens = _estimate_tokens(prefix)
+                with STATE["lock"]:
+                    hit = prefix in STATE["prompt_cache"]
+                    STATE["prompt_cache"].add(prefix)
+                return {"cache_read_input_tokens": tokens} if hit else {"cache_creation_input_tokens": tokens}
+    return {}
+
+def _remember_repair(schema_name: str, prompt: str):
+    """Сохраняет запрос дозаполнения полей (GET /stats его не показывает, читается из STATE)."""
+    if (schema_name or "").endswith("Repair"):
+        with STATE["lock"]:
+            STATE["last_repair_prompt"] = prompt
+
+def anthropic_message(params: dict) -> dict:
+    """Ответ Messages API на запрос с параметрами params."""
+    tool_choice = params.get("tool_choice") or {}
+    tools = {tool["name"]: tool for tool in params.get("tools", [])}
+    if tool_choice.get("type") == "tool":
+        tool = tools.get(tool_choice["name"], {})
+        _remember_repair(tool_choice["name"], _user_prompt(params.get("messages")))
+        payload = canned_payload(tool_choice["name"], tool.get("input_schema"), params.get("system", "")) or {}
+        content = [{"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:12]}", "name": tool_choice["name"], "input": payload}]
+        stop_reason = "tool_use"
+    else:
+        payload = canned_text(params.get("system", ""), _user_prompt(params.get("messages")))
+        content = [{"type": "text", "text": payload}]
+        stop_reason = "end_turn"
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:12]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "claude-fake"),
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": _estimate_tokens(params.get("messages")), "output_tokens": _estimate_tokens(payload),
+            **_prompt_cache_usage(params.get("messages")),
+        },
+    }
+
+def openai_chat_completion(body: dict) -> dict:
+    """Ответ Chat Completions API на запрос body."""
+    messages = body.get("messages", [])
+    system_prompt = next((m["content"] for m in messages if m.get("role") == "system"), "")
+    response_format = body.get("response_format") or {}
+    json_schema = response_format.get("json_schema") or {}
+    if response_format:
+        _remember_repair(json_schema.get("name"), _user_prompt(messages))
+        payload = canned_payload(json_schema.get("name"), json_schema.get("schema"), system_prompt) or {"result": "ok"}
+        text = json.dumps(payload, ensure_ascii=False)
+    else:
+        payload = text = canned_text(system_prompt, _user_prompt(messages))
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": _estimate_tokens(messages),
+            "completion_tokens": _estimate_tokens(payload),
+            "total_tokens": _estimate_tokens(messages) + _estimate_tokens(payload),
+        },
+    }
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов поддельного API."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if not CONFIG["quiet"]:
+            print(f"[fake-llm] {self.command} {self.path} -> {format % args}")
+
+    def _path(self) -> str:
+        # Anthropic SDK добавляет ?beta=true для beta-эндпоинтов, OpenAI SDK - базовый префикс /v1
+        return urlparse(self.path).path.rstrip("/")
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status: int, body, content_type: str = "application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self._send(404, {"error": {"type": "not_found_error", "message": f"Unknown path {self.path}"}})
+
+    def _start_sse(self):
+        # Длина потока заранее неизвестна - соединение закрывается после последнего события
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _sse(self, data: dict = None, event: str = None, raw: str = None):
+        message = f"event: {event}\n" if event else ""
+        message += f"data: {raw if raw is not None else json.dumps(data, ensure_ascii=False)}\n\n"
+        self.wfile.write(message.encode("utf-8"))
+        self.wfile.flush()
+
+    def _inject_error(self, provider: str) -> bool:
+        """С заданной вероятностью отвечает ошибкой 429 или 5xx в формате провайдера."""
+        roll = random.random()
+        if roll < CONFIG["error_429"]:
+            status, error_type, message = 429, "rate_limit_error", "Rate limit exceeded (injected)"
+            _count("errors_429")
+        elif roll < CONFIG["error_429"] + CONFIG["error_5xx"]:
+            status = random.choice((500, 529) if provider == "anthropic" else (500, 502, 503))
+            error_type = "overloaded_error" if status == 529 else "api_error"
+            message = f"Server error {status} (injected)"
+            _count("errors_5xx")
+        else:
+            return False
+        if provider == "anthropic":
+            body = {"type": "error", "error": {"type": error_type, "message": message}}
+        else:
+            body = {"error": {"message": message, "type": error_type, "code": str(status)}}
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("retry-after", str(CONFIG["retry_after"]))
+        self.end_headers()
+        self.wfile.write(data)
+        return True
+
+    def _serve_completion(self, provider: str, body: dict):
+        """Общая часть Messages/Chat Completions: учет, задержка, внедрение ошибок, выбор формата ответа."""
+        _count("requests")
+        if self._inject_error(provider):
+            return
+        _count("in_flight")
+        try:
+            time.sleep(sample_latency(body.get("model")))
+            if provider == "anthropic":
+                response = anthropic_message(body)
+                stream = self._stream_anthropic
+            else:
+                response = openai_chat_completion(body)
+                stream = self._stream_openai
+            if body.get("stream"):
+                _count("streamed")
+                stream(response, body)
+            else:
+                # Без потока ответ приходит целиком - как будто все фрагменты уже сгенерированы
+                text = json.dumps(response["content"] if provider == "anthropic" else response["choices"], ensure_ascii=False)
+                time.sleep(CONFIG["chunk_delay"] * len(_chunks(text)))
+                self._send(200, response)
+        finally:
+            _count("in_flight", -1)
+
+    def _stream_anthropic(self, message: dict, params: dict):
+        self._start_sse()
+        usage = message["usage"]
+        self._sse({"type": "message_start", "message": {
+            **message, "content": [], "stop_reason": None,
+            "usage": {**usage, "output_tokens": 1},
+        }}, event="message_start")
+        for index, block in enumerate(message["content"]):
+            if block["type"] == "tool_use":
+                start_block = {**block, "input": {}}
+                text, delta_type, delta_key = json.dumps(block["input"], ensure_ascii=False), "input_json_delta", "partial_json"
+            else:
+                start_block = {"type": "text", "text": ""}
+                text, delta_type, delta_key = block["text"], "text_delta", "text"
+            self._sse({"type": "content_block_start", "index": index, "content_block": start_block}, event="content_block_start")
+            for chunk in _chunks(text):
+                self._sse({"type": "content_block_delta", "index": index, "delta": {"type": delta_type, delta_key: chunk}}, event="content_block_delta")
+                time.sleep(CONFIG["chunk_delay"])
+            self._sse({"type": "content_block_stop", "index": index}, event="content_block_stop")
+        self._sse({
+            "type": "message_delta",
+            "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+            "usage": {"output_tokens": usage["output_tokens"]},
+        }, event="message_delta")
+        self._sse({"type": "message_stop"}, event="message_stop")
+
+    def _stream_openai(self, completion: dict, body: dict):
+        self._start_sse()
+        base = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"], "model": completion["model"]}
+        self._sse({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+        for chunk in _chunks(completion["choices"][0]["message"]["content"]):
+            self._sse({**base, "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]})
+            time.sleep(CONFIG["chunk_delay"])
+        self._sse({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._sse({**base, "choices": [], "usage": completion["usage"]})
+        self._sse(raw="[DONE]")
+
+    # --- Маршрутизация ---
+
+    def do_POST(self):
+        path = self._path()
+        body = self._read_body()
+        if path == "/v1/messages":
+            return self._serve_completion("anthropic", json.loads(body))
+        if path == "/v1/chat/completions":
+            return self._serve_completion("openai", json.loads(body))
+        if path == "/v1/messages/batches":
+            return self._anthropic_create_batch(json.loads(body))
+        if path == "/v1/files":
+            return self._openai_upload_file(body)
+        if path == "/v1/batches":
+            return self._openai_create_batch(json.loads(body))
+        self._not_found()
+
+    def do_GET(self):
+        path = self._path()
+        parts = path.split("/")
+        if path == "/stats":
+            with STATE["lock"]:
+                return self._send(200, dict(STATE["stats"]))
+        if path.startswith("/v1/messages/batches/"):
+            if path.endswith("/results"):
+                return self._anthropic_batch_results(parts[-2])
+            return self._anthropic_get_batch(parts[-1])
+        if path.startswith("/v1/batches/"):
+            return self._openai_get_batch(parts[-1])
+        if path.startswith("/v1/files/") and path.endswith("/content"):
+            return self._openai_file_content(parts[-2])
+        self._not_found()
+
+    # --- Anthropic Message Batches ---
+
+    def _anthropic_batch_view(self, batch: dict) -> dict:
+        ended = time.time() >= batch["ready_at"]
+        count = len(batch["requests"])
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else count,
+                "succeeded": count if ended else 0,
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+            "created_at": _iso(batch["created"]),
+            "expires_at": _iso(batch["created"] + 86400),
+            "ended_at": _iso(batch["ready_at"]) if ended else None,
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": f"http://{self.headers.get('Host')}/v1/messages/batches/{batch['id']}/results" if ended else None,
+        }
+
+    def _anthropic_create_batch(self, body: dict):
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:16]}"
+        batch = {"id": batch_id, "requests": body.get("requests", []), "created": time.time(), "ready_at": time.time() + CONFIG["batch_delay"]}
+        with STATE["lock"]:
+            STATE["anthropic_batches"][batch_id] = batch
+        self._send(200, self._anthropic_batch_view(batch))
+
+    def _anthropic_get_batch(self, batch_id: str):
+        batch = STATE["anthropic_batches"].get(batch_id)
+        if not batch:
+            return self._not_found()
+        self._send(200, self._anthropic_batch_view(batch))
+
+    def _anthropic_batch_results(self, batch_id: str):
+        batch = STATE["anthropic_batches"].get(batch_id)
+        if not batch or time.time() < batch["ready_at"]:
+            return self._not_found()
+        lines = [
+            json.dumps({"custom_id": req["custom_id"], "result": {"type": "succeeded", "message": anthropic_message(req["params"])}}, ensure_ascii=False)
+            for req in batch["requests"]
+        ]
+        self._send(200, ("\n".join(lines) + "\n").encode("utf-8"), "application/binary")
+
+    # --- OpenAI Files + Batch ---
+
+    def _openai_upload_file(self, body: bytes):
+        message = BytesParser(policy=policy.default).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8") + body
+        )
+        content, filename, purpose = b"", "upload.jsonl", "batch"
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                content = part.get_payload(decode=True) or b""
+                filename = part.get_filename() or filename
+            elif name == "purpose":
+                purpose = (part.get_payload(decode=True) or b"batch").decode("utf-8")
+        file_id = f"file-{uuid.uuid4().hex[:16]}"
+        with STATE["lock"]:
+            STATE["files"][file_id] = content
+        self._send(200, {
+            "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose, "status": "processed",
+        })
+
+    def _openai_batch_view(self, batch: dict) -> dict:
+        ended = time.time() >= batch["ready_at"]
+        if ended and not batch.get("output_file_id"):
+            lines = []
+            for line in STATE["files"].get(batch["input_file_id"], b"").decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                lines.append(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": openai_chat_completion(request["body"])},
+                    "error": None,
+                }, ensure_ascii=False))
+            output_file_id = f"file-{uuid.uuid4().hex[:16]}"
+            with STATE["lock"]:
+                STATE["files"][output_file_id] = ("\n".join(lines) + "\n").encode("utf-8")
+            batch["output_file_id"] = output_file_id
+            batch["total"] = len(lines)
+        return {
+            "id": batch["id"],
+            "object": "batch",
+            "endpoint": batch["endpoint"],
+            "errors": None,
+            "input_file_id": batch["input_file_id"],
+            "completion_window": "24h",
+            "status": "completed" if ended else "in_progress",
+            "output_file_id": batch.get("output_file_id"),
+            "error_file_id": None,
+            "created_at": int(batch["created"]),
+            "request_counts": {"total": batch.get("total", 0), "completed": batch.get("total", 0), "failed": 0},
+        }
+
+    def _openai_create_batch(self, body: dict):
+        batch_id = f"batch_{uuid.uuid4().hex[:16]}"
+        batch = {
+            "id": batch_id, "endpoint": body.get("endpoint"), "input_file_id": body.get("input_file_id"),
+            "created": time.time(), "ready_at": time.time() + CONFIG["batch_delay"],
+        }
+        with STATE["lock"]:
+            STATE["openai_batches"][batch_id] = batch
+        self._send(200, self._openai_batch_view(batch))
+
+    def _openai_get_batch(self, batch_id: str):
+        batch = STATE["openai_batches"].get(batch_id)
+        if not batch:
+            return self._not_found()
+        self._send(200, self._openai_batch_view(batch))
+
+    def _openai_file_content(self, file_id: str):
+        if file_id not in STATE["files"]:
+            return self._not_found()
+        self._send(200, STATE["files"][file_id], "application/octet-stream")
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """HTTP сервер с очередью соединений, рассчитанной на сотни одновременных запросов."""
+    request_queue_size = 1024
+    daemon_threads = True
+
+def run_server(host: str = "127.0.0.1", port: int = 8765, **config) -> ThreadingHTTPServer:
+    """
+    Создает сервер (запуск - serve_forever, например, в отдельном потоке).
+    Именованные аргументы переопределяют CONFIG (latency_mean, error_429 и т.д.).
+    """
+    CONFIG.update(config)
+    return FakeLLMServer((host, port), FakeLLMHandler)
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Поддельный API провайдеров LLM для локальной проверки")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--batch-delay", type=float, default=CONFIG["batch_delay"], help="Через сколько секунд пакет считается обработанным")
+    parser.add_argument("--latency-dist", choices=("fixed", "uniform", "lognormal"), default=CONFIG["latency_dist"], help="Распределение задержки до первого токена")
+    parser.add_argument("--latency-mean", type=float, default=CONFIG["latency_mean"], help="Средняя задержка, сек")
+    parser.add_argument("--latency-sigma", type=float, default=CONFIG["latency_sigma"], help="Разброс (uniform - доля среднего, lognormal - sigma)")
+    parser.add_argument("--chunk-delay", type=float, default=CONFIG["chunk_delay"], help="Задержка между фрагментами ответа, сек")
+    parser.add_argument("--error-429", type=float, default=CONFIG["error_429"], help="Вероятность ответа 429")
+    parser.add_argument("--error-5xx", type=float, default=CONFIG["error_5xx"], help="Вероятность ответа 5xx")
+    parser.add_argument("--retry-after", type=int, default=CONFIG["retry_after"], help="Заголовок retry-after для 429, сек")
+    parser.add_argument("--partial-rate", type=float, default=CONFIG["partial_rate"], help="Вероятность ответа по схеме без последнего поля")
+    parser.add_argument("--quiet", action="store_true", help="Не выводить журнал запросов")
+    return parser
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    server = run_server(
+        args.host,
+        args.port,
+        batch_delay=args.batch_delay,
+        latency_dist=args.latency_dist,
+        latency_mean=args.latency_mean,
+        latency_sigma=args.latency_sigma,
+        chunk_delay=args.chunk_delay,
+        error_429=args.error_429,
+        error_5xx=args.error_5xx,
+        retry_after=args.retry_after,
+        partial_rate=args.partial_rate,
+        quiet=args.quiet,
+    )
+    print(f"Fake LLM server: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -3,104 +3,216 @@ import pandas as pd
 import time
 from pathlib import Path
 from src.config import settings
-from src.utils import file_utils
-from src.services import ai_service
+from src.utils import file_utils, normalization
+from src.services import ai_service, comparison_service, hedging, token_budget, request_coalescing, telemetry, admission, similarity, tender_digest, export_service
 import json
 import random
 
-def run_single_analysis(tz_file, kp_file, additional_files):
-    """Выполняет анализ одного КП по отношению к ТЗ и доп. файлам с использованием AI."""
+def build_analysis_output(tz_name: str, kp_name: str, kp_summary_data: dict, comparison_result: dict,
+                          preliminary_recommendation: dict, additional_info_analysis: dict = None,
+                          served_models: dict = None) -> dict:
+    """
+    Собирает результат анализа одного КП в формате, который используют отчеты и сравнение.
+    Используется как интерактивным анализом, так и пакетным режимом (batch_service).
+
+    Args:
+        tz_name (str): Имя файла ТЗ.
+        kp_name (str): Имя файла КП.
+        kp_summary_data (dict): Ключевые данные КП (этап summary).
+        comparison_result (dict): Результат сравнения ТЗ и КП (этап comparison).
+        preliminary_recommendation (dict): Предварительная рекомендация (этап recommendation).
+        additional_info_analysis (dict, optional): Анализ дополнительных файлов.
+        served_models (dict, optional): Модели, фактически обслужившие этапы.
+
+    Returns:
+        dict: Результат анализа КП.
+    """
+    # Сравнение одним запросом (пакетный режим) не дает оценок по разделам - показываем общую оценку
+    if "sections" not in comparison_result:
+        comparison_result["sections"] = [{
+            "name": "Документ целиком",
+            "compliance": comparison_result.get("compliance_score", 0),
+            "details": "Оценка по документу целиком, без разбиения ТЗ на разделы.",
+        }]
+
+    # Рейтинги (пока заглушка - случайные значения)
+    base_ratings = {c["id"]: random.randint(3, 9) for c in settings.EVALUATION_CRITERIA}
+
+    # Модифицируем рейтинги с учетом дополнительной информации
+    ratings = base_ratings.copy()
+    if additional_info_analysis and additional_info_analysis.get("rating_impact"):
+        # Поправка по выводам об участнике применяется ко всем рейтингам в пределах шкалы 1-10
+        for key in ratings:
+            ratings[key] = max(1, min(10, ratings[key] + additional_info_analysis["rating_impact"]))
+
+    comments = {} # Пустые комментарии
+
+    pricing = kp_summary_data.get("pricing", "Не указано")
+    timeline = kp_summary_data.get("timeline", "Не указано")
+    return {
+        "tz_name": tz_name,
+        "kp_name": kp_name,
+        "company_name": kp_summary_data.get("company_name", "Не определено"),
+        "tech_stack": kp_summary_data.get("tech_stack", "Не указано"),
+        "pricing": pricing,
+        "timeline": timeline,
+        # Сумма, валюта и длительность разбираются один раз и хранятся вместе с анализом
+        "terms": normalization.normalize_terms(pricing, timeline),
+        "comparison_result": comparison_result,
+        "additional_info_analysis": additional_info_analysis,
+        "preliminary_recommendation": preliminary_recommendation,
+        "ratings": ratings,
+        "comments": comments,
+        "served_models": served_models or {}
+    }
+
+def vendor_additional_info(additional_files: list, digest: dict, names: list):
+    """
+    Выводы дополнительных файлов об участнике (срез дайджеста тендера) или None, если файлов нет.
+    Дайджест составляется здесь, если он не передан (выжимки файлов берутся из хранилища).
+    """
+    if not additional_files:
+        return None
+    if digest is None:
+        with telemetry.span("stage.digest", files=len(additional_files)):
+            digest = tender_digest.build_tender_digest(additional_files)
+    return tender_digest.vendor_slice(digest, names)
+
+def apply_additional_info(result: dict, additional_info_analysis: dict):
+    """
+    Заменяет в повторно использованном результате выводы дополнительных файлов на выводы текущего
+    тендера: поправка прежних выводов снимается с рейтингов, поправка новых применяется
+    (в пределах шкалы 1-10, как в build_analysis_output).
+    """
+    previous = (result.get("additional_info_analysis") or {}).get("rating_impact") or 0
+    current = (additional_info_analysis or {}).get("rating_impact") or 0
+    if previous != current:
+        result["ratings"] = {key: max(1, min(10, value - previous + current)) for key, value in result["ratings"].items()}
+    result["additional_info_analysis"] = additional_info_analysis
+    return result
+
+def find_reusable_match(tz_text: str, kp_text: str, kp_name: str):
+    """
+    Прежний анализ почти совпадающего КП того же участника (similarity.ProposalIndex.find) или None.
+    Почти такой же текст еще не означает ту же компанию: другой участник мог взять чужое КП за основу,
+    а прежний результат содержит название компании и выводы о ней. Поэтому результат используется,
+    только если название компании из прежнего анализа есть в имени файла или в тексте нового КП.
+    """
+    match = similarity.index.find(tz_text, kp_text)
+    if match and tender_digest.vendor_matches(match["result"].get("company_name"), [Path(kp_name).stem, kp_text]):
+        return match
+    return None
+
+def describe_stage_models() -> str:
+    """Краткое описание моделей этапов анализа КП для текущей сессии."""
+    return ", ".join(
+        f"{settings.STAGE_LABELS[stage]} - {ai_service.get_stage_config(stage)['model']}"
+        for stage in ("summary", "comparison", "recommendation")
+    )
+
+def run_single_analysis(tz_file, kp_file, additional_files, digest: dict = None):
+    """
+    Выполняет анализ одного КП по отношению к ТЗ и доп. файлам с использованием AI.
+
+    Args:
+        tz_file (dict): Загруженное ТЗ.
+        kp_file (dict): Загруженное КП.
+        additional_files (list): Дополнительные файлы тендера.
+        digest (dict, optional): Дайджест дополнительных файлов (tender_digest.build_tender_digest),
+            составленный один раз на тендер. Если None, составляется здесь (выжимки файлов берутся из хранилища).
+    """
     
     st.info(f"Анализ КП: {kp_file['original_name']}...")
     
     try:
         # 1. Извлечение текста из файлов
-        tz_text = file_utils.extract_text_from_file(Path(tz_file["file_path"]))
+        with telemetry.span("extraction", kp=kp_file["original_name"]):
+            tz_text = file_utils.extract_text_from_file(Path(tz_file["file_path"]))
+            kp_text = file_utils.extract_text_from_file(Path(kp_file["file_path"]))
         if not tz_text:
             st.error(f"Не удалось извлечь текст из ТЗ: {tz_file['original_name']}")
             return None
-            
-        kp_text = file_utils.extract_text_from_file(Path(kp_file["file_path"]))
         if not kp_text:
             st.error(f"Не удалось извлечь текст из КП: {kp_file['original_name']}")
             return None
+
+        # Почти такое же КП этого участника уже анализировалось по этому ТЗ - используем прежний результат
+        if settings.DEDUP_MODE != "off":
+            match = find_reusable_match(tz_text, kp_text, kp_file["original_name"])
+            if match and (settings.DEDUP_MODE == "auto" or (st.session_state.get("dedup_decisions") or {}).get(kp_file["file_path"])):
+                result = similarity.reuse_result(match, kp_file["original_name"])
+                # Дополнительные файлы у этого тендера свои: выводы об участнике берутся из его дайджеста
+                apply_additional_info(result, vendor_additional_info(
+                    additional_files, digest, [result.get("company_name"), Path(kp_file["original_name"]).stem]
+                ))
+                st.info(similarity.describe_provenance(result))
+                return result
+        full_tz_text, full_kp_text = tz_text, kp_text
         
-        # Ограничение длины текста для экономии токенов (можно настроить)
-        MAX_LEN = 30000 # Примерно 7-8 тыс. токенов
-        if len(tz_text) > MAX_LEN:
-            st.warning(f"Текст ТЗ ({tz_file['original_name']}) слишком длинный, будет обрезан до {MAX_LEN} символов для анализа.")
-            tz_text = tz_text[:MAX_LEN]
-        if len(kp_text) > MAX_LEN:
-             st.warning(f"Текст КП ({kp_file['original_name']}) слишком длинный, будет обрезан до {MAX_LEN} символов для анализа.")
-             kp_text = kp_text[:MAX_LEN]
+        # Обрезка текстов под бюджет токенов каждого этапа (settings.STAGE_TOKEN_BUDGETS).
+        # Токены оцениваются для модели этапа с учетом плотности кириллицы, а не по числу символов.
+        summary_model_id = ai_service.get_stage_config("summary")["model"]
+        model_id = ai_service.get_stage_config("comparison")["model"]
+        # ТЗ не обрезается: оно сравнивается с КП по разделам, каждый раздел укладывается в свою половину бюджета.
+        kp_summary_text, kp_summary_truncated = token_budget.truncate_for_stage(kp_text, "summary", summary_model_id)
+        kp_text, kp_truncated = token_budget.truncate_for_stage(kp_text, "comparison", model_id, share=0.5)
+        if kp_truncated or kp_summary_truncated:
+            st.warning(f"Текст КП ({kp_file['original_name']}) превышает бюджет токенов и будет обрезан для анализа.")
 
         # === Вызов AI сервисов ===
         
         # 2. Извлечение ключевых данных из КП
         st.write(f"- Извлечение ключевых данных из {kp_file['original_name']}...")
-        kp_summary_data = ai_service.extract_kp_summary_data(kp_text)
+        with telemetry.span("stage.summary", kp=kp_file["original_name"]):
+            kp_summary_data = ai_service.extract_kp_summary_data(kp_summary_text)
+        # Запоминаем, какая модель фактически обслужила каждый этап (с учетом резервных)
+        served_models = {"summary": ai_service.get_last_served_model()}
         # Добавляем небольшую задержку для наглядности
         time.sleep(random.uniform(0.5, 1.5))
 
         # 3. Сравнение ТЗ и КП
-        st.write(f"- Сравнение {kp_file['original_name']} с ТЗ...")
-        comparison_result = ai_service.compare_tz_kp(tz_text, kp_text)
-        # Добавляем фиктивные секции на основе общей оценки для демо
-        compliance_score = comparison_result.get("compliance_score", 0)
-        comparison_result["sections"] = [
-            {"name": "Общие требования", "compliance": random.randint(max(0, compliance_score-10), min(100, compliance_score+10)), "details": "(Детали будут добавлены после более глубокого анализа секций)"},
-            {"name": "Функциональные требования", "compliance": random.randint(max(0, compliance_score-15), min(100, compliance_score+5)), "details": "(Детали будут добавлены после более глубокого анализа секций)"},
-            {"name": "Нефункциональные требования", "compliance": random.randint(max(0, compliance_score-20), min(100, compliance_score+15)), "details": "(Детали будут добавлены после более глубокого анализа секций)"},
-        ]
+        st.write(f"- Сравнение {kp_file['original_name']} с ТЗ по разделам...")
+        with telemetry.span("stage.comparison", kp=kp_file["original_name"]):
+            comparison_result = comparison_service.compare_tz_and_kp(tz_text, kp_text)
+        served_models["comparison"] = comparison_service.served_model(comparison_result)
+        cached_sections = sum(section["cached"] for section in comparison_result["sections"])
+        if cached_sections:
+            st.caption(f"Разделов ТЗ: {len(comparison_result['sections'])}, из них без изменений (результат из кеша): {cached_sections}")
         time.sleep(random.uniform(0.5, 1.5))
 
-        # 4. Генерация предварительной рекомендации
+        # 4. Выводы дополнительных файлов об этом участнике (срез общего дайджеста тендера):
+        # в запрос рекомендации идет только этот срез, а не тексты дополнительных файлов
+        additional_info_analysis = vendor_additional_info(
+            additional_files, digest, [kp_summary_data.get("company_name"), Path(kp_file["original_name"]).stem]
+        )
+
+        # 5. Генерация предварительной рекомендации
         st.write(f"- Формирование предварительных выводов по {kp_file['original_name']}...")
-        preliminary_recommendation = ai_service.generate_recommendation(comparison_result, kp_summary_data)
+        with telemetry.span("stage.recommendation", kp=kp_file["original_name"]):
+            preliminary_recommendation = ai_service.generate_recommendation(comparison_result, kp_summary_data, additional_info_analysis)
+        served_models["recommendation"] = ai_service.get_last_served_model()
         time.sleep(random.uniform(0.5, 1.5))
 
-        # 5. Анализ дополнительных файлов (пока заглушка)
-        additional_info_analysis = None
-        if additional_files:
-            st.write(f"- Анализ дополнительных файлов для {kp_file['original_name']}...")
-            # Реализуем анализ дополнительных файлов - это будет влиять на рейтинг
-            additional_info_analysis = {
-                "key_findings": ["Учитываю дополнительную информацию для расчета рейтинга"],
-                "impact": "Дополнительная информация имеет существенное положительное влияние на общую оценку",
-                "rating_impact": 2.0  # Добавляем значимый положительный модификатор к рейтингу (2 из 10)
-            }
-            time.sleep(1)
-
-        # 6. Рейтинги (пока заглушка - случайные значения)
-        base_ratings = {c["id"]: random.randint(3, 9) for c in settings.EVALUATION_CRITERIA}
-        
-        # Модифицируем рейтинги с учетом дополнительной информации
-        ratings = base_ratings.copy()
-        if additional_info_analysis and "rating_impact" in additional_info_analysis:
-            # Применяем модификатор ко всем рейтингам, но с ограничением максимума 10
-            for key in ratings:
-                ratings[key] = min(10, ratings[key] + additional_info_analysis["rating_impact"])
-            st.info(f"Рейтинг скорректирован в большую сторону благодаря дополнительной информации (+{additional_info_analysis['rating_impact']} балла)")
-        
-        comments = {} # Пустые комментарии
+        if additional_info_analysis and additional_info_analysis["rating_impact"]:
+            direction = "в большую" if additional_info_analysis["rating_impact"] > 0 else "в меньшую"
+            st.info(f"Рейтинг скорректирован {direction} сторону по дополнительной информации ({additional_info_analysis['rating_impact']:+.1f} балла)")
         # === Конец вызовов AI сервисов ===
 
         st.success(f"Анализ {kp_file['original_name']} завершен.")
         
         # Формируем итоговый результат для этого КП
-        analysis_output = {
-            "tz_name": tz_file["original_name"],
-            "kp_name": kp_file["original_name"],
-            "company_name": kp_summary_data.get("company_name", "Не определено"),
-            "tech_stack": kp_summary_data.get("tech_stack", "Не указано"),
-            "pricing": kp_summary_data.get("pricing", "Не указано"),
-            "timeline": kp_summary_data.get("timeline", "Не указано"),
-            "comparison_result": comparison_result, 
-            "additional_info_analysis": additional_info_analysis,
-            "preliminary_recommendation": preliminary_recommendation,
-            "ratings": ratings, 
-            "comments": comments
-        }
+        analysis_output = build_analysis_output(
+            tz_file["original_name"],
+            kp_file["original_name"],
+            kp_summary_data,
+            comparison_result,
+            preliminary_recommendation,
+            additional_info_analysis,
+            served_models
+        )
+        # В индекс похожих КП попадают только анализы, все этапы которых получили ответ модели
+        if settings.DEDUP_MODE != "off" and all(served_models.values()):
+            similarity.index.add(full_tz_text, full_kp_text, kp_file["original_name"], analysis_output)
         return analysis_output
         
     except Exception as e:
@@ -109,6 +221,40 @@ def run_single_analysis(tz_file, kp_file, additional_files):
         st.error(traceback.format_exc())
         return None
 
+def find_reusable_analyses(tz_file: dict, kp_files: list) -> list:
+    """
+    Ищет среди загруженных КП почти совпадающие с уже проанализированными по этому ТЗ КП тех же участников.
+
+    Returns:
+        list: Пары (файл КП, найденное совпадение similarity.ProposalIndex.find).
+    """
+    tz_text = file_utils.extract_text_from_file(Path(tz_file["file_path"]))
+    if not tz_text:
+        return []
+    matches = []
+    for kp_file in kp_files:
+        kp_text = file_utils.extract_text_from_file(Path(kp_file["file_path"]))
+        match = find_reusable_match(tz_text, kp_text, kp_file["original_name"]) if kp_text else None
+        if match:
+            matches.append((kp_file, match))
+    return matches
+
+def render_reuse_offer(matches: list):
+    """Предлагает использовать прежние анализы почти совпадающих КП вместо повторного анализа."""
+    st.markdown("#### ♻️ Найдены ранее проанализированные почти одинаковые КП")
+    st.caption("Отмеченные КП не будут анализироваться повторно: в отчет попадет прежний результат с отметкой о происхождении.")
+    decisions = {}
+    for kp_file, match in matches:
+        decisions[kp_file["file_path"]] = st.checkbox(
+            f"{kp_file['original_name']} ≈ {match['kp_name']} (сходство {match['similarity']:.0%}, "
+            f"анализ от {match['analyzed_at'].replace('T', ' ')})",
+            value=True,
+            key=f"dedup_{kp_file['file_path']}"
+        )
+    if st.button("Продолжить анализ", type="primary"):
+        st.session_state.dedup_decisions = decisions
+        st.rerun()
+
 def render_analysis_section():
     """Отображает процесс анализа всех загруженных КП."""
     
@@ -129,16 +275,43 @@ def render_analysis_section():
         # Используем .get() для безопасного получения списка доп. файлов
         additional_files = st.session_state.uploaded_files.get("additional", [])
         
+        # Перед анализом предлагаем использовать прежние результаты почти одинаковых КП
+        if settings.DEDUP_MODE == "offer" and st.session_state.get("dedup_decisions") is None:
+            matches = find_reusable_analyses(tz_file, kp_files)
+            if matches:
+                render_reuse_offer(matches)
+                return
+            st.session_state.dedup_decisions = {}
+
         total_files = len(kp_files)
         st.session_state.all_analysis_results = [] # Очищаем предыдущие результаты
         
+        # Расход токенов, стоимость и задержка копятся по тендеру (ТЗ)
+        tender_id = tz_file["file_path"]
+        token_budget.reset_tender(tender_id)
+        st.session_state.tender_id = tender_id
+        priority = "interactive" if total_files == 1 else "bulk"
+
+        # Дополнительные файлы общие для всех КП - разбираем их один раз до анализа КП
+        digest = None
+        if additional_files:
+            with st.spinner(f"Разбор дополнительных файлов тендера ({len(additional_files)})..."), \
+                    token_budget.tender_scope(tender_id), admission.priority_scope(priority), \
+                    telemetry.span("stage.digest", files=len(additional_files)):
+                digest = tender_digest.build_tender_digest(additional_files)
+            cached_files = sum(item["cached"] for item in digest["files"])
+            st.caption(
+                f"Дайджест дополнительных файлов: {len(digest['files'])} файлов, общих выводов - {len(digest['general_findings'])}, "
+                f"участников упомянуто - {len(digest['vendors'])}" + (f", из кеша - {cached_files}" if cached_files else "")
+            )
+        
         # Стильное отображение информации о старте анализа
         st.markdown(f"""
         <div style='background-color: #f0f7ff; padding: 15px 20px; border-radius: 10px; margin-bottom: 20px; border-left: 4px solid {settings.BRAND_COLORS["primary"]}'>
             <h3 style='margin:0 0 10px 0; color: {settings.BRAND_COLORS["primary"]}; font-size: 1.2rem;'>🤖 Запуск AI-анализа</h3>
             <p style='margin:0; font-size: 0.95rem;'>
                 Анализирую <b>{total_files}</b> коммерческих предложений относительно технического задания.
-                <br>Используемая модель: <b>{st.session_state.selected_model}</b>
+                <br>Используемые модели: <b>{describe_stage_models()}</b>
             </p>
         </div>
         """, unsafe_allow_html=True)
@@ -182,11 +355,14 @@ def render_analysis_section():
             progress_bar.progress(completion_pct)
             
             # Очищаем статус и запускаем анализ одного файла
-            with status_placeholder.container(): 
-                result = run_single_analysis(tz_file, kp_file, additional_files)
+            # Анализ одного КП - интерактивный запрос, пакет КП обслуживается в общей очереди после них
+            with status_placeholder.container(), token_budget.tender_scope(tender_id), admission.priority_scope(priority):
+                result = run_single_analysis(tz_file, kp_file, additional_files, digest)
             
             if result:
                 st.session_state.all_analysis_results.append(result)
+                # История анализов - источник выгрузки результатов (export_service)
+                export_service.append_history([result], tender_id)
             else:
                 st.error(f"Не удалось проанализировать файл: {kp_file['original_name']}. Он будет пропущен.")
                 # Можно добавить логирование или более детальную обработку ошибок
@@ -195,21 +371,38 @@ def render_analysis_section():
         progress_text_ph.empty()
         progress_bar.empty()
         
+        st.session_state.tender_usage = token_budget.get_tender_totals(tender_id)
+        usage = st.session_state.tender_usage
+        
         st.markdown(f"""
         <div style='background-color: #ecfdf5; padding: 15px 20px; border-radius: 10px; margin: 20px 0; border-left: 4px solid #10B981;'>
             <h3 style='margin:0 0 5px 0; color: #065f46; font-size: 1.2rem;'>✅ Анализ успешно завершен</h3>
             <p style='margin:0; font-size: 0.95rem; color: #065f46;'>
                 Проанализировано {total_files} коммерческих предложений.
+                <br>Токены: {usage['input_tokens']:,} вход / {usage['output_tokens']:,} выход, стоимость ≈ ${usage['cost']:.2f}, время моделей {usage['latency']:.0f} с, превышений SLO задержки: {usage['slo_violations']}.
                 <br>Переход к сравнительной таблице...
             </p>
         </div>
         """, unsafe_allow_html=True)
         
+        coalescing_stats = request_coalescing.coalescer.stats()
+        if coalescing_stats["coalesced"]:
+            st.caption(f"Повторных одинаковых запросов объединено: {coalescing_stats['coalesced']} из {coalescing_stats['requests']}")
+
+        if settings.HEDGING_ENABLED:
+            hedge_stats = hedging.policy.stats()
+            st.caption(
+                f"Хеджирование запросов: {hedge_stats['hedged']} из {hedge_stats['requests']} "
+                f"({hedge_stats['hedge_rate']:.0%}), ответ дубликата использован {hedge_stats['hedge_wins']} раз, "
+                f"доп. токенов ≈ {hedge_stats['extra_tokens']}"
+            )
+        
         # Добавляем небольшую задержку для отображения завершения
         time.sleep(1.5)
         
         # Сбрасываем флаг, чтобы анализ не запускался повторно при перезагрузке
         st.session_state.run_full_analysis = False 
+        st.session_state.dedup_decisions = None
         
         # Автоматически переходим к сравнительной таблице
         st.session_state.current_step = "comparison"
@@ -1,21 +1,104 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from src.config import settings
-from src.services import ai_service
+from src.services import ai_service, token_budget, scoring, report_reduce, tournament, export_service
+from src.utils import figure_cache, html_report, normalization, pdf_export, report_stream
 import time
 import json
 from datetime import datetime
 import re
-import base64
-from io import BytesIO
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+import textwrap
+from matplotlib.figure import Figure
 import os
 
+def render_stage_report(usage: dict):
+    """
+    Показывает отчет по этапам анализа: модели, задержка относительно SLO этапа и стоимость
+    в сравнении с выполнением всех этапов на модели, выбранной для анализа КП.
+
+    Args:
+        usage (dict): Итоги тендера (token_budget.get_tender_totals).
+    """
+    baseline_model_id = st.session_state.get("selected_model")
+    report = token_budget.stage_report(usage, baseline_model_id)
+    if not report:
+        st.info("Нет данных о вызовах моделей.")
+        return
+    rows = []
+    for row in report:
+        rows.append({
+            "Этап": settings.STAGE_LABELS.get(row["stage"], row["stage"]),
+            "Модели": ", ".join(f"{model} ({calls})" for model, calls in row["models"].items()),
+            "Вызовы": row["calls"],
+            "Средняя задержка, с": round(row["avg_latency"], 1),
+            "Макс. задержка, с": round(row["max_latency"], 1),
+            "SLO, с": row["latency_slo"],
+            "Превышения SLO": row["slo_violations"],
+            "Токены": row["tokens"],
+            "Стоимость, $": round(row["cost"], 4),
+            f"На {baseline_model_id}, $": round(row["baseline_cost"], 4),
+        })
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    baseline_cost = sum(row["baseline_cost"] for row in report)
+    st.caption(
+        f"Стоимость с моделями по этапам: ${usage['cost']:.2f}; "
+        f"если бы все этапы выполняла {baseline_model_id}: ${baseline_cost:.2f}"
+    )
+
+def strip_code_fences(text):
+    """Удаляет маркеры блока кода, если модель обернула HTML в блок кода"""
+    text = re.sub(r'^```html\s*', '', text)
+    return re.sub(r'\s*```$', '', text)
+
+def clean_report_html(report_html):
+    """Очищает HTML аналитического отчета от маркеров кода и обрамления полного HTML документа"""
+    report_html = strip_code_fences(report_html)
+    # Удаляем DOCTYPE и HTML теги, если модель создала полный HTML документ
+    return re.sub(r'<!DOCTYPE[^>]*>|<html[^>]*>|<head>.*?</head>|<body[^>]*>|</body>|</html>', '', report_html, flags=re.DOTALL)
+
+def stream_report(prompt, system_prompt, model_id, clean, render_section):
+    """
+    Выводит отчет по разделам по мере генерации: законченные разделы выводятся один раз,
+    текущий раздел обновляется не чаще settings.REPORT_STREAM_REFRESH_SEC. После завершения
+    вывод убирается - готовый документ показывает render_comparison_table.
+
+    Args:
+        prompt: Запрос отчета
+        system_prompt: Системная инструкция отчета
+        model_id: Модель отчета
+        clean: Функция очистки накопленного текста перед выводом
+        render_section: Функция вывода законченного раздела
+
+    Returns:
+        str: Полный ответ модели или строка, начинающаяся с "Error:"
+    """
+    slot = st.empty()
+    sections_box, tail_slot = None, None
+    rendered, refreshed_at, text = None, 0.0, ""
+    for text in ai_service.stream_ai_response(prompt, system_prompt, model_id=model_id, stage="comparative_report"):
+        if time.monotonic() - refreshed_at < settings.REPORT_STREAM_REFRESH_SEC:
+            continue
+        refreshed_at = time.monotonic()
+        sections, tail = report_stream.split_sections(clean(text))
+        if rendered is None or sections[:len(rendered)] != rendered:
+            # Первый вывод или ответ начался заново (резервная модель) - выведенные разделы заменяются
+            with slot.container():
+                sections_box = st.container()
+                tail_slot = st.empty()
+            rendered = []
+        with sections_box:
+            for section in sections[len(rendered):]:
+                render_section(section)
+        rendered = sections
+        tail_slot.markdown(report_stream.strip_figures(tail) + " ▌", unsafe_allow_html=True)
+    slot.empty()
+    return text
+
 def compare_all_proposals(analysis_results):
     """
     Создает сравнительный анализ всех КП между собой, 
@@ -62,39 +145,61 @@ def compare_all_proposals(analysis_results):
         "Используй Markdown для форматирования. Помни, что это итоговый документ для принятия решения."
     )
     
-    # Формируем запрос с описанием всех компаний
-    prompt = "# Данные для сравнительного анализа КП\n\n"
-    
+    # Данные каждой компании - отдельный блок запроса
+    blocks = []
     for i, comp in enumerate(companies_data, 1):
-        prompt += f"## Компания {i}: {comp['company_name']}\n"
-        prompt += f"* Соответствие ТЗ: {comp['compliance_score']}%\n"
-        prompt += f"* Технологический стек: {comp['tech_stack']}\n"
-        prompt += f"* Стоимость: {comp['pricing']}\n"
-        prompt += f"* Сроки реализации: {comp['timeline']}\n"
-        prompt += f"* Пропущенные требования: {comp['missing_count']} шт\n"
-        prompt += f"* Дополнительные функции: {comp['additional_count']} шт\n"
+        block = f"## Компания {i}: {comp['company_name']}\n"
+        block += f"* Соответствие ТЗ: {comp['compliance_score']}%\n"
+        block += f"* Технологический стек: {comp['tech_stack']}\n"
+        block += f"* Стоимость: {comp['pricing']}\n"
+        block += f"* Сроки реализации: {comp['timeline']}\n"
+        block += f"* Пропущенные требования: {comp['missing_count']} шт\n"
+        block += f"* Дополнительные функции: {comp['additional_count']} шт\n"
         
-        prompt += "* Сильные стороны:\n"
+        block += "* Сильные стороны:\n"
         for s in comp['strengths']:
-            prompt += f"  - {s}\n"
+            block += f"  - {s}\n"
         
-        prompt += "* Слабые стороны:\n"
+        block += "* Слабые стороны:\n"
         for w in comp['weaknesses']:
-            prompt += f"  - {w}\n"
+            block += f"  - {w}\n"
         
-        prompt += "\n"
+        blocks.append(block + "\n")
     
-    # Используем модель для сравнения КП из session_state
-    # Здесь используем именно selected_comparison_model, а не selected_model
-    comparison_model_id = st.session_state.get("selected_comparison_model")
+    # Модель этапа сравнительного отчета (при выключенном подборе по этапам - selected_comparison_model)
+    comparison_model_id = ai_service.get_stage_config("comparative_report")["model"]
+    # Готовый отчет по тем же данным и модели берется из кеша без обращения к модели
+    report_key = figure_cache.data_key("comparative", comparison_model_id, system_prompt, blocks)
+    cached_report = report_stream.get_cached(report_key)
+    if cached_report is not None:
+        return cached_report
     
     try:
-        st.info(f"Формируем сравнительный анализ КП с использованием модели {comparison_model_id}...")
-        comparison_html = ai_service.get_ai_response(prompt, system_prompt, model_id=comparison_model_id)
+        info = st.empty()
+        info.info(f"Формируем сравнительный анализ КП с использованием модели {comparison_model_id}...")
+        # Расход на отчет учитывается в итогах того же тендера, что и анализ КП
+        tender_id = st.session_state.get("tender_id")
+        with token_budget.tender_scope(tender_id):
+            # Для большого тендера запрос собирается из шорт-листа и сводок групп КП
+            prompt, prompt_info = report_reduce.build_report_prompt(
+                "# Данные для сравнительного анализа КП\n\n", blocks,
+                scoring.score_results(analysis_results)["overall"].tolist(), comparison_model_id
+            )
+            if report_reduce.describe_mode(prompt_info):
+                st.caption(report_reduce.describe_mode(prompt_info))
+            # Отчет выводится по разделам по мере генерации
+            comparison_html = stream_report(
+                prompt, system_prompt, comparison_model_id, strip_code_fences,
+                lambda section: st.markdown(section, unsafe_allow_html=True)
+            )
+        info.empty()
+        if tender_id:
+            st.session_state.tender_usage = token_budget.get_tender_totals(tender_id)
+        if comparison_html.startswith("Error:"):
+            return comparison_html
         
         # Удаляем маркеры кода, если модель обернула HTML в блок кода
-        comparison_html = re.sub(r'^```html\s*', '', comparison_html)
-        comparison_html = re.sub(r'\s*```$', '', comparison_html)
+        comparison_html = strip_code_fences(comparison_html)
         
         # Проверяем, является ли ответ валидным HTML
         if not comparison_html.strip().startswith("<"):
@@ -105,77 +210,106 @@ def compare_all_proposals(analysis_results):
             </div>
             """
         
+        report_stream.store(report_key, comparison_html)
         return comparison_html
     except Exception as e:
         st.error(f"Ошибка при формировании сравнительного анализа: {e}")
         return "Не удалось сформировать сравнительный анализ. Пожалуйста, попробуйте еще раз или выберите другую модель."
 
-def create_visualization_html(vis_type, comparative_data):
+def select_visualization_builder(vis_type):
     """
-    Создает HTML-код с интерактивной визуализацией Plotly
-    
-    Args:
-        vis_type: Тип визуализации (например, 'Стоимость предложений')
-        comparative_data: Данные для визуализации
-        
-    Returns:
-        str: HTML-код с внедренной визуализацией
+    Выбирает построитель графика по названию визуализации из отчета
+    (например, 'Стоимость предложений' -> create_price_visualization).
     """
-    if "стоимость" in vis_type.lower() or "цен" in vis_type.lower() or "финанс" in vis_type.lower():
+    vis_type = vis_type.lower()
+    if "стоимость" in vis_type or "цен" in vis_type or "финанс" in vis_type:
         # Визуализация стоимости
-        fig = create_price_visualization(comparative_data)
-    elif "срок" in vis_type.lower() or "время" in vis_type.lower() or "реализац" in vis_type.lower():
+        return create_price_visualization
+    if "срок" in vis_type or "время" in vis_type or "реализац" in vis_type:
         # Визуализация сроков
-        fig = create_timeline_visualization(comparative_data)
-    elif "соответств" in vis_type.lower() or "требован" in vis_type.lower() or "техн" in vis_type.lower():
+        return create_timeline_visualization
+    if "соответств" in vis_type or "требован" in vis_type or "техн" in vis_type:
         # Визуализация соответствия требованиям
-        fig = create_compliance_visualization(comparative_data)
-    elif "рейтинг" in vis_type.lower() or "оценк" in vis_type.lower() or "сравнен" in vis_type.lower():
+        return create_compliance_visualization
+    if "рейтинг" in vis_type or "оценк" in vis_type or "сравнен" in vis_type:
         # Визуализация сравнения рейтингов
-        fig = create_rating_visualization(comparative_data)
-    elif "риск" in vis_type.lower() or "недостатк" in vis_type.lower():
+        return create_rating_visualization
+    if "риск" in vis_type or "недостатк" in vis_type:
         # Визуализация рисков
-        fig = create_risk_visualization(comparative_data)
-    else:
-        # Общий случай - сводная визуализация
-        fig = create_summary_visualization(comparative_data)
-    
-    # Конвертируем график в HTML
-    config = {'displayModeBar': False, 'staticPlot': False, 'responsive': True}
-    plot_html = fig.to_html(full_html=False, include_plotlyjs='cdn', config=config)
-    
-    # Оборачиваем в контейнер для стилизации
-    return f"""
-    <div class="visualization-container">
-        <h4 class="visualization-title">{vis_type}</h4>
-        {plot_html}
-    </div>
+        return create_risk_visualization
+    # Общий случай - сводная визуализация
+    return create_summary_visualization
+
+def create_visualization_html(vis_type, comparative_data, include_static=None):
     """
+    Создает HTML-фрагмент с интерактивной визуализацией Plotly для автономного отчета
+    (html_report.build_document встраивает plotly.js в документ один раз).
+    
+    Args:
+        vis_type: Тип визуализации (например, 'Стоимость предложений')
+        comparative_data: Данные для визуализации
+        include_static: Добавить SVG-версию графика для печати (по умолчанию settings.HTML_REPORT_STATIC_SVG)
+        
+    Returns:
+        str: HTML-фрагмент с графиком
+    """
+    fig = select_visualization_builder(vis_type)(comparative_data)
+    return html_report.figure_block(fig, vis_type or None, include_static)
+
+@figure_cache.memoize_figure
+def create_overview_visualization(comparative_data):
+    """Создает сводный график соответствия ТЗ и рейтинга (нормированного до 100) по компаниям"""
+    # Для более компактного отображения, сокращаем длинные названия компаний
+    companies = [data["vendor_name"][:20] + '...' if len(data["vendor_name"]) > 20 else data["vendor_name"] for data in comparative_data]
+    summary_data_melted = pd.DataFrame({
+        "Название компании": companies * 2,
+        "Показатель": ["Соответствие (%)"] * len(companies) + ["Рейтинг (норм. до 100)"] * len(companies),
+        "Значение": [data["compliance_score"] for data in comparative_data] + [data["avg_rating"] * 10 for data in comparative_data],
+    })
 
+    fig = px.bar(
+        summary_data_melted, 
+        x="Название компании", 
+        y="Значение", 
+        color="Показатель",
+        barmode="group",
+        height=350, # Уменьшаем высоту графика для компактности
+        color_discrete_map={
+            "Соответствие (%)": settings.BRAND_COLORS["primary"],
+            "Рейтинг (норм. до 100)": settings.BRAND_COLORS["accent"]
+        }
+    )
+    
+    fig.update_layout(
+        xaxis_title="Компания",
+        yaxis_title="Оценка (0-100)",
+        legend_title="Показатель",
+        yaxis=dict(range=[0, 100]),
+        plot_bgcolor="rgba(0,0,0,0)",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        margin=dict(l=40, r=40, t=40, b=80)  # Компактные отступы
+    )
+    
+    return fig
+
+@figure_cache.memoize_figure
 def create_price_visualization(comparative_data):
     """Создает визуализацию сравнения стоимости предложений"""
-    # Подготавливаем данные
-    companies = [data["vendor_name"] for data in comparative_data]
-    prices = []
-    price_labels = []
-    
-    for data in comparative_data:
-        price_text = data["pricing"]
-        price = extract_price_value(price_text)
-        if price > 0:
-            prices.append(price)
-            price_labels.append(data["vendor_name"])
+    # Суммы в разных валютах и ставки за разные периоды несопоставимы: на графике только
+    # самая многочисленная группа, остальные КП перечисляются под графиком
+    unit, priced, excluded = normalization.comparable_prices(comparative_data)
     
     # Сортируем по возрастанию цены
-    sorted_data = sorted(zip(price_labels, prices), key=lambda x: x[1])
-    companies_sorted = [item[0] for item in sorted_data]
-    prices_sorted = [item[1] for item in sorted_data]
+    sorted_data = sorted(priced, key=lambda data: data["price_amount"])
+    companies_sorted = [data["vendor_name"] for data in sorted_data]
+    prices_sorted = [data["price_amount"] for data in sorted_data]
+    price_title = f"Стоимость, {unit}" if unit else "Стоимость"
     
     # Создаем визуализацию с Plotly
     fig = px.bar(
         x=companies_sorted, 
         y=prices_sorted,
-        labels={'x': 'Компания', 'y': 'Стоимость'},
+        labels={'x': 'Компания', 'y': price_title},
         title='Сравнение стоимости предложений',
         color_discrete_sequence=[settings.BRAND_COLORS["primary"]]
     )
@@ -186,7 +320,7 @@ def create_price_visualization(comparative_data):
     
     fig.update_layout(
         xaxis_title="Компания",
-        yaxis_title="Стоимость",
+        yaxis_title=price_title,
         xaxis_tickangle=-45,
         height=400,
         margin=dict(l=40, r=20, t=40, b=80),
@@ -196,20 +330,22 @@ def create_price_visualization(comparative_data):
     
     fig.update_traces(texttemplate='%{y:' + price_format + '}', textposition='outside')
     
+    if excluded:
+        note = "; ".join(f"{data['vendor_name']} ({reason})" for data, reason in excluded)
+        fig.add_annotation(
+            text=f"Не показаны: {note}", xref="paper", yref="paper", x=0, y=-0.45,
+            showarrow=False, xanchor="left", font=dict(size=11, color="gray"),
+        )
+        fig.update_layout(height=440, margin=dict(l=40, r=20, t=40, b=120))
+    
     return fig
 
+@figure_cache.memoize_figure
 def create_timeline_visualization(comparative_data):
     """Создает визуализацию сравнения сроков реализации"""
-    # Подготавливаем данные
-    companies = []
-    timelines = []
-    
-    for data in comparative_data:
-        timeline_text = data["timeline"]
-        days = extract_timeline_days(timeline_text)
-        if days > 0:
-            timelines.append(days)
-            companies.append(data["vendor_name"])
+    # Подготавливаем данные (КП без распознанного срока не показываются)
+    companies = [data["vendor_name"] for data in comparative_data if data.get("timeline_days")]
+    timelines = [data["timeline_days"] for data in comparative_data if data.get("timeline_days")]
     
     # Сортируем по возрастанию сроков
     sorted_data = sorted(zip(companies, timelines), key=lambda x: x[1])
@@ -239,6 +375,7 @@ def create_timeline_visualization(comparative_data):
     
     return fig
 
+@figure_cache.memoize_figure
 def create_compliance_visualization(comparative_data):
     """Создает визуализацию соответствия требованиям и технических решений"""
     # Подготавливаем данные
@@ -313,40 +450,33 @@ def create_compliance_visualization(comparative_data):
     
     return fig
 
+@figure_cache.memoize_figure
 def create_rating_visualization(comparative_data):
     """Создает визуализацию рейтингов КП"""
-    # Подготавливаем данные
-    companies = [data["vendor_name"] for data in comparative_data]
-    compliance = [data["compliance_score"] for data in comparative_data]
-    ratings = [data["avg_rating"] * 10 for data in comparative_data]  # переводим в шкалу 0-100
-    
-    # Добавляем индикатор наличия дополнительной информации
-    has_additional_info = [data.get("has_additional_info", False) for data in comparative_data]
-    
-    # Расчет общего рейтинга с учетом дополнительной информации (если есть)
-    overall = [(data["avg_rating"] * 10 + data["compliance_score"]) / 2 for data in comparative_data]
-    
-    # Сортируем по убыванию общего рейтинга
-    sorted_indices = sorted(range(len(overall)), key=lambda k: overall[k], reverse=True)
-    companies_sorted = [companies[i] for i in sorted_indices]
-    compliance_sorted = [compliance[i] for i in sorted_indices]
-    ratings_sorted = [ratings[i] for i in sorted_indices]
-    overall_sorted = [overall[i] for i in sorted_indices]
-    has_additional_info_sorted = [has_additional_info[i] for i in sorted_indices]
+    # Общий рейтинг уже рассчитан (scoring.score_results) - только сортируем по нему
+    frame = pd.DataFrame(comparative_data).sort_values("overall_score", ascending=False, kind="stable")
+    companies_sorted = frame["vendor_name"].tolist()
+    compliance_sorted = frame["compliance_score"].tolist()
+    ratings_sorted = (frame["avg_rating"] * 10).tolist()  # переводим в шкалу 0-100
+    overall_sorted = frame["overall_score"].tolist()
+    # Индикатор наличия дополнительной информации
+    has_additional_info_sorted = frame["has_additional_info"].tolist()
     
     # Создаем визуализацию
     fig = go.Figure()
     
     # Добавляем линии для порогов рекомендаций
+    recommend_threshold = settings.SCORING_THRESHOLDS["recommend"]
+    conditional_threshold = settings.SCORING_THRESHOLDS["conditional"]
     fig.add_shape(
         type="line",
-        x0=-0.5, y0=75, x1=len(companies_sorted)-0.5, y1=75,
+        x0=-0.5, y0=recommend_threshold, x1=len(companies_sorted)-0.5, y1=recommend_threshold,
         line=dict(color="green", width=1, dash="dash"),
     )
     
     fig.add_shape(
         type="line",
-        x0=-0.5, y0=60, x1=len(companies_sorted)-0.5, y1=60,
+        x0=-0.5, y0=conditional_threshold, x1=len(companies_sorted)-0.5, y1=conditional_threshold,
         line=dict(color="orange", width=1, dash="dash"),
     )
     
@@ -403,7 +533,7 @@ def create_rating_visualization(comparative_data):
         legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
         annotations=[
             dict(
-                x=len(companies_sorted)-1, y=75,
+                x=len(companies_sorted)-1, y=recommend_threshold,
                 xref="x", yref="y",
                 text="Рекомендуется",
                 showarrow=False,
@@ -411,7 +541,7 @@ def create_rating_visualization(comparative_data):
                 xanchor="right", yanchor="bottom"
             ),
             dict(
-                x=len(companies_sorted)-1, y=60,
+                x=len(companies_sorted)-1, y=conditional_threshold,
                 xref="x", yref="y",
                 text="Требует доработки",
                 showarrow=False,
@@ -423,6 +553,7 @@ def create_rating_visualization(comparative_data):
     
     return fig
 
+@figure_cache.memoize_figure
 def create_risk_visualization(comparative_data):
     """Создает визуализацию рисков по предложениям"""
     # Подготавливаем данные
@@ -525,19 +656,13 @@ def create_risk_visualization(comparative_data):
     
     return fig
 
+@figure_cache.memoize_figure
 def create_summary_visualization(comparative_data):
     """Создает сводную визуализацию с основными показателями КП"""
-    # Подготавливаем данные
-    companies = [data["vendor_name"] for data in comparative_data]
-    
-    # Рассчитываем общий рейтинг
-    overall_scores = [(data["avg_rating"] * 10 + data["compliance_score"]) / 2 for data in comparative_data]
-    
-    # Сортируем по убыванию общего рейтинга
-    sorted_data = sorted(zip(companies, overall_scores, comparative_data), key=lambda x: x[1], reverse=True)
-    companies_sorted = [item[0] for item in sorted_data]
-    scores_sorted = [item[1] for item in sorted_data]
-    data_sorted = [item[2] for item in sorted_data]
+    # Сортируем по убыванию общего рейтинга (рассчитан в scoring.score_results)
+    data_sorted = sorted(comparative_data, key=lambda data: data["overall_score"], reverse=True)
+    companies_sorted = [data["vendor_name"] for data in data_sorted]
+    scores_sorted = [data["overall_score"] for data in data_sorted]
     
     # Создаем таблицу с основными показателями
     fig = go.Figure(data=[go.Table(
@@ -572,6 +697,50 @@ def create_summary_visualization(comparative_data):
     
     return fig
 
+def build_comparative_data(analysis_results):
+    """
+    Готовит данные КП для аналитического отчета и графиков: показатели анализа
+    и оценки из общей таблицы scoring.
+
+    Args:
+        analysis_results: Список с результатами анализа всех КП
+
+    Returns:
+        list: Словари vendor_name, compliance_score, pricing, timeline, price_amount, currency, timeline_days,
+        avg_rating, overall_score, recommendation и др.
+    """
+    comparative_data = []
+    scores = scoring.score_results(analysis_results)
+    terms = normalization.terms_frame(analysis_results)
+    recommendation_labels = {
+        "recommend": "Рекомендовать к принятию",
+        "conditional": "Рекомендовать к доработке",
+        "reject": "Рекомендовать к отклонению",
+    }
+    
+    for analysis, score, term in zip(analysis_results, scores.itertuples(index=False), terms.itertuples(index=False)):
+        comparative_data.append({
+            "vendor_name": score.company_name,
+            "compliance_score": analysis["comparison_result"]["compliance_score"],
+            "tech_stack": analysis.get("tech_stack", "Не указан"),
+            "pricing": analysis.get("pricing", "Не указана"),
+            "timeline": analysis.get("timeline", "Не указаны"),
+            # Нормализованные условия (None - значение не найдено в описании)
+            "price_amount": None if pd.isna(term.price_amount) else float(term.price_amount),
+            "currency": None if pd.isna(term.currency) else term.currency,
+            "price_period": None if pd.isna(term.price_period) else term.price_period,
+            "timeline_days": None if pd.isna(term.timeline_days) else int(term.timeline_days),
+            "missing_requirements": analysis["comparison_result"]["missing_requirements"],
+            "additional_features": analysis["comparison_result"]["additional_features"],
+            "strengths": analysis["preliminary_recommendation"]["strength"],
+            "weaknesses": analysis["preliminary_recommendation"]["weakness"],
+            "avg_rating": float(score.rating),
+            "recommendation": recommendation_labels[score.level],
+            "overall_score": float(score.overall),
+            "has_additional_info": bool(score.has_additional_info)
+        })
+    return comparative_data
+
 def generate_analytical_report(analysis_results):
     """
     Генерирует профессиональный аналитический отчет по сравнению всех КП
@@ -590,46 +759,7 @@ def generate_analytical_report(analysis_results):
         return "Недостаточно КП для сравнительного анализа. Загрузите хотя бы 2 КП."
     
     # Подготавливаем данные для запроса к модели
-    comparative_data = []
-    
-    for analysis in analysis_results:
-        company_name = analysis.get("company_name", analysis["kp_name"])
-        compliance_score = analysis["comparison_result"]["compliance_score"]
-        missing_count = len(analysis["comparison_result"]["missing_requirements"])
-        additional_count = len(analysis["comparison_result"]["additional_features"])
-        
-        # Рассчитываем среднюю оценку
-        ratings = analysis.get("ratings", {})
-        avg_rating = sum(ratings.values()) / len(ratings) if ratings else 0
-        
-        # Проверяем наличие дополнительной информации
-        has_additional_info = analysis.get("additional_info_analysis") is not None
-        
-        # Определяем рекомендацию
-        overall_score = (avg_rating * 10 + compliance_score) / 2
-        if overall_score >= 75:
-            recommendation = "Рекомендовать к принятию"
-        elif overall_score >= 60:
-            recommendation = "Рекомендовать к доработке"
-        else:
-            recommendation = "Рекомендовать к отклонению"
-        
-        vendor_data = {
-            "vendor_name": company_name,
-            "compliance_score": compliance_score,
-            "tech_stack": analysis.get("tech_stack", "Не указан"),
-            "pricing": analysis.get("pricing", "Не указана"),
-            "timeline": analysis.get("timeline", "Не указаны"),
-            "missing_requirements": analysis["comparison_result"]["missing_requirements"],
-            "additional_features": analysis["comparison_result"]["additional_features"],
-            "strengths": analysis["preliminary_recommendation"]["strength"],
-            "weaknesses": analysis["preliminary_recommendation"]["weakness"],
-            "avg_rating": avg_rating,
-            "recommendation": recommendation,
-            "overall_score": overall_score,
-            "has_additional_info": has_additional_info
-        }
-        comparative_data.append(vendor_data)
+    comparative_data = build_comparative_data(analysis_results)
     
     # Формируем системный промпт для аналитического отчета
     system_prompt = r"""
@@ -677,58 +807,90 @@ def generate_analytical_report(analysis_results):
     <p>Отчет сгенерирован системой Devent Tender Analysis AI | Дата формирования: ТЕКУЩАЯ_ДАТА</p>\
     """
     
-    # Формируем запрос с данными всех КП
-    prompt = "# Данные для аналитического отчета по КП\n\n"
-    
+    # Данные каждой компании - отдельный блок запроса
+    blocks = []
     for i, vendor in enumerate(comparative_data, 1):
-        prompt += f"## Компания {i}: {vendor['vendor_name']}\n"
-        prompt += f"* Общий рейтинг: {vendor['overall_score']:.1f}/100\n"
-        prompt += f"* Соответствие ТЗ: {vendor['compliance_score']}%\n"
-        prompt += f"* Технологический стек: {vendor['tech_stack']}\n"
-        prompt += f"* Стоимость: {vendor['pricing']}\n"
-        prompt += f"* Сроки реализации: {vendor['timeline']}\n"
-        prompt += f"* Пропущенные требования: {len(vendor['missing_requirements'])} шт\n"
+        block = f"## Компания {i}: {vendor['vendor_name']}\n"
+        block += f"* Общий рейтинг: {vendor['overall_score']:.1f}/100\n"
+        block += f"* Соответствие ТЗ: {vendor['compliance_score']}%\n"
+        block += f"* Технологический стек: {vendor['tech_stack']}\n"
+        block += f"* Стоимость: {vendor['pricing']}\n"
+        block += f"* Сроки реализации: {vendor['timeline']}\n"
+        block += f"* Пропущенные требования: {len(vendor['missing_requirements'])} шт\n"
         if len(vendor['missing_requirements']) > 0:
-            prompt += "  - " + "\n  - ".join(vendor['missing_requirements'][:3])
+            block += "  - " + "\n  - ".join(vendor['missing_requirements'][:3])
             if len(vendor['missing_requirements']) > 3:
-                prompt += f"\n  - ... и еще {len(vendor['missing_requirements']) - 3} требований"
-            prompt += "\n"
+                block += f"\n  - ... и еще {len(vendor['missing_requirements']) - 3} требований"
+            block += "\n"
         
-        prompt += f"* Дополнительные функции: {len(vendor['additional_features'])} шт\n"
+        block += f"* Дополнительные функции: {len(vendor['additional_features'])} шт\n"
         if len(vendor['additional_features']) > 0:
-            prompt += "  - " + "\n  - ".join(vendor['additional_features'][:3])
+            block += "  - " + "\n  - ".join(vendor['additional_features'][:3])
             if len(vendor['additional_features']) > 3:
-                prompt += f"\n  - ... и еще {len(vendor['additional_features']) - 3} функций"
-            prompt += "\n"
+                block += f"\n  - ... и еще {len(vendor['additional_features']) - 3} функций"
+            block += "\n"
         
-        prompt += "* Сильные стороны:\n"
+        block += "* Сильные стороны:\n"
         for s in vendor['strengths']:
-            prompt += f"  - {s}\n"
+            block += f"  - {s}\n"
         
-        prompt += "* Слабые стороны:\n"
+        block += "* Слабые стороны:\n"
         for w in vendor['weaknesses']:
-            prompt += f"  - {w}\n"
+            block += f"  - {w}\n"
         
-        prompt += f"* Рекомендация: {vendor['recommendation']}\n\n"
-    
-    # Используем модель для сравнения КП из session_state
-    comparison_model_id = st.session_state.get("selected_comparison_model")
+        block += f"* Рекомендация: {vendor['recommendation']}\n\n"
+        blocks.append(block)
+    
+    # Модель этапа сравнительного отчета (при выключенном подборе по этапам - selected_comparison_model)
+    comparison_model_id = ai_service.get_stage_config("comparative_report")["model"]
+    # Готовый отчет по тем же данным и модели берется из кеша без обращения к модели
+    report_key = figure_cache.data_key("analytical", comparison_model_id, system_prompt, blocks)
+    cached_report = report_stream.get_cached(report_key)
+    if cached_report is not None:
+        return cached_report
+
+    # Графики строятся по мере готовности разделов с плейсхолдерами [VISUALIZATION: Название];
+    # на графиках - лучшие КП по общей оценке (больше settings.COMPARISON_CHART_MAX_N на графике не читается)
+    chart_data = sorted(comparative_data, key=lambda vendor: vendor["overall_score"], reverse=True)[:settings.COMPARISON_CHART_MAX_N]
+    fragments = {}
+
+    def render_section(section):
+        for kind, value in report_stream.split_figures(section):
+            if kind == "text":
+                if value.strip():
+                    st.markdown(value, unsafe_allow_html=True)
+            elif value not in fragments:
+                st.plotly_chart(select_visualization_builder(value)(chart_data), use_container_width=True)
+                fragments[value] = create_visualization_html(value, chart_data)
     
     try:
-        st.info(f"Формируем аналитический отчет с использованием модели {comparison_model_id}...")
-        report_html = ai_service.get_ai_response(prompt, system_prompt, model_id=comparison_model_id)
+        info = st.empty()
+        info.info(f"Формируем аналитический отчет с использованием модели {comparison_model_id}...")
+        # Расход на отчет учитывается в итогах того же тендера, что и анализ КП
+        tender_id = st.session_state.get("tender_id")
+        with token_budget.tender_scope(tender_id):
+            # Для большого тендера запрос собирается из шорт-листа и сводок групп КП
+            prompt, prompt_info = report_reduce.build_report_prompt(
+                "# Данные для аналитического отчета по КП\n\n", blocks,
+                [vendor["overall_score"] for vendor in comparative_data], comparison_model_id
+            )
+            if report_reduce.describe_mode(prompt_info):
+                st.caption(report_reduce.describe_mode(prompt_info))
+            # Отчет выводится по разделам по мере генерации, графики строятся по мере готовности разделов
+            report_html = stream_report(prompt, system_prompt, comparison_model_id, clean_report_html, render_section)
+        info.empty()
+        if tender_id:
+            st.session_state.tender_usage = token_budget.get_tender_totals(tender_id)
+        if report_html.startswith("Error:"):
+            return report_html
         
         # Очищаем ответ от некорректных \u escape-последовательностей
         # Заменяем \u (если за ним не идут 4 hex-символа) на \\u
         # Исправленный шаблон: r'\\u(...)' вместо r'\u(...)'
         report_html = re.sub(r'\\u(?![0-9a-fA-F]{4})', r'\\u', report_html)
         
-        # Удаляем маркеры кода, если модель обернула HTML в блок кода
-        report_html = re.sub(r'^```html\s*', '', report_html)
-        report_html = re.sub(r'\s*```$', '', report_html)
-        
-        # Удаляем DOCTYPE и HTML теги, если модель создала полный HTML документ
-        report_html = re.sub(r'<!DOCTYPE[^>]*>|<html[^>]*>|<head>.*?</head>|<body[^>]*>|</body>|</html>', '', report_html, flags=re.DOTALL)
+        # Удаляем маркеры кода и обрамление полного HTML документа
+        report_html = clean_report_html(report_html)
         
         # Проверяем, является ли ответ валидным HTML
         if not report_html.strip().startswith("<"):
@@ -814,41 +976,15 @@ def generate_analytical_report(analysis_results):
                 font-size: 14px;
                 text-align: center;
             }
-            .vis-placeholder {
-                padding: 20px;
-                margin: 16px 0;
-                background-color: #f8f9fa;
-                border: 1px dashed #ced4da;
-                text-align: center;
-                color: #6c757d;
-                font-style: italic;
-                border-radius: 8px;
-            }
         </style>
         """
 
-        # Определяем текст заглушки
-        placeholder_text = "<div class='vis-placeholder'>[Визуализация будет доступна позже]</div>"
-        placeholder_text_named = "<div class='vis-placeholder'>[Визуализация '{vis_name}' будет доступна позже]</div>"
-
-        # Удаляем код автоматической вставки визуализаций
-        # report_html = re.sub(r'(<h2>3\. Анализ финансовых предложений</h2>.*?)(<h2>|$)', r'\\1' + price_vis + r'\\2', report_html, flags=re.DOTALL)
-        # report_html = re.sub(r'(<h2>4\. Сравнение сроков реализации</h2>.*?)(<h2>|$)', r'\\1' + timeline_vis + r'\\2', report_html, flags=re.DOTALL)
-        # report_html = re.sub(r'(<h2>5\. Сравнение технических решений.*?</h2>.*?)(<h2>|$)', r'\\1' + compliance_vis + r'\\2', report_html, flags=re.DOTALL)
-
-
-        # Заменяем [VISUALIZATION: Name] на заглушку
-        report_html = re.sub(r'\\[VISUALIZATION:?\\s*(.*?)\\]', lambda m: placeholder_text_named.format(vis_name=m.group(1).strip()), report_html)
-
-        # Заменяем [VISUALIZATION] на заглушку
-        report_html = re.sub(r'\\[VISUALIZATION\\]', placeholder_text, report_html)
-
-        # Заменяем <div class="visual">...</div> на заглушку
-        report_html = re.sub(r'<div class="visual">.*?</div>', placeholder_text, report_html, flags=re.DOTALL | re.IGNORECASE)
-
-        # Оборачиваем отчет стилями, но НЕ добавляем div container в начало
-        # Просто встраиваем CSS стили перед содержимым
-        report_html = f"{css_styles}{report_html}"
+        # Заменяем плейсхолдеры графиками: готовые при выводе разделов берутся как есть,
+        # остальные строятся параллельно (без обращения к CDN)
+        report_html = html_report.resolve_placeholders(
+            report_html, lambda vis_name: fragments.get(vis_name) or create_visualization_html(vis_name, chart_data)
+        )
+        report_html = report_html.replace("ТЕКУЩАЯ_ДАТА", datetime.now().strftime("%d.%m.%Y"))
 
         # Добавляем дату в отчет, если модель не добавила ее сама
         if "Дата формирования" not in report_html:
@@ -865,7 +1001,10 @@ def generate_analytical_report(analysis_results):
                  </div>
                  """
 
-        return report_html
+        # Автономный документ: plotly.js и стили встроены, отчет открывается без доступа в интернет
+        document = html_report.build_document(report_html, "Аналитический отчет по выбору подрядчика", css_styles)
+        report_stream.store(report_key, document)
+        return document
     except Exception as e:
         # Добавляем traceback в лог для детальной диагностики
         import traceback
@@ -873,62 +1012,13 @@ def generate_analytical_report(analysis_results):
         return f"Не удалось сформировать аналитический отчет. Ошибка: {str(e)}"
 
 # Вспомогательные функции для подготовки данных
-def extract_price_value(price_text):
-    """Извлекает числовое значение цены из текстового описания"""
-    import re
-    
-    # Очищаем текст от НДС и другой информации
-    price_text = price_text.lower().replace('без ндс', '').replace('с ндс', '')
-    
-    # Пытаемся найти числовые значения
-    numbers = re.findall(r'(\d[\d\s]*[\d.,]*\d)', price_text)
-    if numbers:
-        # Берем первое найденное число и очищаем от пробелов
-        price_str = numbers[0].replace(' ', '').replace(',', '.')
-        try:
-            return float(price_str)
-        except ValueError:
-            return 0
-    return 0
-
-def extract_pricing_model(price_text):
-    """Определяет модель ценообразования из текстового описания"""
-    if "фиксированная" in price_text.lower():
-        return "Fixed Price"
-    elif "t&m" in price_text.lower() or "time & materials" in price_text.lower():
-        return "Time & Materials"
-    else:
-        return "Unknown"
-
-def extract_timeline_days(timeline_text):
-    """Извлекает длительность в днях из текстового описания сроков"""
-    import re
-    
-    # Ищем упоминания дней, недель, месяцев
-    days_match = re.search(r'(\d+)\s*(?:раб\w+\s*)?дн', timeline_text.lower())
-    weeks_match = re.search(r'(\d+)\s*недел', timeline_text.lower())
-    months_match = re.search(r'(\d+)\s*месяц', timeline_text.lower())
-    
-    days = 0
-    
-    if days_match:
-        days += int(days_match.group(1))
-    if weeks_match:
-        days += int(weeks_match.group(1)) * 7
-    if months_match:
-        days += int(months_match.group(1)) * 30
-    
-    # Если никаких сроков не нашли, возвращаем случайное значение как заглушку
-    if days == 0:
-        days = np.random.randint(30, 120)
-    
-    return days
-
 def assess_timeline_realism(timeline_text):
     """Оценивает реалистичность предложенных сроков"""
-    timeline_days = extract_timeline_days(timeline_text)
+    timeline_days = normalization.normalize_terms(None, timeline_text)["timeline_days"]
     
-    if timeline_days < 45:
+    if timeline_days is None:
+        return "Не определено"
+    elif timeline_days < 45:
         return "Оптимистичный"
     elif timeline_days < 90:
         return "Реалистичный"
@@ -975,45 +1065,56 @@ def random_timeline_variance():
     """Возвращает случайное отклонение от сроков как заглушку"""
     return round(np.random.uniform(-10, 30), 1)
 
+def comparison_pdf_key(comparison_df, all_analyses):
+    """Ключ PDF сравнительной таблицы: хеш строк таблицы, оценок и условий КП."""
+    terms = normalization.terms_frame(all_analyses)
+    return figure_cache.data_key(
+        comparison_df.drop(columns=["kp_key"], errors="ignore").to_dict("records"),
+        scoring.results_version(all_analyses),
+        terms.astype(object).where(terms.notna(), None).to_dict("records"),
+    )
+
 def export_comparison_to_pdf(comparison_df, all_analyses):
     """
-    Экспортирует сравнительную таблицу КП в PDF файл
+    Экспортирует сравнительную таблицу КП в PDF файл.
+    Страницы строятся объектным API Matplotlib и рисуются параллельно (pdf_export.render_pages),
+    готовый файл кешируется по ключу comparison_pdf_key.
     
     Args:
         comparison_df: DataFrame с данными сравнительной таблицы
         all_analyses: Список с результатами анализа всех КП
         
     Returns:
-        BytesIO: PDF файл в формате BytesIO для скачивания
+        bytes: PDF файл для скачивания
     """
-    # Создаем временный BytesIO буфер для хранения PDF
-    buffer = BytesIO()
-    
-    # Создаем PDF документ
-    with PdfPages(buffer) as pdf:
-        # --- Титульная страница ---
-        plt.figure(figsize=(11, 8.5))
-        plt.axis('off')
-        plt.text(0.5, 0.8, 'Сравнительный анализ', fontsize=24, ha='center')
-        plt.text(0.5, 0.7, 'коммерческих предложений', fontsize=24, ha='center')
-        plt.text(0.5, 0.5, f'Сгенерирован: {datetime.now().strftime("%d.%m.%Y %H:%M")}', fontsize=14, ha='center')
-        plt.text(0.5, 0.4, f'Проанализировано КП: {len(all_analyses)}', fontsize=14, ha='center')
-        plt.text(0.5, 0.2, 'Devent Tender Analysis AI', fontsize=16, ha='center', color='gray')
-        pdf.savefig()
-        plt.close()
-        
-        # --- Сравнительная таблица ---
-        plt.figure(figsize=(11, 8.5))
-        plt.axis('off')
-        plt.text(0.5, 0.95, 'Сравнительная таблица КП', fontsize=16, ha='center')
+    generated_at = datetime.now().strftime("%d.%m.%Y %H:%M")
+    # Нормализованные условия и оценки КП (строки таблицы идут в порядке all_analyses)
+    terms = normalization.terms_frame(all_analyses)
+    scores = scoring.score_results(all_analyses).sort_values("overall", ascending=False, kind="stable")
+    company_names = list(comparison_df["Название компании"])
+
+    def title_page():
+        fig = Figure(figsize=(11, 8.5))
+        ax = fig.add_subplot()
+        ax.axis('off')
+        ax.text(0.5, 0.8, 'Сравнительный анализ', fontsize=24, ha='center')
+        ax.text(0.5, 0.7, 'коммерческих предложений', fontsize=24, ha='center')
+        ax.text(0.5, 0.5, f'Сгенерирован: {generated_at}', fontsize=14, ha='center')
+        ax.text(0.5, 0.4, f'Проанализировано КП: {len(all_analyses)}', fontsize=14, ha='center')
+        ax.text(0.5, 0.2, 'Devent Tender Analysis AI', fontsize=16, ha='center', color='gray')
+        return fig
+
+    def table_page():
+        fig = Figure(figsize=(11, 8.5))
+        ax = fig.add_subplot()
+        ax.axis('off')
+        ax.text(0.5, 0.95, 'Сравнительная таблица КП', fontsize=16, ha='center')
         
         # Подготавливаем данные для таблицы
-        table_data = comparison_df.copy()
-        if 'kp_key' in table_data.columns:
-            table_data = table_data.drop('kp_key', axis=1)
+        table_data = comparison_df.drop(columns=[c for c in ('kp_key', 'Источник') if c in comparison_df.columns])
         
         # Рисуем таблицу
-        table = plt.table(
+        table = ax.table(
             cellText=table_data.values,
             colLabels=table_data.columns,
             cellLoc='center',
@@ -1023,150 +1124,293 @@ def export_comparison_to_pdf(comparison_df, all_analyses):
         table.auto_set_font_size(False)
         table.set_fontsize(9)
         table.scale(1, 1.5)
-        pdf.savefig()
-        plt.close()
-        
-        # --- График сравнения ---
-        plt.figure(figsize=(11, 6))
-        summary_data = comparison_df[["Название компании", "Соответствие (%)", "Рейтинг (1-10)"]]
+        return fig
+
+    def summary_page():
+        fig = Figure(figsize=(11, 6))
+        ax = fig.add_subplot()
         
         # Сокращаем длинные названия компаний
-        summary_data["Название компании"] = summary_data["Название компании"].apply(
-            lambda x: x[:20] + '...' if len(x) > 20 else x
-        )
+        labels = [name[:20] + '...' if len(name) > 20 else name for name in company_names]
         
         # Нормализуем рейтинг до 100 для единообразия
-        y1 = summary_data["Соответствие (%)"]
-        y2 = summary_data["Рейтинг (1-10)"] * 10
-        x = range(len(summary_data))
-        
-        plt.bar(x, y1, width=0.4, align='center', label='Соответствие ТЗ (%)', color=settings.BRAND_COLORS["primary"])
-        plt.bar([i+0.4 for i in x], y2, width=0.4, align='center', label='Рейтинг (0-100)', color=settings.BRAND_COLORS["accent"])
-        
-        plt.xticks([i+0.2 for i in x], summary_data["Название компании"], rotation=45, ha='right')
-        plt.ylim(0, 100)
-        plt.legend()
-        plt.grid(axis='y', linestyle='--', alpha=0.7)
-        plt.title('Сравнение соответствия ТЗ и рейтинга')
-        plt.tight_layout()
-        pdf.savefig()
-        plt.close()
-        
-        # --- Анализ цен и сроков ---
-        plt.figure(figsize=(11, 8.5))
-        plt.subplot(2, 1, 1)
-        
-        # Извлекаем и обрабатываем цены
-        prices = []
-        price_labels = []
-        for i, row in comparison_df.iterrows():
-            price_text = row["Стоимость"]
-            price_labels.append(row["Название компании"])
-            try:
-                # Пытаемся извлечь числовое значение из строки
-                price_value = extract_price_value(price_text)
-                prices.append(price_value)
-            except:
-                prices.append(0)
-        
-        # Сортируем по возрастанию цены
-        price_data = sorted(zip(price_labels, prices), key=lambda x: x[1])
-        price_labels = [item[0] for item in price_data]
-        prices = [item[1] for item in price_data]
+        y1 = comparison_df["Соответствие (%)"]
+        y2 = comparison_df["Рейтинг (1-10)"] * 10
+        x = range(len(labels))
         
-        plt.bar(price_labels, prices, color=settings.BRAND_COLORS["primary"])
-        plt.xticks(rotation=45, ha='right')
-        plt.title('Сравнение стоимости предложений')
-        plt.grid(axis='y', linestyle='--', alpha=0.7)
-        plt.tight_layout()
+        ax.bar(x, y1, width=0.4, align='center', label='Соответствие ТЗ (%)', color=settings.BRAND_COLORS["primary"])
+        ax.bar([i+0.4 for i in x], y2, width=0.4, align='center', label='Рейтинг (0-100)', color=settings.BRAND_COLORS["accent"])
         
-        # График сроков
-        plt.subplot(2, 1, 2)
-        timelines = []
-        for i, row in comparison_df.iterrows():
-            timeline_text = row["Сроки"]
-            try:
-                # Пытаемся извлечь длительность в днях
-                days = extract_timeline_days(timeline_text)
-                timelines.append((row["Название компании"], days))
-            except:
-                timelines.append((row["Название компании"], 0))
-        
-        # Сортируем по возрастанию сроков
-        timelines.sort(key=lambda x: x[1])
-        
-        timeline_labels = [item[0] for item in timelines]
-        timeline_days = [item[1] for item in timelines]
-        
-        plt.bar(timeline_labels, timeline_days, color=settings.BRAND_COLORS["accent"])
-        plt.xticks(rotation=45, ha='right')
-        plt.title('Сравнение сроков реализации (в днях)')
-        plt.grid(axis='y', linestyle='--', alpha=0.7)
-        plt.tight_layout()
-        pdf.savefig()
-        plt.close()
+        ax.set_xticks([i+0.2 for i in x], labels, rotation=45, ha='right')
+        ax.set_ylim(0, 100)
+        ax.legend()
+        ax.grid(axis='y', linestyle='--', alpha=0.7)
+        ax.set_title('Сравнение соответствия ТЗ и рейтинга')
+        fig.tight_layout()
+        return fig
+
+    def terms_page():
+        fig = Figure(figsize=(11, 8.5))
+        price_ax, timeline_ax = fig.subplots(2, 1)
         
-        # --- Страница с рекомендациями ---
-        plt.figure(figsize=(11, 8.5))
-        plt.axis('off')
-        plt.text(0.5, 0.95, 'Рекомендации по выбору КП', fontsize=16, ha='center')
+        # КП без цены или срока не рисуются нулевыми столбцами (иначе они выглядят самыми дешевыми
+        # и быстрыми), а перечисляются под графиком; цены - только сопоставимые по валюте и периоду
+        rows = [dict(record, name=name) for name, record in zip(company_names, terms.to_dict("records"))]
+        unit, priced, price_excluded = normalization.comparable_prices(rows)
+        timed = [row for row in rows if not pd.isna(row["timeline_days"])]
+        timeline_excluded = [(row, "не указано") for row in rows if pd.isna(row["timeline_days"])]
         
-        # Сортируем компании по общему рейтингу
-        overall_scores = []
-        for analysis in all_analyses:
-            company_name = analysis.get("company_name", analysis["kp_name"])
-            compliance_score = analysis["comparison_result"]["compliance_score"]
-            ratings = analysis.get("ratings", {})
-            avg_rating = sum(ratings.values()) / len(ratings) if ratings else 0
-            overall_score = (avg_rating * 10 + compliance_score) / 2
-            overall_scores.append((company_name, overall_score))
+        for ax, data, key, excluded, color, title in (
+            (price_ax, priced, "price_amount", price_excluded, settings.BRAND_COLORS["primary"],
+             f'Сравнение стоимости предложений, {unit}' if unit else 'Сравнение стоимости предложений'),
+            (timeline_ax, timed, "timeline_days", timeline_excluded, settings.BRAND_COLORS["accent"],
+             'Сравнение сроков реализации (в днях)'),
+        ):
+            # Сортируем по возрастанию цены и сроков
+            data = sorted(data, key=lambda row: row[key])
+            ax.bar(range(len(data)), [row[key] for row in data], color=color)
+            ax.set_xticks(range(len(data)), [row["name"] for row in data], rotation=45, ha='right')
+            if excluded:
+                note = "; ".join(f"{row['name']} ({reason})" for row, reason in excluded)
+                title = f"{title}\n" + textwrap.shorten(f"Не показаны: {note}", width=160, placeholder="...")
+            ax.set_title(title)
+            ax.grid(axis='y', linestyle='--', alpha=0.7)
+        fig.tight_layout()
+        return fig
+
+    def recommendations_page():
+        fig = Figure(figsize=(11, 8.5))
+        ax = fig.add_subplot()
+        ax.axis('off')
+        ax.text(0.5, 0.95, 'Рекомендации по выбору КП', fontsize=16, ha='center')
         
-        # Сортируем по убыванию оценки
-        overall_scores.sort(key=lambda x: x[1], reverse=True)
+        # Компании по общему рейтингу
+        overall_scores = list(zip(scores["company_name"], scores["overall"], scores["level"]))
+        pdf_recommendations = {
+            "recommend": ("✅ Рекомендовано к принятию", "green"),
+            "conditional": ("⚠️ Рекомендовано с оговорками", "orange"),
+            "reject": ("❌ Не рекомендовано", "red"),
+        }
         
         # Выводим рекомендации
         y_pos = 0.85
-        plt.text(0.1, y_pos, "Ранжирование КП по общей оценке:", fontsize=12)
+        ax.text(0.1, y_pos, "Ранжирование КП по общей оценке:", fontsize=12)
         y_pos -= 0.05
         
-        for i, (company, score) in enumerate(overall_scores, 1):
-            if score >= 75:
-                recommendation = "✅ Рекомендовано к принятию"
-                color = 'green'
-            elif score >= 60:
-                recommendation = "⚠️ Рекомендовано с оговорками"
-                color = 'orange'
-            else:
-                recommendation = "❌ Не рекомендовано"
-                color = 'red'
-                
-            plt.text(0.1, y_pos, f"{i}. {company}", fontsize=11)
-            plt.text(0.6, y_pos, f"Оценка: {score:.1f}/100", fontsize=11)
-            plt.text(0.8, y_pos, recommendation, fontsize=11, color=color)
+        for i, (company, score, level) in enumerate(overall_scores, 1):
+            recommendation, color = pdf_recommendations[level]
+
+            ax.text(0.1, y_pos, f"{i}. {company}", fontsize=11)
+            ax.text(0.6, y_pos, f"Оценка: {score:.1f}/100", fontsize=11)
+            ax.text(0.8, y_pos, recommendation, fontsize=11, color=color)
             y_pos -= 0.04
             
             if i == 1:
                 # Для лучшего КП даем развернутую рекомендацию
                 y_pos -= 0.02
-                plt.text(0.1, y_pos, f"Рекомендация:", fontsize=12, fontweight='bold')
+                ax.text(0.1, y_pos, f"Рекомендация:", fontsize=12, fontweight='bold')
                 y_pos -= 0.04
-                plt.text(0.1, y_pos, f"Предложение от '{company}' является наиболее подходящим с общей оценкой {score:.1f}/100.", 
-                         fontsize=10, wrap=True)
+                ax.text(0.1, y_pos, f"Предложение от '{company}' является наиболее подходящим с общей оценкой {score:.1f}/100.", 
+                        fontsize=10, wrap=True)
                 y_pos -= 0.04
         
-        plt.text(0.1, 0.1, "Примечание: Данный отчет сгенерирован автоматически и носит рекомендательный характер.", 
-                 fontsize=9, fontstyle='italic')
-        pdf.savefig()
-        plt.close()
-    
-    # Возвращаем буфер в начальную позицию
-    buffer.seek(0)
-    return buffer
+        ax.text(0.1, 0.1, "Примечание: Данный отчет сгенерирован автоматически и носит рекомендательный характер.", 
+                fontsize=9, fontstyle='italic')
+        return fig
+
+    return pdf_export.build_cached(
+        comparison_pdf_key(comparison_df, all_analyses),
+        [title_page, table_page, summary_page, terms_page, recommendations_page],
+    )
+
+# Итоговые рекомендации в сравнительной таблице
+TABLE_RECOMMENDATIONS = {
+    "recommend": "✅ Рекомендовано",
+    "conditional": "⚠️ С оговорками",
+    "reject": "❌ Не рекомендовано",
+}
+# Колонки сравнительной таблицы (в этом порядке они попадают и в PDF)
+TABLE_COLUMNS = ["Название компании", "Соответствие (%)", "Стоимость", "Сроки", "Пропущено", "Добавлено",
+                 "Рейтинг (1-10)", "Рекомендация", "kp_key", "Источник"]
+# Сортировка выборки КП: подпись -> (колонка таблицы, по возрастанию)
+COMPARISON_SORTS = {
+    "Общая оценка ↓": ("overall", False),
+    "Соответствие ↓": ("Соответствие (%)", False),
+    "Рейтинг ↓": ("Рейтинг (1-10)", False),
+    "Стоимость ↑": ("price_amount", True),
+    "Сроки ↑": ("timeline_days", True),
+    "Компания А-Я": ("Название компании", True),
+}
+
+def render_tournament(all_analyses):
+    """
+    Турнирный рейтинг: лучшие КП по общей оценке упорядочиваются попарными сравнениями моделью.
+    Рейтинг показывается, пока набор результатов не изменился.
+    
+    Args:
+        all_analyses: Список с результатами анализа всех КП
+    """
+    st.caption(
+        f"Лучшие КП по общей оценке (до {settings.TOURNAMENT_SHORTLIST_K}) сравниваются попарно моделью этапа "
+        f"«{settings.STAGE_LABELS['pairwise']}». Вердикты пар сохраняются: повторный турнир по тем же КП "
+        "не обращается к модели, а новое КП требует лишь нескольких сравнений."
+    )
+    version = scoring.results_version(all_analyses)
+    if st.button("Провести турнир", key="run_tournament"):
+        tender_id = st.session_state.get("tender_id")
+        with st.spinner("Попарное сравнение КП..."):
+            # Расход на сравнения учитывается в итогах того же тендера, что и анализ КП
+            with token_budget.tender_scope(tender_id):
+                st.session_state.tournament_ranking = {"version": version, **tournament.rank_shortlist(all_analyses)}
+        if tender_id:
+            st.session_state.tender_usage = token_budget.get_tender_totals(tender_id)
+
+    ranking = st.session_state.get("tournament_ranking")
+    if not ranking or ranking["version"] != version:
+        return
+    scores = scoring.score_results(all_analyses)
+    rows = []
+    for place, (i, reason) in enumerate(zip(ranking["order"], ranking["reasons"]), 1):
+        rows.append({
+            "Место": place,
+            "Компания": all_analyses[i].get("company_name", all_analyses[i]["kp_name"]),
+            "Общая оценка": round(scores.at[i, "overall"], 1),
+            "Место по общей оценке": int(scores.at[i, "rank"]),
+            "Почему выше следующего": reason or "",
+        })
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    stats = ranking["stats"]
+    st.caption(
+        f"Сравнений: {stats['comparisons']}, из них новых запросов к модели: {stats['requests']}, "
+        f"из сохраненных вердиктов: {stats['cached']}."
+    )
+    if stats["failed"]:
+        st.warning(f"Модель не вынесла вердикт по {stats['failed']} парам - они упорядочены по общей оценке.")
+
+def render_results_export(all_analyses):
+    """
+    Выгрузка результатов текущего тендера или всей истории анализов в нормализованные таблицы
+    (export_service). Файлы сохраняются в settings.EXPORT_DIR и доступны для скачивания.
+    
+    Args:
+        all_analyses: Список с результатами анализа всех КП
+    """
+    source = st.radio("Данные", ["Текущий тендер", "Вся история анализов"], horizontal=True, key="results_export_source")
+    formats = st.multiselect("Форматы", settings.EXPORT_FORMATS, default=["xlsx"], key="results_export_formats")
+    if st.button("Выгрузить", key="results_export_run", disabled=not formats):
+        results = all_analyses if source == "Текущий тендер" else export_service.iter_results()
+        try:
+            with st.spinner("Выгрузка результатов..."):
+                st.session_state.results_export = export_service.export_results(results, formats, export_service.default_base())
+        except RuntimeError as e:
+            st.error(str(e))
+
+    summary = st.session_state.get("results_export")
+    if not summary:
+        return
+    st.caption("Строк в таблицах: " + ", ".join(f"{table} - {count}" for table, count in summary["rows"].items()))
+    for fmt, path in summary["paths"].items():
+        st.download_button(
+            f"📥 {fmt.upper()}: {path.name}",
+            data=export_service.pack_export(path),
+            file_name=path.name if fmt == "xlsx" else f"{path.name}.zip",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if fmt == "xlsx" else "application/zip",
+            key=f"results_export_download_{fmt}",
+        )
+
+def build_comparison_frame(all_analyses):
+    """
+    Сравнительная таблица всех КП: колонки TABLE_COLUMNS и служебные колонки для сортировки
+    и фильтрации (position - индекс КП в all_analyses, overall, level, price_amount, timeline_days).
+    Строится один раз на набор результатов и хранится в session_state, поэтому перезапуски
+    страницы (фильтры, сортировка, листание) ее не пересчитывают.
+
+    Args:
+        all_analyses: Список с результатами анализа всех КП
+
+    Returns:
+        pd.DataFrame: Строки в порядке all_analyses.
+    """
+    key = figure_cache.data_key(
+        scoring.results_version(all_analyses),
+        [[analysis.get("pricing"), analysis.get("timeline"), analysis.get("provenance")] for analysis in all_analyses],
+    )
+    cached = st.session_state.get("comparison_frame")
+    if cached and cached[0] == key:
+        return cached[1]
+
+    scores = scoring.score_results(all_analyses)
+    terms = normalization.terms_frame(all_analyses)
+    table_data = []
+    for analysis, score in zip(all_analyses, scores.itertuples(index=False)):
+        # Отметка о повторно использованном анализе почти совпадающего КП
+        provenance = analysis.get("provenance")
+        table_data.append({
+            "Название компании": str(score.company_name),
+            "Соответствие (%)": analysis["comparison_result"]["compliance_score"],
+            "Стоимость": analysis.get("pricing", "Не указана"),
+            "Сроки": analysis.get("timeline", "Не указаны"),
+            "Пропущено": score.missing_count,
+            "Добавлено": score.additional_count,
+            "Рейтинг (1-10)": round(score.rating, 1),
+            "Рекомендация": TABLE_RECOMMENDATIONS[score.level],
+            "kp_key": analysis["kp_name"], # Скрытый ключ для идентификации КП
+            "Источник": f"♻️ {provenance['reused_from']} ({provenance['similarity']:.0%})" if provenance else "Анализ",
+        })
+    
+    # Для более компактного отображения, преобразуем данные таблицы
+    # Сокращаем форматы строк для Стоимости и Сроков, обеспечивая перенос
+    for item in table_data:
+        # Очищаем стоимость от лишнего текста
+        if "Фиксированная цена:" in item["Стоимость"]:
+            price_parts = item["Стоимость"].split(":")
+            item["Стоимость"] = price_parts[1].strip() if len(price_parts) > 1 else item["Стоимость"]
+        
+        # Преобразуем длинные строки с добавлением переносов
+        if len(item["Стоимость"]) > 30:
+            # Добавляем пробелы в длинных числах для облегчения переноса
+            item["Стоимость"] = item["Стоимость"].replace(" ", "\n")
+        
+        # Аналогично для сроков
+        if ":" in item["Сроки"]:
+            timeline_parts = item["Сроки"].split(":")
+            item["Сроки"] = timeline_parts[1].strip() if len(timeline_parts) > 1 else item["Сроки"]
+    
+    frame = pd.DataFrame(table_data, columns=TABLE_COLUMNS)
+    frame["position"] = range(len(all_analyses))
+    frame["overall"] = scores["overall"].to_numpy()
+    frame["level"] = scores["level"].to_numpy()
+    frame["price_amount"] = terms["price_amount"].to_numpy()
+    frame["timeline_days"] = terms["timeline_days"].to_numpy()
+    st.session_state.comparison_frame = (key, frame)
+    return frame
+
+def select_comparison_rows(frame, query="", levels=None, min_compliance=0, sort_label="Общая оценка ↓"):
+    """
+    Выборка КП для сравнительной таблицы: фильтры и сортировка по таблице build_comparison_frame.
+
+    Args:
+        frame (pd.DataFrame): Таблица build_comparison_frame.
+        query (str): Подстрока названия компании (без учета регистра).
+        levels (list, optional): Допустимые уровни рекомендации (scoring.LEVELS); пусто - любые.
+        min_compliance (int): Минимальное соответствие ТЗ, %.
+        sort_label (str): Ключ COMPARISON_SORTS.
+
+    Returns:
+        pd.DataFrame: Отфильтрованные и отсортированные строки (КП без цены или срока - в конце).
+    """
+    mask = frame["Соответствие (%)"] >= min_compliance
+    if query:
+        mask &= frame["Название компании"].str.contains(query.strip(), case=False, regex=False)
+    if levels:
+        mask &= frame["level"].isin(levels)
+    column, ascending = COMPARISON_SORTS[sort_label]
+    return frame[mask].sort_values(column, ascending=ascending, na_position="last", kind="stable")
 
 def render_comparison_table():
     """
     Отображает сравнительную таблицу всех коммерческих предложений
-    и позволяет выбрать КП для детального отчета с помощью кнопок.
+    с фильтрами, сортировкой и постраничным выводом и позволяет выбрать КП для детального отчета.
     """
     if "all_analysis_results" not in st.session_state or not st.session_state.all_analysis_results:
         st.warning("Нет данных для сравнения. Пожалуйста, запустите анализ.")
@@ -1179,6 +1423,16 @@ def render_comparison_table():
         return
     
     st.header("Сравнительная таблица коммерческих предложений")
+    
+    # Итоги расхода по тендеру (токены, стоимость, время моделей)
+    usage = st.session_state.get("tender_usage")
+    if usage and usage["calls"]:
+        st.caption(
+            f"Расход на анализ: {usage['calls']} запросов, {usage['input_tokens']:,} входных и "
+            f"{usage['output_tokens']:,} выходных токенов, ≈ ${usage['cost']:.2f}, суммарное время моделей {usage['latency']:.0f} с"
+        )
+        with st.expander("Задержка и стоимость по этапам"):
+            render_stage_report(usage)
 
     # Если у нас более одного КП, предлагаем сформировать сравнительный анализ
     all_analyses = st.session_state.all_analysis_results
@@ -1191,119 +1445,42 @@ def render_comparison_table():
                 
             col1, col2, col3 = st.columns([2, 1, 1])
             with col2:
-                if st.button("Сформировать анализ", use_container_width=True, key="run_comparison_analysis"):
-                    st.session_state.comparison_analysis = compare_all_proposals(all_analyses)
+                run_comparison = st.button("Сформировать анализ", use_container_width=True, key="run_comparison_analysis")
             
             with col3:
-                if st.button("Аналитический отчет", use_container_width=True, key="run_analytical_report"):
-                    st.session_state.comparison_analysis = generate_analytical_report(all_analyses)
+                run_report = st.button("Аналитический отчет", use_container_width=True, key="run_analytical_report")
+            
+            # Отчет формируется на всю ширину блока: разделы выводятся по мере генерации
+            if run_comparison:
+                st.session_state.comparison_analysis = compare_all_proposals(all_analyses)
+            elif run_report:
+                st.session_state.comparison_analysis = generate_analytical_report(all_analyses)
             
             # Если анализ уже был сформирован, отображаем его
-            if st.session_state.comparison_analysis:
+            if html_report.is_document(st.session_state.comparison_analysis):
+                # Аналитический отчет с графиками - автономный HTML-документ (скрипты выполняются только в iframe)
+                components.html(st.session_state.comparison_analysis, height=900, scrolling=True)
+                st.download_button(
+                    "💾 Скачать HTML-отчет",
+                    data=st.session_state.comparison_analysis.encode("utf-8"),
+                    file_name="analytical_report.html",
+                    mime="text/html",
+                    key="download_analytical_report"
+                )
+            elif st.session_state.comparison_analysis:
                 st.markdown(st.session_state.comparison_analysis, unsafe_allow_html=True)
             else:
                 st.markdown("Нажмите кнопку 'Сформировать анализ' или 'Аналитический отчет', чтобы получить результаты сравнения всех КП.")
+
+        with st.expander("🏆 **Турнирный рейтинг лучших КП**"):
+            render_tournament(all_analyses)
     
     st.divider()
     
-    # Сначала добавим заметную инструкцию
-    st.info("👇 **Чтобы увидеть подробный отчет по конкретной компании, нажмите на соответствующую кнопку ниже.**")
-    
-    # Сначала отображаем крупные кнопки для быстрого доступа к отчетам
-    st.subheader("Быстрый доступ к отчетам")
-    
-    # Расположим кнопки в несколько столбцов
-    cols_per_row = 4
-    
-    for i in range(0, len(all_analyses), cols_per_row):
-        cols = st.columns(cols_per_row)
-        for j in range(cols_per_row):
-            if i + j < len(all_analyses):
-                analysis = all_analyses[i + j]
-                company = analysis.get("company_name", analysis["kp_name"])
-                compliance = analysis["comparison_result"]["compliance_score"]
-                
-                # Определяем цвет кнопки на основе соответствия
-                if compliance >= 80:
-                    btn_color = "🟢"
-                elif compliance >= 60:
-                    btn_color = "🟡"
-                else:
-                    btn_color = "🔴"
-                    
-                with cols[j]:
-                    if st.button(f"{btn_color} Отчет: {company}\n{compliance}% соотв.", 
-                                 key=f"quick_report_{i+j}",
-                                 use_container_width=True):
-                        st.session_state.analysis_result = analysis
-                        st.session_state.current_step = "report"
-                        st.rerun()
-    
-    st.divider()
-    
-    # Создаем данные для таблицы
-    table_data = []
-    kp_names = []
+    # Таблица всех КП строится один раз на набор результатов; фильтры, сортировка и листание
+    # работают с ней на стороне сервера, а в браузер уходит только текущая страница
+    comparison_frame = build_comparison_frame(all_analyses)
     
-    for analysis in st.session_state.all_analysis_results:
-        kp_name = analysis["kp_name"]
-        company_name = analysis.get("company_name", kp_name)  # Используем company_name, если есть
-        kp_names.append(kp_name)  # Сохраняем имя файла для ключа
-        
-        # Базовая информация
-        kp_info = {
-            "Название компании": company_name,  # Используем название компании
-            "Соответствие (%)": analysis["comparison_result"]["compliance_score"],
-            "Стоимость": analysis.get("pricing", "Не указана"),      # Новое поле
-            "Сроки": analysis.get("timeline", "Не указаны"),         # Новое поле
-            "Пропущено": len(analysis["comparison_result"]["missing_requirements"]),
-            "Добавлено": len(analysis["comparison_result"]["additional_features"])
-        }
-        
-        # Расчет среднего рейтинга (если есть)
-        ratings = analysis.get("ratings", {})
-        avg_rating = sum(ratings.values()) / len(ratings) if ratings else 0
-        kp_info["Рейтинг (1-10)"] = round(avg_rating, 1)
-        
-        # Добавляем рекомендацию
-        compliance_score = kp_info["Соответствие (%)"]
-        overall_score = (avg_rating * 10 + compliance_score) / 2
-        
-        if overall_score >= 75:
-            kp_info["Рекомендация"] = "✅ Рекомендовано"
-        elif overall_score >= 60:
-            kp_info["Рекомендация"] = "⚠️ С оговорками"
-        else:
-            kp_info["Рекомендация"] = "❌ Не рекомендовано"
-            
-        # Добавляем столбец для кнопки отчета
-        # kp_info["Открыть отчет"] = "📊 Открыть детальный отчет"  # Изменяем текст
-        kp_info["kp_key"] = kp_name # Добавляем скрытый ключ для идентификации КП
-        
-        table_data.append(kp_info)
-    
-    # Для более компактного отображения, преобразуем данные таблицы
-    # Сокращаем форматы строк для Стоимости и Сроков, обеспечивая перенос
-    for item in table_data:
-        # Очищаем стоимость от лишнего текста
-        if "Фиксированная цена:" in item["Стоимость"]:
-            price_parts = item["Стоимость"].split(":")
-            item["Стоимость"] = price_parts[1].strip() if len(price_parts) > 1 else item["Стоимость"]
-        
-        # Преобразуем длинные строки с добавлением переносов
-        if len(item["Стоимость"]) > 30:
-            # Добавляем пробелы в длинных числах для облегчения переноса
-            item["Стоимость"] = item["Стоимость"].replace(" ", "\n")
-        
-        # Аналогично для сроков
-        if ":" in item["Сроки"]:
-            timeline_parts = item["Сроки"].split(":")
-            item["Сроки"] = timeline_parts[1].strip() if len(timeline_parts) > 1 else item["Сроки"]
-    
-    # Создаем DataFrame
-    comparison_df = pd.DataFrame(table_data)
-    
-    # Отображаем таблицу без колонки ButtonColumn - улучшенная версия с компактными колонками
     st.markdown("""
     <div style='background-color: white; padding: 15px 20px; border-radius: 10px; box-shadow: 0 1px 3px rgba(0,0,0,0.12); margin-bottom: 20px;'>
         <h3 style='margin:0 0 10px 0; color: #1A1E3A; font-size: 1.1rem;'>📊 Сравнительная таблица коммерческих предложений</h3>
@@ -1311,8 +1488,39 @@ def render_comparison_table():
     </div>
     """, unsafe_allow_html=True)
     
+    filter_cols = st.columns([3, 3, 2, 2])
+    with filter_cols[0]:
+        query = st.text_input("Поиск по компании", key="comparison_query")
+    with filter_cols[1]:
+        levels = st.multiselect(
+            "Рекомендация", list(TABLE_RECOMMENDATIONS), format_func=TABLE_RECOMMENDATIONS.get, key="comparison_levels"
+        )
+    with filter_cols[2]:
+        min_compliance = st.slider("Соответствие от, %", 0, 100, 0, step=5, key="comparison_min_compliance")
+    with filter_cols[3]:
+        sort_label = st.selectbox("Сортировка", list(COMPARISON_SORTS), key="comparison_sort")
+    selection = select_comparison_rows(comparison_frame, query, levels, min_compliance, sort_label)
+    
+    page_cols = st.columns([2, 2, 4])
+    with page_cols[0]:
+        page_size = st.selectbox("КП на странице", settings.COMPARISON_PAGE_SIZES, index=1, key="comparison_page_size")
+    pages = max(1, -(-len(selection) // page_size))
+    # После смены фильтров номер страницы может оказаться за пределами выборки
+    if st.session_state.get("comparison_page", 1) > pages:
+        st.session_state.comparison_page = pages
+    with page_cols[1]:
+        page = st.number_input("Страница", min_value=1, max_value=pages, step=1, key="comparison_page")
+    start = (page - 1) * page_size
+    page_df = selection.iloc[start:start + page_size]
+    with page_cols[2]:
+        st.caption(
+            f"Показано {start + 1 if len(page_df) else 0}-{start + len(page_df)} из {len(selection)} КП выборки "
+            f"(всего КП: {len(comparison_frame)})"
+        )
+    comparison_df = selection[TABLE_COLUMNS]
+    
     st.dataframe(
-        comparison_df,
+        page_df[TABLE_COLUMNS],
         column_config={
             "Название компании": st.column_config.TextColumn(
                 "Компания", 
@@ -1343,7 +1551,7 @@ def render_comparison_table():
                 min_value=0, 
                 max_value=10,
                 width="small",
-                help="Средний рейтинг по всем критериям (1-10)"
+                help="Рейтинг по критериям с учетом их весов (1-10)"
             ),
             "Пропущено": st.column_config.NumberColumn(
                 "Упущено", 
@@ -1362,99 +1570,107 @@ def render_comparison_table():
                 width="small",
                 help="Итоговая рекомендация на основе анализа"
             ),
+            "Источник": st.column_config.TextColumn(
+                "Источник",
+                width="small",
+                help="♻️ - использован прежний анализ почти совпадающего КП (в скобках - сходство текстов)"
+            ),
             "kp_key": None
         },
         hide_index=True,
         use_container_width=True,
-        height=280, # Фиксированная высота для компактности
-        column_order=["Название компании", "Соответствие (%)", "Стоимость", "Сроки", "Рейтинг (1-10)", "Пропущено", "Добавлено", "Рекомендация"],
+        column_order=["Название компании", "Соответствие (%)", "Стоимость", "Сроки", "Рейтинг (1-10)", "Пропущено", "Добавлено", "Рекомендация", "Источник"],
         key="comparison_table_df_no_button" # Меняем ключ, чтобы избежать конфликтов
     )
     
-    # Добавляем кнопку для сохранения сравнительной таблицы в PDF
+    # Быстрый доступ к отчету: один список КП текущей страницы вместо кнопки на каждое КП
+    st.subheader("Быстрый доступ к отчетам")
+    report_cols = st.columns([4, 2])
+    with report_cols[0]:
+        compliance_marks = {
+            position: "🟢" if compliance >= 80 else "🟡" if compliance >= 60 else "🔴"
+            for position, compliance in zip(page_df["position"], page_df["Соответствие (%)"])
+        }
+        companies = dict(zip(page_df["position"], page_df["Название компании"]))
+        report_position = st.selectbox(
+            "КП для детального отчета",
+            page_df["position"].tolist(),
+            format_func=lambda position: f"{compliance_marks[position]} {companies[position]} "
+                                         f"({all_analyses[position]['comparison_result']['compliance_score']}% соотв.)",
+            key="quick_report_kp",
+            label_visibility="collapsed"
+        )
+    with report_cols[1]:
+        if st.button("📊 Открыть отчет", use_container_width=True, key="quick_report_open", disabled=report_position is None):
+            st.session_state.analysis_result = all_analyses[report_position]
+            st.session_state.current_step = "report"
+            st.rerun()
+    
+    # Сохранение сравнительной таблицы в PDF: готовый файл берется из кеша по набору результатов,
+    # и кнопка скачивания отдает его без повторной отрисовки страниц
+    selected_analyses = [all_analyses[position] for position in selection["position"]]
     save_col1, save_col2, save_col3 = st.columns([3, 2, 3])
     with save_col2:
-        if st.button("📄 Сохранить таблицу в PDF", use_container_width=True, key="save_comparison_table"):
-            st.info("Подготовка PDF-файла с таблицей сравнения...")
+        pdf_key = comparison_pdf_key(comparison_df, selected_analyses)
+        pdf_bytes = pdf_export.get_cached(pdf_key)
+        if pdf_bytes is None and st.button("📄 Сохранить таблицу в PDF", use_container_width=True, key="save_comparison_table",
+                                           help="В PDF попадают все КП текущей выборки в выбранном порядке"):
             try:
-                # Генерируем PDF
-                pdf_buffer = export_comparison_to_pdf(comparison_df, all_analyses)
-                
-                # Кодируем PDF в base64 для скачивания
-                b64 = base64.b64encode(pdf_buffer.read()).decode()
-                
-                # Создаем ссылку для скачивания
-                now = datetime.now().strftime("%Y%m%d_%H%M%S")
-                file_name = f"tender_comparison_{now}.pdf"
-                
-                st.success("PDF успешно сгенерирован!")
-                
-                # Отображаем ссылку для скачивания
-                href = f'<a href="data:application/pdf;base64,{b64}" download="{file_name}">📥 Скачать PDF файл</a>'
-                st.markdown(href, unsafe_allow_html=True)
+                with st.spinner("Подготовка PDF-файла с таблицей сравнения..."):
+                    pdf_bytes = export_comparison_to_pdf(comparison_df, selected_analyses)
             except Exception as e:
                 st.error(f"Ошибка при создании PDF: {e}")
+        if pdf_bytes is not None:
+            st.download_button(
+                "📥 Скачать PDF файл",
+                data=pdf_bytes,
+                file_name="tender_comparison.pdf",
+                mime="application/pdf",
+                use_container_width=True,
+                key="download_comparison_pdf",
+            )
+
+    with st.expander("🗄 Выгрузка результатов для BI (Parquet, XLSX, JSONL)"):
+        render_results_export(all_analyses)
     
     st.divider()
     
     # --- Визуализации остаются ниже --- 
     
-    # Сравнение общего соответствия и среднего рейтинга
     st.subheader("Сводная оценка по компаниям", anchor=False)
     
-    if len(table_data) > 0:
-        summary_data = comparison_df[["Название компании", "Соответствие (%)", "Рейтинг (1-10)"]]
-        
-        # Для более компактного отображения, сокращаем длинные названия компаний
-        summary_data["Название компании"] = summary_data["Название компании"].apply(
-            lambda x: x[:20] + '...' if len(x) > 20 else x
-        )
-        
-        summary_data_melted = pd.melt(
-            summary_data, 
-            id_vars=["Название компании"],
-            var_name="Показатель", 
-            value_name="Значение"
-        )
-        
-        # Нормализуем оценки - рейтинг умножаем на 10
-        summary_data_melted["Значение"] = np.where(
-            summary_data_melted["Показатель"] == "Рейтинг (1-10)", 
-            summary_data_melted["Значение"] * 10, 
-            summary_data_melted["Значение"]
-        )
-        
-        # Меняем название показателя для легенды
-        summary_data_melted["Показатель"] = np.where(
-            summary_data_melted["Показатель"] == "Рейтинг (1-10)",
-            "Рейтинг (норм. до 100)",
-            summary_data_melted["Показатель"]
-        )
-
-        fig = px.bar(
-            summary_data_melted, 
-            x="Название компании", 
-            y="Значение", 
-            color="Показатель",
-            barmode="group",
-            height=350, # Уменьшаем высоту графика для компактности
-            color_discrete_map={
-                "Соответствие (%)": settings.BRAND_COLORS["primary"],
-                "Рейтинг (норм. до 100)": settings.BRAND_COLORS["accent"]
-            }
-        )
-        
-        fig.update_layout(
-            xaxis_title="Компания",
-            yaxis_title="Оценка (0-100)",
-            legend_title="Показатель",
-            yaxis=dict(range=[0, 100]),
-            plot_bgcolor="rgba(0,0,0,0)",
-            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-            margin=dict(l=40, r=40, t=40, b=80)  # Компактные отступы
-        )
-        
-        st.plotly_chart(fig, use_container_width=True)
+    if len(selection) > 0:
+        chart_builders = {
+            "Соответствие и рейтинг": create_overview_visualization,
+            "Общий рейтинг": create_rating_visualization,
+            "Требования ТЗ": create_compliance_visualization,
+            "Стоимость": create_price_visualization,
+            "Сроки": create_timeline_visualization,
+            "Риски": create_risk_visualization,
+        }
+        chart_cols = st.columns([5, 1])
+        # Строится только выбранный график: содержимое st.tabs и свернутых st.expander
+        # выполняется при каждом перезапуске страницы, даже если его не видно
+        with chart_cols[0]:
+            chart_name = st.radio(
+                "График",
+                list(chart_builders),
+                horizontal=True,
+                key="comparison_chart",
+                label_visibility="collapsed"
+            )
+        with chart_cols[1]:
+            top_n = st.number_input(
+                "КП на графике", min_value=1, max_value=settings.COMPARISON_CHART_MAX_N,
+                value=settings.COMPARISON_CHART_TOP_N, step=1, key="comparison_top_n"
+            )
+        # Графики строятся только для первых N КП выборки - их размер не зависит от числа КП в тендере
+        chart_analyses = selected_analyses[:top_n]
+        st.caption(f"На графике - первые {len(chart_analyses)} из {len(selection)} КП выборки (сортировка: {sort_label}).")
+        # Повторные перезапуски страницы берут готовую фигуру из кеша (figure_cache)
+        st.plotly_chart(chart_builders[chart_name](build_comparative_data(chart_analyses)), use_container_width=True)
+    else:
+        st.info("Нет КП, удовлетворяющих фильтрам.")
     
     # Кнопки управления
     st.divider()
@@ -229,6 +229,7 @@ def render_upload_section(upload_dir: Path = settings.UPLOAD_DIR):
         
         if analyze_btn:
             st.session_state.run_full_analysis = True
+            st.session_state.dedup_decisions = None
             st.session_state.all_analysis_results = []
             st.session_state.analysis_result = None 
             st.session_state.ratings = {} 
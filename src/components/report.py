@@ -12,6 +12,8 @@ from io import BytesIO
 import time
 from src.config import settings
 from src.components import comparison_table
+from src.services import similarity, scoring
+from src.utils import normalization
 
 def render_report_section(result_dir):
     """Отображает секцию с отчетом по выбранному КП или сравнительную таблицу."""
@@ -43,7 +45,6 @@ def render_single_report_new_structure():
     tz_name = analysis_data["tz_name"]
     comparison_result = analysis_data["comparison_result"]
     prelim_recommendation = analysis_data["preliminary_recommendation"]
-    ratings = analysis_data.get("ratings", {})
     
     # Получаем дополнительные данные (технологии, сроки, стоимость)
     tech_stack = analysis_data.get("tech_stack", "Не указано")
@@ -52,6 +53,9 @@ def render_single_report_new_structure():
     
     st.title(f"Анализ Коммерческого Предложения: {company_name}")
     st.markdown(f"*по отношению к ТЗ: {tz_name}*")
+    provenance = similarity.describe_provenance(analysis_data)
+    if provenance:
+        st.info(provenance)
     st.divider()
     
     # Добавляем кнопки для экспорта в PDF
@@ -73,6 +77,9 @@ def render_single_report_new_structure():
         else:
             compliance_text = "Значительные расхождения с требованиями ТЗ"
         st.markdown(f"**Общая Оценка Соответствия:** {compliance_text} ({compliance_score}%) ✨")
+        failed_sections = comparison_result.get("failed_sections", 0)
+        if failed_sections:
+            st.warning(f"Оценка неполная: {failed_sections} из {len(comparison_result['sections'])} разделов ТЗ не удалось оценить, они не учтены в общей оценке.")
 
         # Ключевые моменты (берем первые N из анализа)
         st.markdown("**Ключевые Положительные Моменты:**")
@@ -92,16 +99,13 @@ def render_single_report_new_structure():
         # Финансовый итог
         st.markdown(f"**Финансовый Итог:** {pricing} 💰")
 
-        # Итоговая рекомендация
-        avg_rating = sum(ratings.values()) / len(ratings) if ratings else 0
-        overall_score = (avg_rating * 10 + compliance_score) / 2
-        
-        if overall_score >= 75:
-            recommendation_final = "✅ Рекомендовать к принятию"
-        elif overall_score >= 60:
-            recommendation_final = "⚠️ Рекомендовать к доработке/переговорам"
-        else:
-            recommendation_final = "❌ Рекомендовать к отклонению"
+        # Итоговая рекомендация (общая оценка - из таблицы оценок всех КП тендера)
+        score = scoring.score_of(analysis_data, st.session_state.get("all_analysis_results"))
+        recommendation_final = {
+            "recommend": "✅ Рекомендовать к принятию",
+            "conditional": "⚠️ Рекомендовать к доработке/переговорам",
+            "reject": "❌ Рекомендовать к отклонению",
+        }[score["level"]]
         st.markdown(f"**Итоговая Рекомендация:** {recommendation_final}")
         
     # --- 2. Вводная Информация --- 
@@ -116,6 +120,12 @@ def render_single_report_new_structure():
              st.markdown(f"**Поставщик:** {company_name}")
              st.markdown("**Контекст:** Оценка КП для выбора исполнителя по ТЗ.")
              st.markdown(f"**Дата Анализа:** {datetime.now().strftime('%d.%m.%Y %H:%M')}")
+             served_models = analysis_data.get("served_models", {})
+             if served_models:
+                 stage_names = {"summary": "извлечение данных", "comparison": "сравнение с ТЗ", "recommendation": "рекомендация"}
+                 st.markdown("**Модели Анализа:** " + ", ".join(
+                     f"{stage_names.get(stage, stage)} — {model or 'нет ответа'}" for stage, model in served_models.items()
+                 ))
 
     # --- 3. Обзор Коммерческого Предложения (КП) --- 
     st.markdown("## 3. Обзор Коммерческого Предложения (КП)")
@@ -139,11 +149,8 @@ def render_single_report_new_structure():
 
     # --- 4. Детальное Построчное Сравнение ТЗ и КП --- 
     st.markdown("## 4. Детальное Построчное Сравнение ТЗ и КП")
-    # Этот раздел требует детального анализа и сопоставления пунктов ТЗ и КП (сложная задача для AI)
-    st.markdown("_Этот раздел требует более глубокого AI-анализа для автоматического сопоставления пунктов ТЗ и КП. Текущая версия предоставляет общую оценку соответствия._")
-    
-    # Отображаем таблицу соответствия по разделам (как временное решение)
-    st.markdown("### Соответствие по основным разделам (упрощенно)")
+    # Каждый раздел ТЗ оценивается отдельным запросом к модели (comparison_service.compare_tz_and_kp)
+    st.markdown("### Соответствие по разделам ТЗ")
     sections_data = []
     if "sections" in comparison_result:
         for section in comparison_result["sections"]:
@@ -195,26 +202,33 @@ def render_single_report_new_structure():
         # Используем данные о цене
         st.markdown(f"**Структура Цены:** {pricing}")
         
+        # Нормализованные условия: сумма, валюта, НДС и модель ценообразования
+        terms = normalization.terms_of(analysis_data)
+        if terms["price_amount"] is not None:
+            periods = {"hour": " в час", "day": " в день", "month": " в месяц", "year": " в год"}
+            vat = {"included": " (с НДС)", "excluded": " (без НДС)"}
+            st.markdown(
+                f"**Стоимость:** {normalization.format_amount(terms['price_amount'], terms['currency'])}"
+                f"{periods.get(terms['price_period'], '')}{vat.get(terms['vat'], '')}"
+            )
+        
         # Анализируем модель ценообразования
-        if "Фиксированная цена" in pricing:
+        if terms["pricing_model"] == "Fixed Price":
             st.markdown("**Тип ценовой модели:** 📌 Фиксированная цена (Fixed Price)")
             st.markdown("**Преимущества:** Предсказуемость затрат, четкие обязательства со стороны поставщика.")
             st.markdown("**Недостатки:** Меньшая гибкость при изменении требований, возможна избыточная оценка рисков исполнителем.")
-        elif "T&M" in pricing:
+        elif terms["pricing_model"] == "Time & Materials":
             st.markdown("**Тип ценовой модели:** ⏱️ Time & Materials (T&M)")
             st.markdown("**Преимущества:** Гибкость при изменении требований, прозрачность затрат.")
             st.markdown("**Недостатки:** Менее предсказуемые затраты, требует более тщательного контроля со стороны заказчика.")
-        elif "Смешанная" in pricing:
+        elif terms["pricing_model"] == "Mixed":
             st.markdown("**Тип ценовой модели:** 🔄 Смешанная модель")
             st.markdown("**Преимущества:** Баланс между предсказуемостью и гибкостью, распределение рисков.")
             st.markdown("**Недостатки:** Может быть сложнее в администрировании, требует четкого определения границ.")
         
-        # Извлекаем стоимость для сравнения с рынком
-        import re
-        price_match = re.search(r'([0-9,]+,?[0-9]*)', pricing)
-        if price_match:
-            price_str = price_match.group(1)
-            price_value = float(price_str.replace(',', ''))
+        # Сравнение с рынком - только для суммы за проект в рублях
+        if terms["price_amount"] is not None and not terms["price_period"] and terms["currency"] == "RUB":
+            price_value = terms["price_amount"]
             
             # Примерное сравнение с рыночными ценами (заглушка)
             if price_value > 5000000:
@@ -268,22 +282,18 @@ def render_single_report_new_structure():
         st.markdown("  - Организационные: _(Пример: риск недостаточной вовлеченности заказчика...)_ ")
         st.markdown("**Оценка Ключевых Рисков:** _(Требуется детальный анализ)_ ")
 
-    # Рассчитываем общую оценку
-    avg_rating = sum(ratings.values()) / len(ratings)
-    compliance = comparison_result["compliance_score"]
-    overall_score = (avg_rating * 10 + compliance) / 2  # Шкала 0-100
-    
     # Определяем наличие дополнительной информации
     has_additional_info = analysis_data.get("additional_info_analysis") is not None
-    additional_info_modifier = analysis_data.get("additional_info_analysis", {}).get("rating_impact", 0)
+    additional_info_modifier = (analysis_data.get("additional_info_analysis") or {}).get("rating_impact", 0)
     
     # Добавляем информационную карточку если есть дополнительная информация
-    if has_additional_info and additional_info_modifier > 0:
+    if has_additional_info and additional_info_modifier:
+        direction = "увеличен" if additional_info_modifier > 0 else "снижен"
         st.markdown(f"""
         <div style="padding: 10px 15px; background-color: #f0f9ff; border-radius: 5px; margin: 15px 0; border-left: 4px solid #3b82f6;">
             <p style="margin:0; font-weight:500;">
-                ⭐ Рейтинг этого предложения увеличен на <strong>{additional_info_modifier}</strong> балла 
-                благодаря учету дополнительной информации!
+                ⭐ Рейтинг этого предложения {direction} на <strong>{abs(additional_info_modifier):.1f}</strong> балла 
+                с учетом дополнительной информации.
             </p>
         </div>
         """, unsafe_allow_html=True)
@@ -312,10 +322,10 @@ def render_single_report_new_structure():
 
         st.markdown("**Предлагаемые Следующие Шаги:**")
         # Шаги зависят от рекомендации
-        if "Принять" in recommendation_final:
+        if score["level"] == "recommend":
             st.markdown("  - Начать подготовку договора.")
             st.markdown("  - Согласовать финальный план работ.")
-        elif "Доработать" in recommendation_final or "Переговоры" in recommendation_final:
+        elif score["level"] == "conditional":
             st.markdown("  - Запросить у поставщика разъяснения по критическим вопросам.")
             st.markdown("  - Провести встречу для обсуждения цены/сроков/условий.")
         else: # Отклонить
@@ -331,8 +341,9 @@ def render_single_report_new_structure():
             
             # Создаем данные для более компактной таблицы
             table_data = []
+            scores = scoring.score_results(st.session_state.all_analysis_results)
             
-            for analysis in st.session_state.all_analysis_results:
+            for analysis, rating in zip(st.session_state.all_analysis_results, scores["rating"]):
                 kp_name = analysis["kp_name"]
                 comp_name = analysis.get("company_name", kp_name)
                 
@@ -344,7 +355,7 @@ def render_single_report_new_structure():
                     "Соотв.": f"{analysis['comparison_result']['compliance_score']}%",
                     "Цена": analysis.get("pricing", "—").split(':')[-1].strip() if ":" in analysis.get("pricing", "—") else analysis.get("pricing", "—"),
                     "Сроки": analysis.get("timeline", "—").split(':')[-1].strip() if ":" in analysis.get("timeline", "—") else analysis.get("timeline", "—"),
-                    "Рейтинг": f"{round(sum(analysis.get('ratings', {}).values()) / len(analysis.get('ratings', {1: 0})), 1)}/10" if analysis.get('ratings') else "—",
+                    "Рейтинг": f"{rating:.1f}/10" if analysis.get('ratings') else "—",
                 }
                 
                 # Добавляем с выделением текущего КП
@@ -394,9 +405,9 @@ def render_single_report_new_structure():
             
             # Добавляем рекомендацию по итогам сравнения
             st.markdown("**Рекомендация по результатам сравнения:**")
-            if position == 1 and overall_score >= 75:
+            if position == 1 and score["level"] == "recommend":
                 st.markdown("✅ Данное КП является предпочтительным среди всех представленных.")
-            elif position <= total / 3 and overall_score >= 60:
+            elif position <= total / 3 and score["level"] != "reject":
                 st.markdown("✅ Данное КП входит в число лидеров и рекомендуется к дальнейшему рассмотрению.")
             elif position <= total / 2:
                 st.markdown("⚠️ Данное КП имеет среднюю позицию, рекомендуется рассмотреть более сильные предложения.")
@@ -460,7 +471,7 @@ def render_additional_info_section(additional_info):
         if "rating_impact" in additional_info:
             st.markdown(f"""
             <div style='margin-top: 10px; padding: 10px; background-color: #ecfdf5; border-radius: 4px;'>
-                <strong>Модификатор рейтинга:</strong> +{additional_info["rating_impact"]} (существенное влияние на итоговую оценку)
+                <strong>Модификатор рейтинга:</strong> {additional_info["rating_impact"]:+.1f} (по выводам дополнительных файлов об участнике)
             </div>
             """, unsafe_allow_html=True)
             
@@ -35,7 +35,9 @@ AVAILABLE_MODELS = {
     # "o1-mini (Experimental)": "o1-mini",     # Экспериментальные модели o1 недоступны
     "Claude 3.7 Sonnet (Пользовательский запрос)": "claude-3-7-sonnet-20250219",  # Корректный идентификатор с датой
     "Claude 3.5 Sonnet (Рекомендуется)": "claude-3-5-sonnet-20240620",  # Актуальная модель
-    "Claude 3 Opus": "claude-3-opus-20240229"  # Самая мощная модель Anthropic
+    "Claude 3 Opus": "claude-3-opus-20240229",  # Самая мощная модель Anthropic
+    "GPT-4o mini": "gpt-4o-mini",  # Быстрая и дешевая модель для извлечения данных
+    "Claude 3 Haiku": "claude-3-haiku-20240307"  # Быстрая модель Anthropic
 }
 
 # Критерии оценки (пример)
@@ -47,6 +49,22 @@ EVALUATION_CRITERIA = [
     {"id": "vendor_reliability", "name": "Надежность поставщика", "weight": 0.1, "description": "Опыт, репутация и ресурсы поставщика."}
 ]
 
+# Общая оценка КП (0-100): доля соответствия ТЗ, остальное - взвешенный рейтинг по критериям (x10)
+SCORING_COMPLIANCE_SHARE = 0.5
+# Пороги общей оценки для итоговой рекомендации
+SCORING_THRESHOLDS = {"recommend": 75, "conditional": 60}
+SCORING_CACHE_SIZE = 32 # Сколько последних версий набора результатов хранить
+# Автономный HTML-отчет: plotly.js встраивается в документ, SVG-версии графиков для печати требуют kaleido
+HTML_REPORT_STATIC_SVG = os.getenv("HTML_REPORT_STATIC_SVG", "false").lower() == "true"
+HTML_REPORT_WORKERS = 4 # Потоков для построения графиков отчета
+FIGURE_CACHE_SIZE = int(os.getenv("FIGURE_CACHE_SIZE", "64")) # Сколько построенных графиков хранить в памяти процесса
+# Экспорт сравнительной таблицы в PDF: страницы рисуются параллельно, готовые файлы кешируются по набору результатов
+PDF_EXPORT_WORKERS = 4 # Потоков для отрисовки страниц
+PDF_CACHE_SIZE = int(os.getenv("PDF_CACHE_SIZE", "8")) # Сколько готовых PDF хранить в памяти процесса
+# Сравнительные отчеты выводятся по разделам по мере генерации, готовые документы кешируются по запросу
+REPORT_STREAM_REFRESH_SEC = 0.3 # Как часто обновлять выводимый текст отчета во время генерации
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "8")) # Сколько готовых отчетов хранить в памяти процесса
+
 # API ключи для сервисов AI
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -55,9 +73,109 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 CLAUDE_MODEL = "claude-3-5-sonnet-20240620"
 GPT_MODEL = "gpt-4o"
 
+# Резервные модели по этапам анализа: при недоступности или деградации выбранной модели
+# запрос уходит следующей здоровой модели из списка
+STAGE_FALLBACKS = {
+    "default": ["claude-3-5-sonnet-20240620", "gpt-4o"],
+    "summary": ["gpt-4o-mini", "claude-3-haiku-20240307", "gpt-4o"],
+    "comparison": ["claude-3-5-sonnet-20240620", "gpt-4o", "claude-3-opus-20240229"],
+    "recommendation": ["gpt-4o", "claude-3-5-sonnet-20240620", "gpt-4o-mini"],
+    "digest": ["gpt-4o-mini", "claude-3-haiku-20240307", "gpt-4o"],
+    "comparative_report": ["gpt-4-turbo-preview", "claude-3-5-sonnet-20240620", "gpt-4o"],
+    "report_group": ["gpt-4o-mini", "claude-3-haiku-20240307", "gpt-4o"],
+    "pairwise": ["gpt-4o", "claude-3-5-sonnet-20240620", "gpt-4o-mini"],
+}
+
+# Параметры контроля состояния провайдеров
+ROUTER_PROBE_INTERVAL_SEC = 300      # Как часто измерять задержку моделей пробным запросом
+ROUTER_MAX_CONSECUTIVE_FAILURES = 2  # Ошибок подряд, после которых модель уходит на паузу
+ROUTER_FAILURE_COOLDOWN_SEC = 120    # Длительность паузы после серии ошибок
+ROUTER_SLOW_LATENCY_SEC = 90.0       # Сглаженная задержка, выше которой модель считается деградировавшей
+ROUTER_LATENCY_SMOOTHING = 0.3       # Вес нового замера в сглаженной задержке
+
+# Модели этапов анализа: извлечение данных КП не требует сильной модели, сравнение с ТЗ - требует.
+# model - модель этапа (None - модель, выбранная пользователем), latency_slo_sec - целевая задержка
+# ответа (модели со сглаженной задержкой выше SLO уходят в конец очереди кандидатов),
+# max_tokens - лимит ответа. Значения можно изменить в боковой панели для текущей сессии.
+STAGE_MODELS = {
+    "default": {"model": None, "latency_slo_sec": 60.0, "max_tokens": 4000},
+    "summary": {"model": "gpt-4o-mini", "latency_slo_sec": 15.0, "max_tokens": 1000},
+    "comparison": {"model": "claude-3-5-sonnet-20240620", "latency_slo_sec": 90.0, "max_tokens": 4000},
+    "recommendation": {"model": "gpt-4o", "latency_slo_sec": 30.0, "max_tokens": 2000},
+    "digest": {"model": "gpt-4o-mini", "latency_slo_sec": 30.0, "max_tokens": 1500},
+    "comparative_report": {"model": "gpt-4-turbo-preview", "latency_slo_sec": 120.0, "max_tokens": 4000},
+    "report_group": {"model": "gpt-4o-mini", "latency_slo_sec": 30.0, "max_tokens": 800},
+    "pairwise": {"model": "gpt-4o", "latency_slo_sec": 20.0, "max_tokens": 300},
+}
+# Названия этапов для интерфейса
+STAGE_LABELS = {
+    "summary": "Извлечение данных КП",
+    "comparison": "Сравнение ТЗ и КП",
+    "recommendation": "Рекомендация",
+    "digest": "Дайджест доп. файлов",
+    "comparative_report": "Сравнительный отчет",
+    "report_group": "Сводка группы КП",
+    "pairwise": "Попарное сравнение КП",
+}
+# Если выключено, все этапы используют модели, выбранные в боковой панели (как раньше)
+STAGE_TIERING_ENABLED = os.getenv("STAGE_TIERING_ENABLED", "true").lower() == "true"
+
+# Входные бюджеты токенов по этапам: максимум токенов документов в запросе
+# (лимит ответа задается max_tokens в STAGE_MODELS)
+STAGE_TOKEN_BUDGETS = {
+    "default": {"input": 24000},
+    "summary": {"input": 12000},
+    "comparison": {"input": 24000},  # ТЗ и КП делят бюджет пополам
+    "recommendation": {"input": 4000},
+    "digest": {"input": 12000},  # Один дополнительный файл
+    "comparative_report": {"input": 24000},
+    "report_group": {"input": 8000},  # Данные одной группы КП
+    "pairwise": {"input": 6000},  # Данные двух КП
+}
+
+# Средняя длина токена в символах для оценки без токенизатора (кириллица кодируется плотнее латиницы)
+CHARS_PER_TOKEN = {"cyrillic": 2.3, "other": 3.8}
+
+# Тарифы моделей, USD за 1 млн токенов: (вход, выход)
+MODEL_PRICING = {
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4-turbo-preview": (10.0, 30.0),
+    "claude-3-7-sonnet-20250219": (3.0, 15.0),
+    "claude-3-5-sonnet-20240620": (3.0, 15.0),
+    "claude-3-opus-20240229": (15.0, 75.0),
+    "claude-3-haiku-20240307": (0.25, 1.25),
+}
+
+# Хеджирование медленных запросов (опционально): если ответ не пришел за p95 задержек модели,
+# отправляется дублирующий запрос, побеждает первый валидный ответ
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "false").lower() == "true"
+HEDGE_TARGET = "alternate"             # "same" - дублировать на ту же модель, "alternate" - на резервную
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20                 # Минимум замеров задержки модели до включения хеджирования
+HEDGE_MIN_DELAY_SEC = 5.0              # Нижняя граница порога ожидания
+HEDGE_LATENCY_HISTORY = 200            # Сколько последних задержек хранить на модель
+HEDGE_RATE_WINDOW = 100                # Окно запросов для ограничения доли хеджирования
+HEDGE_MAX_RATE = 0.1                   # Не более 10% запросов в окне получают дубликат
+HEDGE_MAX_EXTRA_TOKENS = 200000        # Лимит дополнительных токенов на хеджирование за окно бюджета
+HEDGE_BUDGET_WINDOW_SEC = 3600
+HEDGE_EXPECTED_OUTPUT_TOKENS = 1500    # Оценка объема ответа при расчете стоимости дубликата
+
+# Пул HTTP-соединений для асинхронных клиентов AI (общий для всех сессий процесса)
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "200"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "50"))
+HTTP_KEEPALIVE_EXPIRY = 60.0  # Секунды простоя, после которых keep-alive соединение закрывается
+HTTP_CONNECT_TIMEOUT = 10.0
+HTTP_REQUEST_TIMEOUT = 300.0  # Длинные ответы моделей могут занимать несколько минут
+
 # Конфигурация интерфейса
 APP_ICON = "📊"
 THEME_COLOR = "#1a1c23"  # Темная тема, вдохновленная devent.world
+# Сравнительная таблица: на странице показывается одна страница выборки КП, графики - только для первых N
+COMPARISON_PAGE_SIZES = (10, 25, 50, 100)
+COMPARISON_CHART_TOP_N = 10 # Сколько КП выборки показывать на графиках по умолчанию
+COMPARISON_CHART_MAX_N = 30 # Больше КП на одном графике уже не читается
 
 # Поддерживаемые форматы файлов
 SUPPORTED_FILE_FORMATS = {
@@ -74,4 +192,71 @@ BRAND_COLORS = {
     "background": "#F4F7FC", # Светлый фон
     "text": "#0F172A",       # Тёмный текст
     "light_text": "#64748B"  # Светлый текст
-} 
\ No newline at end of file
+} 
+# Бюджет холодного старта: время импорта модулей приложения в новом процессе (секунды)
+COLD_START_BUDGET_SEC = float(os.getenv("COLD_START_BUDGET_SEC", "1.5"))
+
+# Структурированные ответы моделей
+# Модели OpenAI с поддержкой response_format json_schema (остальные используют json_object)
+OPENAI_JSON_SCHEMA_MODELS = ("gpt-4o",)
+# Сколько раз дозапрашивать недостающие или невалидные поля ответа
+STRUCTURED_REPAIR_ATTEMPTS = 1
+# Бюджет токенов на фрагмент исходного запроса в дозапросе полей (подходящие к полям абзацы)
+STRUCTURED_REPAIR_CONTEXT_TOKENS = 2000
+
+# Пакетный режим (Batch API провайдеров)
+BATCH_DIR = DATA_DIR / "batches" # Состояние пакетных заданий для продолжения опроса после перезапуска
+BATCH_POLL_INTERVAL_SEC = 60
+BATCH_COST_FACTOR = 0.5 # Пакетные запросы тарифицируются со скидкой 50%
+
+# Телеметрия вызовов моделей
+STREAM_COMPLETIONS = True # Потоковые ответы моделей (нужны для измерения времени до первого токена)
+TELEMETRY_HISTORY = 1000 # Сколько последних вызовов и спанов хранить в памяти процесса
+TELEMETRY_LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+PROMETHEUS_PORT = int(os.getenv("PROMETHEUS_PORT", "0")) # Эндпоинт метрик Prometheus (0 - не запускать)
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "devent-tender-analysis")
+
+# Планировщик допуска запросов к моделям (общий для всех сессий процесса)
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16")) # Одновременных запросов к провайдерам
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200")) # Глубина очереди, после которой новые запросы отклоняются
+ADMISSION_SERVICE_TIME_SEC = 20.0 # Начальная оценка длительности запроса для расчета времени ожидания
+ADMISSION_INTERACTIVE_STAGES = ("comparative_report", "report_group", "pairwise") # Этапы, запросы которых обслуживаются вне очереди массового анализа
+
+# Повторное использование анализа почти одинаковых КП (MinHash по шинглам слов)
+DEDUP_MODE = os.getenv("DEDUP_MODE", "offer") # auto - использовать прежний анализ сразу, offer - предложить, off - выключено
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9")) # Минимальное сходство Жаккара текстов КП
+DEDUP_SHINGLE_SIZE = 5 # Длина шингла в словах
+DEDUP_NUM_PERM = 128 # Число хеш-перестановок MinHash (точность оценки сходства ~ ±0.05)
+DEDUP_SEED = 1 # Фиксированное зерно, чтобы подписи из сохраненного индекса оставались сравнимыми
+DEDUP_MAX_ENTRIES = 500 # Сколько последних КП хранить в индексе одного ТЗ
+DEDUP_DIR = DATA_DIR / "dedup" # Индексы проанализированных КП по ТЗ
+
+# Сравнение ТЗ и КП по разделам ТЗ (каждый раздел - отдельный параллельный запрос к модели)
+COMPARISON_MAX_SECTIONS = 12 # Больше разделов - соседние объединяются
+COMPARISON_MIN_SECTION_TOKENS = 150 # Более короткие разделы присоединяются к предыдущему
+SECTION_CACHE_DIR = DATA_DIR / "section_cache" # Кеш результатов сравнения по разделам
+
+# Дайджест дополнительных файлов тендера (протоколы, письма): каждый файл разбирается один раз
+DIGEST_DIR = DATA_DIR / "digests" # Выжимки файлов по хешу содержимого
+DIGEST_MAX_RATING_IMPACT = 2.0 # Предел поправки рейтинга участника по дополнительным файлам
+
+# Нормализация стоимости и сроков КП (src/utils/normalization.py)
+NORMALIZATION_DEFAULT_CURRENCY = os.getenv("NORMALIZATION_DEFAULT_CURRENCY", "RUB") # Валюта сумм, для которых она не указана
+
+# Сравнительный отчет по большому тендеру: если данные всех КП не укладываются в бюджет этапа comparative_report,
+# лучшие КП передаются целиком, а остальные - сводками групп, которые составляются параллельно
+REPORT_SHORTLIST_K = 8 # Сколько лучших КП (по общей оценке) передавать в отчет целиком
+REPORT_SHORTLIST_SHARE = 0.6 # Доля входного бюджета отчета для шорт-листа, остальное - сводки групп
+REPORT_GROUP_SIZE = 10 # КП в одной группе (и сводок в одной группе при повторной свертке)
+
+# Турнирный рейтинг (опционально): лучшие КП по общей оценке упорядочиваются попарными сравнениями моделью
+# (сортировка слиянием), вердикт пары хранится по хешам обоих КП, новое КП вставляется двоичным поиском
+TOURNAMENT_SHORTLIST_K = int(os.getenv("TOURNAMENT_SHORTLIST_K", "8")) # Сколько лучших КП участвуют в турнире
+TOURNAMENT_DIR = DATA_DIR / "tournament" # Вердикты пар и последние итоговые порядки
+TOURNAMENT_MAX_ORDERS = 50 # Сколько последних порядков хранить для вставки новых КП
+
+# История анализов и выгрузка результатов для BI (Parquet, XLSX, JSONL)
+HISTORY_PATH = DATA_DIR / "history" / "analyses.jsonl" # Результаты анализа КП, по строке на КП (дописываются после анализа)
+EXPORT_DIR = DATA_DIR / "exports"
+EXPORT_FORMATS = ("parquet", "xlsx", "jsonl")
+EXPORT_CHUNK_ROWS = 5000 # Строк таблицы в одной группе строк Parquet (столько строк держится в памяти на таблицу)
@@ -0,0 +1,49 @@
+"""
+Схемы структурированных ответов AI моделей по этапам анализа
+"""
+
+from typing import List
+from pydantic import BaseModel, Field
+
+class KPSummary(BaseModel):
+    """Ключевые данные, извлеченные из коммерческого предложения."""
+    company_name: str = Field(description="Брендовое название компании, подавшей КП")
+    tech_stack: str = Field(description="Ключевые технологии через запятую или 'Не указано'")
+    pricing: str = Field(description="Предложенная стоимость и модель ценообразования или 'Не указано'")
+    timeline: str = Field(description="Длительность проекта и этапы или 'Не указано'")
+
+class TZKPComparison(BaseModel):
+    """Результат сравнения ТЗ и КП."""
+    compliance_score: int = Field(ge=0, le=100, description="Оценка соответствия КП требованиям ТЗ, 0-100")
+    missing_requirements: List[str] = Field(description="Требования ТЗ, не рассмотренные в КП")
+    additional_features: List[str] = Field(description="Существенные функции КП, не требуемые в ТЗ")
+
+class Recommendation(BaseModel):
+    """Предварительная рекомендация по КП."""
+    strength: List[str] = Field(description="2-4 ключевых положительных аспекта")
+    weakness: List[str] = Field(description="2-4 ключевых негативных аспекта или риска")
+    summary: str = Field(description="Краткое (1-2 предложения) общее заключение")
+
+class SectionComparison(BaseModel):
+    """Результат сравнения одного раздела ТЗ с КП."""
+    compliance: int = Field(ge=0, le=100, description="Оценка соответствия КП требованиям раздела, 0-100")
+    details: str = Field(description="Краткий (1-3 предложения) комментарий о соответствии раздела")
+    missing_requirements: List[str] = Field(description="Требования раздела, не рассмотренные в КП")
+    additional_features: List[str] = Field(description="Предложения КП по теме раздела сверх его требований")
+
+class VendorFinding(BaseModel):
+    """Вывод дополнительного документа об одном участнике тендера."""
+    vendor: str = Field(description="Название компании-участника, как оно указано в документе")
+    finding: str = Field(description="Краткий (1 предложение) вывод об участнике")
+    impact: int = Field(ge=-2, le=2, description="Влияние на оценку участника: от -2 (сильно негативное) до 2 (сильно позитивное)")
+
+class AdditionalFileDigest(BaseModel):
+    """Выжимка дополнительного документа тендера (протокол встречи, письмо, отчет)."""
+    summary: str = Field(description="Краткое (1-2 предложения) содержание документа")
+    general_findings: List[str] = Field(description="Выводы, относящиеся ко всем участникам (уточнения требований, сроков, условий)")
+    vendor_findings: List[VendorFinding] = Field(description="Выводы о конкретных участниках")
+
+class PairwiseVerdict(BaseModel):
+    """Результат попарного сравнения двух КП одного тендера."""
+    winner: int = Field(ge=1, le=2, description="Номер более сильного КП: 1 или 2")
+    reason: str = Field(description="Краткое (1-2 предложения) обоснование выбора")
@@ -0,0 +1,201 @@
+"""
+Планировщик допуска запросов к AI моделям: общий для процесса лимит одновременных запросов,
+справедливая очередь по сессиям и тендерам и приоритет интерактивных запросов
+"""
+
+import math
+import asyncio
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+from src.config import settings
+
+PRIORITIES = ("interactive", "bulk")
+
+# Сессия Streamlit и приоритет текущих запросов (переносятся в общий event loop вместе с контекстом)
+current_session = contextvars.ContextVar("llm_session", default=None)
+current_priority = contextvars.ContextVar("llm_priority", default=None)
+
+class AdmissionRejected(Exception):
+    """Очередь запросов переполнена; eta - оценка времени (сек), через которое стоит повторить."""
+
+    def __init__(self, eta: float, queued: int):
+        self.eta = eta
+        self.queued = queued
+        super().__init__(
+            f"Очередь запросов к AI моделям переполнена ({queued} в ожидании), "
+            f"повторите примерно через {math.ceil(eta)} с"
+        )
+
+@contextmanager
+def priority_scope(priority: str):
+    """Задает приоритет ("interactive" или "bulk") всем запросам к моделям внутри блока with."""
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+def bind_session():
+    """
+    Запоминает сессию Streamlit текущего потока для справедливой очереди.
+    Вызывается в потоке сессии перед передачей запроса в общий event loop.
+    """
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+    except Exception:
+        ctx = None
+    if ctx is not None:
+        current_session.set(ctx.session_id)
+
+def request_priority(stage: str = None) -> str:
+    """Приоритет запроса: заданный через priority_scope или по этапу (settings.ADMISSION_INTERACTIVE_STAGES)."""
+    priority = current_priority.get()
+    if priority is not None:
+        return priority
+    return "interactive" if stage in settings.ADMISSION_INTERACTIVE_STAGES else "bulk"
+
+class AdmissionScheduler:
+    """
+    Пропускает к провайдерам не более settings.ADMISSION_MAX_CONCURRENT запросов одновременно.
+
+    Ожидающие запросы разложены по приоритетам, внутри приоритета - по сессиям, внутри сессии -
+    по тендерам. Освободившийся слот получает интерактивный запрос, если он есть; сессии и тендеры
+    обслуживаются по кругу, поэтому анализ 80 КП одним пользователем не задерживает остальных
+    больше чем на один запрос. Если впереди слишком много запросов, новый запрос сразу отклоняется
+    с оценкой времени ожидания. Используется только из потока общего event loop.
+    """
+
+    def __init__(self):
+        self._active = 0
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self._waiting = {priority: 0 for priority in PRIORITIES}
+        self._service_time = settings.ADMISSION_SERVICE_TIME_SEC
+        self._lock = threading.Lock()
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "max_wait": 0.0}
+
+    def _queued(self, priorities=PRIORITIES) -> int:
+        return sum(self._waiting[priority] for priority in priorities)
+
+    def estimate_wait(self, priority: str) -> float:
+        """Оценка ожидания (сек) нового запроса: очередь впереди него, деленная на число слотов."""
+        ahead = self._queued(PRIORITIES[:PRIORITIES.index(priority) + 1])
+        if self._active < settings.ADMISSION_MAX_CONCURRENT and not ahead:
+            return 0.0
+        return math.ceil((ahead + 1) / settings.ADMISSION_MAX_CONCURRENT) * self._service_time
+
+    def _enqueue(self, priority: str, session_id: str, tender_id: str) -> asyncio.Future:
+        waiter = asyncio.get_running_loop().create_future()
+        tenders = self._queues[priority].setdefault(session_id, OrderedDict())
+        tenders.setdefault(tender_id, deque()).append(waiter)
+        self._waiting[priority] += 1
+        return waiter
+
+    def _remove(self, waiter: asyncio.Future):
+        for priority, sessions in self._queues.items():
+            for session_id, tenders in list(sessions.items()):
+                for tender_id, waiters in list(tenders.items()):
+                    if waiter in waiters:
+                        waiters.remove(waiter)
+                        self._waiting[priority] -= 1
+                        if not waiters:
+                            del tenders[tender_id]
+                        if not tenders:
+                            del sessions[session_id]
+                        return
+
+    def _dispatch(self):
+        """Раздает свободные слоты: сначала интерактивные запросы, сессии и тендеры - по кругу."""
+        while self._active < settings.ADMISSION_MAX_CONCURRENT:
+            priority = next((p for p in PRIORITIES if self._queues[p]), None)
+            if priority is None:
+                return
+            sessions = self._queues[priority]
+            session_id, tenders = next(iter(sessions.items()))
+            tender_id, waiters = next(iter(tenders.items()))
+            waiter = waiters.popleft()
+            self._waiting[priority] -= 1
+            # Обслуженные тендер и сессия уходят в конец круга
+            if waiters:
+                tenders.move_to_end(tender_id)
+            else:
+                del tenders[tender_id]
+            if tenders:
+                sessions.move_to_end(session_id)
+            else:
+                del sessions[session_id]
+            if waiter.cancelled():
+                # Ожидающий отменен, но еще не успел убрать себя из очереди
+                continue
+            self._active += 1
+            waiter.set_result(None)
+
+    async def acquire(self, priority: str, session_id: str = None, tender_id: str = None):
+        """
+        Ждет свободного слота для запроса.
+
+        Raises:
+            AdmissionRejected: Впереди больше settings.ADMISSION_MAX_QUEUE запросов того же или более высокого приоритета.
+        """
+        if self._active < settings.ADMISSION_MAX_CONCURRENT and not self._queued():
+            self._active += 1
+            with self._lock:
+                self._stats["admitted"] += 1
+            return
+        ahead = self._queued(PRIORITIES[:PRIORITIES.index(priority) + 1])
+        if ahead >= settings.ADMISSION_MAX_QUEUE:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise AdmissionRejected(self.estimate_wait(priority), ahead)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        waiter = self._enqueue(priority, session_id, tender_id)
+        with self._lock:
+            self._stats["queued"] += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже выдан, но ожидающий отменен - возвращаем слот следующему
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+        with self._lock:
+            self._stats["admitted"] += 1
+            self._stats["max_wait"] = max(self._stats["max_wait"], loop.time() - started)
+
+    def release(self, duration: float = None):
+        """Освобождает слот; duration - длительность запроса для оценки времени ожидания."""
+        self._active -= 1
+        if duration is not None:
+            self._service_time = 0.2 * duration + 0.8 * self._service_time
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, stage: str = None, tender_id: str = None):
+        """
+        Занимает слот на время блока async with. Сессия и приоритет берутся из контекста
+        (bind_session, priority_scope), тендер - из аргумента.
+        """
+        await self.acquire(request_priority(stage), current_session.get(), tender_id)
+        started = asyncio.get_running_loop().time()
+        try:
+            yield
+        finally:
+            self.release(asyncio.get_running_loop().time() - started)
+
+    def stats(self) -> dict:
+        """Число допущенных, ожидавших и отклоненных запросов, занятые слоты и текущая очередь."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["active"] = self._active
+        stats["waiting"] = {priority: self._queued((priority,)) for priority in PRIORITIES}
+        stats["service_time"] = self._service_time
+        return stats
+
+# Общий для процесса планировщик (используется только из потока event loop)
+scheduler = AdmissionScheduler()
@@ -4,82 +4,852 @@
 
 import os
 import json
-from anthropic import Anthropic
-from openai import OpenAI
+import queue
+import asyncio
+import contextvars
+import threading
+import importlib
+import time
+from dataclasses import dataclass, replace
 from src.config import settings
+from src.models import schemas
+from src.services import model_router, hedging, token_budget, structured_output, request_coalescing, telemetry, admission
 import streamlit as st
 
-# Инициализация клиентов
-openai_client = None
-if os.getenv("OPENAI_API_KEY"):
-    openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-else:
-    print("Warning: OpenAI API key not found.")
-
-anthropic_client = None
-if os.getenv("ANTHROPIC_API_KEY"):
-    loaded_key = os.getenv("ANTHROPIC_API_KEY")
-    print(f"[DEBUG] Loaded ANTHROPIC_API_KEY from env: {loaded_key[:10]}...{loaded_key[-4:]}") 
-    
-    # Временно захардкодим ключ для тестирования, так как он работает в test_anthropic.py
-    # Должно быть удалено после тестирования!
-    hardcoded_key = ""
-    print(f"[DEBUG] Using hardcoded key instead: {hardcoded_key[:10]}...{hardcoded_key[-4:]}")
-    
-    anthropic_client = Anthropic(api_key=hardcoded_key)
-else:
-    print("Warning: Anthropic API key not found.")
+# --- Ленивая инициализация клиентов ---
+# SDK anthropic/openai импортируются и клиенты создаются только при первом обращении,
+# чтобы старт воркера (и просмотр готовых результатов) не платил за импорт обоих SDK.
+_clients_lock = threading.Lock()
+_sync_clients = {}
+
+def _get_sync_client(provider: str):
+    """
+    Возвращает синхронный клиент провайдера, создавая его при первом обращении.
+    Клиент создается один раз на процесс; при отсутствии API-ключа возвращается None.
+
+    Args:
+        provider (str): "openai" или "anthropic".
+    """
+    if provider in _sync_clients:
+        return _sync_clients[provider]
+    with _clients_lock:
+        if provider not in _sync_clients:
+            client = None
+            if provider == "openai":
+                if os.getenv("OPENAI_API_KEY"):
+                    from openai import OpenAI
+                    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+                else:
+                    print("Warning: OpenAI API key not found.")
+            elif provider == "anthropic":
+                if os.getenv("ANTHROPIC_API_KEY"):
+                    from anthropic import Anthropic
+                    client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+                else:
+                    print("Warning: Anthropic API key not found.")
+            _sync_clients[provider] = client
+    return _sync_clients[provider]
+
+def __getattr__(name):
+    """Обратная совместимость: ai_service.openai_client / ai_service.anthropic_client создаются по требованию."""
+    if name == "openai_client":
+        return _get_sync_client("openai")
+    if name == "anthropic_client":
+        return _get_sync_client("anthropic")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# --- Асинхронный слой: общий event loop и пул соединений ---
+# Все асинхронные вызовы выполняются в одном фоновом event loop процесса,
+# поэтому сотни параллельных запросов из разных сессий не занимают по потоку на вызов.
+_async_loop = None
+_async_loop_thread = None
+_async_loop_lock = threading.Lock()
+_async_clients_ready = False
+_async_openai_client = None
+_async_anthropic_client = None
+
+def _get_async_loop() -> asyncio.AbstractEventLoop:
+    """Возвращает общий для процесса event loop, запущенный в фоновом потоке."""
+    global _async_loop, _async_loop_thread
+    with _async_loop_lock:
+        if _async_loop is None:
+            loop = asyncio.new_event_loop()
+            _async_loop_thread = threading.Thread(target=loop.run_forever, name="ai-service-loop", daemon=True)
+            _async_loop_thread.start()
+            _async_loop = loop
+    return _async_loop
+
+def _build_async_http_client(client_cls):
+    """
+    Создает HTTP-клиент SDK с настроенным пулом соединений и keep-alive.
+    Limits/Timeout берутся из того же пакета (httpx или httpx2), на котором построен клиент SDK.
+    Хук запросов считает HTTP-попытки, чтобы телеметрия видела повторы SDK.
+    """
+    http = importlib.import_module(client_cls.__mro__[1].__module__.split(".")[0])
+    return client_cls(
+        limits=http.Limits(
+            max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=http.Timeout(settings.HTTP_REQUEST_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+        event_hooks={"request": [telemetry.count_http_attempt]}
+    )
+
+def _get_async_clients():
+    """
+    Создает (при первом обращении) асинхронные клиенты, каждый со своим пулом соединений,
+    общим для всех сессий. Вызывается только из потока общего event loop, к которому привязаны пулы.
+    """
+    global _async_clients_ready, _async_openai_client, _async_anthropic_client
+    if not _async_clients_ready:
+        if os.getenv("OPENAI_API_KEY"):
+            import openai
+            from openai import AsyncOpenAI
+            _async_openai_client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=_build_async_http_client(openai.DefaultAsyncHttpxClient)
+            )
+        if os.getenv("ANTHROPIC_API_KEY"):
+            import anthropic
+            from anthropic import AsyncAnthropic
+            _async_anthropic_client = AsyncAnthropic(
+                api_key=os.getenv("ANTHROPIC_API_KEY"),
+                http_client=_build_async_http_client(anthropic.DefaultAsyncHttpxClient)
+            )
+        _async_clients_ready = True
+    return _async_openai_client, _async_anthropic_client
+
+def run_sync(coro, timeout: float = None):
+    """
+    Выполняет корутину в общем event loop и блокирует вызывающий поток до результата.
+
+    Args:
+        coro: Корутина для выполнения.
+        timeout (float, optional): Максимальное время ожидания в секундах.
+
+    Returns:
+        Результат корутины.
+    """
+    loop = _get_async_loop()
+    if threading.current_thread() is _async_loop_thread:
+        coro.close()
+        raise RuntimeError("run_sync() нельзя вызывать из общего event loop, используйте await.")
+    # Сессия вызывающего потока нужна планировщику для справедливой очереди (контекст переносится в loop)
+    admission.bind_session()
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+def get_stage_config(stage: str = None) -> dict:
+    """
+    Возвращает настройки этапа анализа: модель, лимит ответа и SLO задержки.
+
+    Берутся из settings.STAGE_MODELS с учетом настроек текущей сессии (боковая панель).
+    Если подбор моделей по этапам выключен или модель этапа не задана, используется модель,
+    выбранная пользователем (для сравнительного отчета - модель сравнения КП).
+
+    Args:
+        stage (str, optional): Этап анализа (summary, comparison, recommendation, comparative_report).
+
+    Returns:
+        dict: {"model": ..., "latency_slo_sec": ..., "max_tokens": ...}
+    """
+    config = dict(settings.STAGE_MODELS.get(stage, settings.STAGE_MODELS["default"]))
+    selected_key = "selected_comparison_model" if stage == "comparative_report" else "selected_model"
+    try:
+        tiering = st.session_state.get("stage_tiering", settings.STAGE_TIERING_ENABLED)
+        config.update(st.session_state.get("stage_config", {}).get(stage, {}))
+        selected_model = st.session_state.get(selected_key)
+    except Exception:
+        # Вне контекста Streamlit (фоновый поток, CLI) session_state недоступен
+        tiering, selected_model = settings.STAGE_TIERING_ENABLED, None
+    if not tiering or config["model"] is None:
+        config["model"] = selected_model or list(settings.AVAILABLE_MODELS.values())[0]
+    return config
+
+def _resolve_model_id(model_id: str = None, stage: str = None) -> str:
+    """Возвращает переданную модель или модель этапа для текущей сессии."""
+    if model_id is not None:
+        return model_id
+    return get_stage_config(stage)["model"]
+
+def _resolve_stage_request(model_id: str, stage: str, max_tokens: int = None, latency_slo: float = None) -> tuple:
+    """
+    Дополняет параметры запроса настройками этапа. Вызывается в потоке сессии Streamlit,
+    где доступен session_state, до передачи запроса в общий event loop.
+
+    Returns:
+        tuple: (model_id, max_tokens, latency_slo)
+    """
+    config = get_stage_config(stage)
+    return (
+        model_id or config["model"],
+        max_tokens or config["max_tokens"],
+        latency_slo if latency_slo is not None else config["latency_slo_sec"],
+    )
+
+# Метка конца общего префикса запроса (например, текста КП в запросах по разделам ТЗ): префикс до нее
+# отправляется отдельным блоком с отметкой кеширования (см. build_request_params)
+CACHE_BREAKPOINT = "\x1e"
+
+@dataclass
+class AICompletion:
+    """Результат одного запроса к модели."""
+    text: str
+    model_id: str                  # Модель, фактически обслужившая запрос
+    requested_model_id: str = None # Модель, запрошенная вызывающим кодом
+    latency: float = 0.0           # Секунды от отправки запроса до полного ответа
+    stage: str = None
+    input_tokens: int = 0          # Фактический расход токенов по данным провайдера
+    output_tokens: int = 0
+    truncated: bool = False        # Ответ оборван по лимиту max_tokens
+    coalesced: bool = False        # Ответ получен от одновременного одинакового запроса (без отдельного вызова)
+    ttft: float = None             # Время до первого токена (потоковый ответ)
+    cached_tokens: int = 0         # Входные токены из кеша промптов провайдера
+    retries: int = 0               # Повторные HTTP-попытки SDK (429/5xx/сетевые ошибки)
+    failovers: int = 0             # Сколько моделей не ответили до модели, давшей ответ
+
+# Последний ответ в текущем потоке (сессии Streamlit) - для учета фактически использованной модели
+_last_completion = threading.local()
 
-def get_ai_response(prompt: str, system_prompt: str = "You are a helpful assistant.", model_id: str = None) -> str:
+def get_last_completion():
+    """Возвращает AICompletion последнего вызова get_ai_response в текущем потоке или None."""
+    return getattr(_last_completion, "value", None)
+
+def get_last_served_model() -> str:
+    """Возвращает ID модели, фактически обслужившей последний запрос в текущем потоке."""
+    completion = get_last_completion()
+    return completion.model_id if completion else None
+
+def _openai_response_format(model_id: str, json_schema: dict) -> dict:
+    """JSON Schema режим для моделей, которые его поддерживают, иначе обычный JSON-режим."""
+    if model_id.startswith(settings.OPENAI_JSON_SCHEMA_MODELS):
+        return {"type": "json_schema", "json_schema": {"name": json_schema["name"], "schema": json_schema["schema"]}}
+    return {"type": "json_object"}
+
+def _cache_prefix(prompt: str) -> tuple:
+    """Делит запрос по CACHE_BREAKPOINT на кешируемый префикс и остаток (префикс пустой, если метки нет)."""
+    prefix, separator, rest = prompt.partition(CACHE_BREAKPOINT)
+    return (prefix, rest) if separator else ("", prompt)
+
+def build_request_params(prompt: str, system_prompt: str, model_id: str, max_tokens: int = None,
+                         json_schema: dict = None) -> dict:
+    """
+    Формирует параметры запроса к API провайдера модели.
+    Используется и для обычных вызовов, и для пакетного режима (batch_service).
+
+    Если передана json_schema (см. structured_output.build_json_schema), используется JSON-режим
+    провайдера: response_format у OpenAI и принудительный вызов инструмента у Anthropic.
+
+    Часть запроса до метки CACHE_BREAKPOINT - общий префикс серии запросов. Anthropic кеширует его
+    по явной отметке cache_control, OpenAI кеширует совпадающие префиксы сам, поэтому ему метка
+    просто убирается из текста.
+
+    Returns:
+        dict: Параметры для chat.completions.create (OpenAI) или messages.create (Anthropic).
+
+    Raises:
+        ValueError: Если провайдер модели неизвестен.
+    """
+    provider = model_router.detect_provider(model_id)
+    prefix, prompt = _cache_prefix(prompt)
+    if provider == "openai":
+        params = {
+            "model": model_id,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prefix + prompt}
+            ],
+            "temperature": 0.1, # Низкая температура для более предсказуемого извлечения
+        }
+        if max_tokens:
+            params["max_tokens"] = max_tokens
+        if json_schema:
+            params["response_format"] = _openai_response_format(model_id, json_schema)
+        return params
+    elif provider == "anthropic":
+        params = {
+            "model": model_id,
+            "system": system_prompt,
+            "messages": [
+                {"role": "user", "content": [
+                    {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+                    {"type": "text", "text": prompt},
+                ] if prefix else prompt}
+            ],
+            "max_tokens": max_tokens or 4000, # Увеличим лимит для ответа
+            "temperature": 0.1,
+        }
+        if json_schema:
+            params["tools"] = [{
+                "name": json_schema["name"],
+                "description": json_schema["description"],
+                "input_schema": json_schema["schema"]
+            }]
+            params["tool_choice"] = {"type": "tool", "name": json_schema["name"]}
+        return params
+    raise ValueError(f"Model '{model_id}' is not supported or its client is not configured.")
+
+def completion_from_response(response, model_id: str) -> AICompletion:
+    """
+    Преобразует ответ API провайдера (ChatCompletion OpenAI или Message Anthropic) в AICompletion.
+    Для ответа через инструмент Anthropic текстом становится JSON аргументов вызова.
+    """
+    if model_router.detect_provider(model_id) == "openai":
+        return _openai_completion(
+            response.choices[0].message.content, response.choices[0].finish_reason, response.usage, model_id
+        )
+    # Убедимся, что извлекаем текст правильно
+    if response.content and isinstance(response.content, list):
+        for block in response.content:
+            if getattr(block, "type", None) == "tool_use":
+                text = json.dumps(block.input, ensure_ascii=False)
+                break
+        else:
+            text = response.content[0].text if hasattr(response.content[0], 'text') else None
+        if text is not None:
+            return AICompletion(
+                text=text,
+                model_id=model_id,
+                input_tokens=response.usage.input_tokens,
+                output_tokens=response.usage.output_tokens,
+                truncated=response.stop_reason == "max_tokens",
+                cached_tokens=getattr(response.usage, "cache_read_input_tokens", None) or 0
+            )
+    raise ValueError(f"Unexpected Anthropic response format: {response}")
+
+def _openai_completion(text: str, finish_reason: str, usage, model_id: str) -> AICompletion:
+    """AICompletion из частей ответа OpenAI (полного или собранного из потока)."""
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    return AICompletion(
+        text=text,
+        model_id=model_id,
+        input_tokens=usage.prompt_tokens if usage else 0,
+        output_tokens=usage.completion_tokens if usage else 0,
+        truncated=finish_reason == "length",
+        cached_tokens=(getattr(details, "cached_tokens", None) or 0) if details else 0
+    )
+
+async def _request_completion(prompt: str, system_prompt: str, model_id: str, max_tokens: int = None,
+                              json_schema: dict = None) -> AICompletion:
+    """
+    Выполняет один запрос к конкретной модели через асинхронные клиенты. Ошибки пробрасываются.
+    Возвращает текст ответа и фактический расход токенов.
+    При переданной json_schema текст ответа - JSON-строка (см. build_request_params).
+    """
+    async_openai_client, async_anthropic_client = _get_async_clients()
+    provider = model_router.detect_provider(model_id)
+    params = build_request_params(prompt, system_prompt, model_id, max_tokens, json_schema)
+    started = time.monotonic()
+    if provider == "openai" and async_openai_client:
+        if settings.STREAM_COMPLETIONS:
+            completion = await _stream_openai(async_openai_client, params, model_id, started)
+        else:
+            response = await async_openai_client.chat.completions.create(**params)
+            completion = completion_from_response(response, model_id)
+    elif provider == "anthropic" and async_anthropic_client:
+        if settings.STREAM_COMPLETIONS:
+            completion = await _stream_anthropic(async_anthropic_client, params, model_id, started)
+        else:
+            response = await async_anthropic_client.messages.create(**params)
+            completion = completion_from_response(response, model_id)
+    else:
+        raise ValueError(f"Model '{model_id}' is not supported or its client is not configured.")
+    return completion
+
+# Получатель фрагментов текста потокового ответа (stream_ai_response): None перед началом
+# каждой попытки (после переключения на резервную модель текст начинается заново), затем фрагменты
+_text_sink = contextvars.ContextVar("text_sink", default=None)
+
+async def _stream_openai(client, params: dict, model_id: str, started: float) -> AICompletion:
+    """Потоковый запрос к OpenAI: собирает ответ и фиксирует время до первого токена."""
+    stream = await client.chat.completions.create(**params, stream=True, stream_options={"include_usage": True})
+    parts, finish_reason, usage, ttft = [], None, None, None
+    sink = _text_sink.get()
+    if sink:
+        sink(None)
+    async for chunk in stream:
+        if chunk.usage:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            if ttft is None:
+                ttft = time.monotonic() - started
+            parts.append(delta)
+            if sink:
+                sink(delta)
+        if chunk.choices[0].finish_reason:
+            finish_reason = chunk.choices[0].finish_reason
+    completion = _openai_completion("".join(parts), finish_reason, usage, model_id)
+    completion.ttft = ttft
+    return completion
+
+async def _stream_anthropic(client, params: dict, model_id: str, started: float) -> AICompletion:
+    """Потоковый запрос к Anthropic: итоговое сообщение собирает SDK, здесь фиксируется время до первого токена."""
+    ttft = None
+    sink = _text_sink.get()
+    if sink:
+        sink(None)
+    async with client.messages.stream(**params) as stream:
+        async for event in stream:
+            if event.type != "content_block_delta":
+                continue
+            if ttft is None:
+                ttft = time.monotonic() - started
+            text = getattr(event.delta, "text", None)
+            if sink and text:
+                sink(text)
+        message = await stream.get_final_message()
+    completion = completion_from_response(message, model_id)
+    completion.ttft = ttft
+    return completion
+
+async def _probe_models():
+    """Пробный минимальный запрос к каждой модели маршрутизации для обновления задержек."""
+    async def _probe(model_id):
+        started = time.monotonic()
+        try:
+            await _request_completion("ping", "Reply with one word.", model_id, max_tokens=1)
+            model_router.router.record_success(model_id, time.monotonic() - started)
+        except Exception as e:
+            model_router.router.record_failure(model_id, e)
+
+    await asyncio.gather(*[_probe(m) for m in model_router.router.probe_targets()])
+
+async def _hedged_request(prompt: str, system_prompt: str, model_id: str, candidates: list, max_tokens: int = None,
+                          json_schema: dict = None, stage: str = None) -> AICompletion:
+    """
+    Отправляет запрос и, если он не завершился за порог (p95 задержек модели), дублирует его
+    на ту же или резервную модель. Побеждает первый валидный ответ, второй запрос отменяется,
+    а его оценочный расход (см. _record_cancelled) учитывается в итогах тендера.
+
+    Returns:
+        AICompletion: Ответ победившего запроса (model_id - модель, давшая ответ).
+    """
+    policy = hedging.policy
+    slot = policy.start_request()
+    started = time.monotonic()
+    primary = asyncio.ensure_future(_request_completion(prompt, system_prompt, model_id, max_tokens, json_schema))
+    threshold = policy.threshold(model_id)
+    if threshold is None:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=threshold)
+    # Хеджируем только если основной запрос еще идет и лимиты доли/токенов позволяют
+    if done or not policy.try_acquire(slot, _estimate_hedge_tokens(prompt, system_prompt, model_id, max_tokens)):
+        return await primary
+
+    hedge_model = hedging.pick_hedge_model(model_id, candidates)
+    hedge_started = time.monotonic()
+    hedge_task = asyncio.ensure_future(_request_completion(prompt, system_prompt, hedge_model, max_tokens, json_schema))
+    pending = {primary: model_id, hedge_task: hedge_model}
+    task_started = {primary: started, hedge_task: hedge_started}
+    primary_error = None
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                served_model = pending.pop(task)
+                if task.exception() is None and task.result().text:
+                    policy.record_win(hedge_won=task is hedge_task)
+                    winner = task.result()
+                    for loser, loser_model in pending.items():
+                        _record_cancelled(prompt, system_prompt, loser_model, stage, winner,
+                                          time.monotonic() - task_started[loser], time.monotonic() - task_started[task])
+                    return winner
+                if task is primary:
+                    primary_error = task.exception() or ValueError("Empty response")
+                else:
+                    model_router.router.record_failure(served_model, task.exception() or ValueError("Empty response"))
+        raise primary_error
+    finally:
+        # Проигравший (или оба при отмене вызова) запрос отменяется, чтобы не расходовать токены
+        for task in pending:
+            task.cancel()
+
+def _record_cancelled(prompt: str, system_prompt: str, model_id: str, stage: str, winner: AICompletion,
+                      elapsed: float, winner_elapsed: float):
+    """
+    Учитывает в итогах тендера отмененный проигравший запрос: провайдер уже принял весь вход
+    и успел сгенерировать часть ответа. Вход оценивается токенизатором, выход - долей ответа
+    победителя, пропорциональной времени работы проигравшего.
+    """
+    input_tokens = token_budget.estimate_tokens(system_prompt + prompt, model_id)
+    output_tokens = round(winner.output_tokens * min(1.0, elapsed / winner_elapsed)) if winner_elapsed > 0 else 0
+    token_budget.record_usage(model_id, stage, input_tokens, output_tokens, elapsed)
+
+def _estimate_hedge_tokens(prompt: str, system_prompt: str, model_id: str, max_tokens: int = None) -> int:
+    """Оценка токенов дублирующего запроса: вход по токенизатору модели плюс ожидаемый объем ответа."""
+    expected_output = min(max_tokens or settings.HEDGE_EXPECTED_OUTPUT_TOKENS, settings.HEDGE_EXPECTED_OUTPUT_TOKENS)
+    return token_budget.estimate_tokens(system_prompt + prompt, model_id) + expected_output
+
+async def get_ai_completion_async(prompt: str, system_prompt: str = "You are a helpful assistant.",
+                                  model_id: str = None, stage: str = None, hedge: bool = None,
+                                  max_tokens: int = None, json_schema: dict = None,
+                                  latency_slo: float = None) -> AICompletion:
+    """
+    Выполняет запрос через маршрутизатор моделей: при ошибке выбранной модели запрос
+    повторяется на резервных моделях этапа (settings.STAGE_FALLBACKS).
+
+    Args:
+        prompt (str): Основной запрос к модели.
+        system_prompt (str): Системная инструкция для модели.
+        model_id (str, optional): Предпочтительная модель. Если None, используется модель этапа.
+        stage (str, optional): Этап анализа (summary, comparison, recommendation, comparative_report).
+        hedge (bool, optional): Хеджировать медленные запросы. Если None, берется settings.HEDGING_ENABLED.
+        max_tokens (int, optional): Лимит токенов ответа. Если None, берется выходной бюджет этапа.
+        json_schema (dict, optional): Схема ответа для JSON-режима провайдера.
+        latency_slo (float, optional): Целевая задержка этапа, сек. Если None, берется из settings.STAGE_MODELS.
+
+    Returns:
+        AICompletion: Ответ, модель, которая его фактически сформировала, и расход токенов.
+
+    Одинаковые одновременные запросы (та же модель, инструкции, запрос, лимит и схема)
+    объединяются: к провайдеру уходит один запрос, остальные получают его ответ.
+    Запросы к провайдерам проходят через общий планировщик допуска (admission.scheduler).
+
+    Raises:
+        admission.AdmissionRejected: Очередь запросов переполнена (с оценкой времени ожидания).
+        Exception: Последняя ошибка, если ни одна модель не ответила.
+    """
+    if model_id is None or max_tokens is None or latency_slo is None:
+        model_id, max_tokens, latency_slo = _resolve_stage_request(model_id, stage, max_tokens, latency_slo)
+
+    async def _admitted_completion():
+        # Слот планировщика занимает только исходный запрос; присоединившиеся дубли его не ждут
+        async with admission.scheduler.slot(stage, token_budget.current_tender.get()):
+            return await _route_completion(prompt, system_prompt, model_id, stage, hedge, max_tokens, json_schema, latency_slo)
+
+    key = request_coalescing.make_cache_key(model_id, system_prompt, prompt, max_tokens, json_schema)
+    completion, joined = await request_coalescing.coalescer.run(key, _admitted_completion)
+    # Каждый вызывающий получает свою копию ответа; расход токенов учтен только у исходного запроса
+    completion = replace(completion, coalesced=joined)
+    if joined:
+        telemetry.record_call(_call_record(completion, stage, model_id, cache_hit=True))
+    return completion
+
+def _call_record(completion: AICompletion, stage: str, requested_model_id: str, cache_hit: bool = False) -> telemetry.CallRecord:
+    """Запись телеметрии об успешном вызове (для объединенного запроса - без токенов и стоимости)."""
+    if cache_hit:
+        return telemetry.CallRecord(
+            timestamp=time.time(), stage=stage, model_id=completion.model_id, requested_model_id=requested_model_id,
+            status="ok", latency=0.0, cache_hit=True, tender_id=token_budget.current_tender.get()
+        )
+    return telemetry.CallRecord(
+        timestamp=time.time(),
+        stage=stage,
+        model_id=completion.model_id,
+        requested_model_id=requested_model_id,
+        status="ok",
+        latency=completion.latency,
+        ttft=completion.ttft,
+        input_tokens=completion.input_tokens,
+        output_tokens=completion.output_tokens,
+        cached_tokens=completion.cached_tokens,
+        retries=completion.retries,
+        failovers=completion.failovers,
+        cost=token_budget.calculate_cost(completion.model_id, completion.input_tokens, completion.output_tokens),
+        tender_id=token_budget.current_tender.get()
+    )
+
+async def _route_completion(prompt: str, system_prompt: str, model_id: str, stage: str, hedge: bool,
+                            max_tokens: int, json_schema: dict, latency_slo: float = None) -> AICompletion:
+    """Перебирает кандидатов маршрутизатора до первого успешного ответа (см. get_ai_completion_async)."""
+    router = model_router.router
+    if router.probe_due():
+        # Пробы запускаются в пустом контексте: задача иначе унаследовала бы получателя
+        # потокового ответа (_text_sink) и тендер вызывающего запроса
+        contextvars.Context().run(asyncio.ensure_future, _probe_models())
+
+    if hedge is None:
+        hedge = settings.HEDGING_ENABLED
+
+    last_error = None
+    candidates = router.candidates(model_id, stage, latency_slo)
+    for candidate in candidates:
+        started = time.monotonic()
+        # Попытки считаются хуком HTTP-клиента; при хеджировании дублирующий запрос тоже считается попыткой
+        attempts = telemetry.track_http_attempts()
+        try:
+            with telemetry.span(f"llm.{stage or 'other'}", model=candidate):
+                if hedge:
+                    completion = await _hedged_request(prompt, system_prompt, candidate, candidates, max_tokens, json_schema, stage)
+                else:
+                    completion = await _request_completion(prompt, system_prompt, candidate, max_tokens, json_schema)
+        except Exception as e:
+            router.record_failure(candidate, e)
+            last_error = e
+            print(f"Ошибка при вызове AI модели ({candidate}), переключение на резервную: {e}")
+            telemetry.record_call(telemetry.CallRecord(
+                timestamp=time.time(), stage=stage, model_id=candidate, requested_model_id=model_id,
+                status="error", latency=time.monotonic() - started, error=str(e), retries=max(0, attempts[0] - 1),
+                tender_id=token_budget.current_tender.get()
+            ))
+            continue
+        completion.latency = time.monotonic() - started
+        completion.requested_model_id = model_id
+        completion.stage = stage
+        completion.failovers = candidates.index(candidate)
+        completion.retries = max(0, attempts[0] - 1)
+        router.record_success(completion.model_id, completion.latency)
+        hedging.policy.record_latency(completion.model_id, completion.latency)
+        token_budget.record_usage(completion.model_id, stage, completion.input_tokens, completion.output_tokens,
+                                  completion.latency, latency_slo=latency_slo)
+        telemetry.record_call(_call_record(completion, stage, model_id))
+        return completion
+    raise last_error
+
+async def get_ai_response_async(prompt: str, system_prompt: str = "You are a helpful assistant.",
+                                model_id: str = None, stage: str = None, hedge: bool = None,
+                                max_tokens: int = None, latency_slo: float = None) -> str:
+    """
+    Асинхронно получает ответ от выбранной AI модели.
+    Запросы используют общий пул соединений, поэтому их можно запускать сотнями через asyncio.gather.
+
+    Args:
+        prompt (str): Основной запрос к модели.
+        system_prompt (str): Системная инструкция для модели.
+        model_id (str, optional): ID модели. Если None, используется модель этапа.
+        stage (str, optional): Этап анализа для выбора модели и резервных моделей.
+        hedge (bool, optional): Хеджировать медленные запросы. Если None, берется settings.HEDGING_ENABLED.
+        max_tokens (int, optional): Лимит токенов ответа. Если None, берется из настроек этапа.
+        latency_slo (float, optional): Целевая задержка этапа, сек.
+
+    Returns:
+        str: Ответ модели или строка, начинающаяся с "Error:", в случае ошибки.
+    """
+    model_id = _resolve_model_id(model_id, stage)
+    try:
+        completion = await get_ai_completion_async(prompt, system_prompt, model_id, stage, hedge,
+                                                   max_tokens=max_tokens, latency_slo=latency_slo)
+        return completion.text
+    except Exception as e:
+        print(f"Ошибка при вызове AI модели ({model_id}): {e}")
+        return f"Error: Exception during AI call - {e}"
+
+def _warn_failover(completion: AICompletion, model_id: str):
+    """
+    Предупреждает о переключении на резервную модель. Ответ другой модели сам по себе
+    не означает недоступность: его мог дать хеджирующий запрос к альтернативной модели,
+    поэтому предупреждение выводится только если до ответившей модели были ошибки.
+    """
+    if completion.failovers:
+        st.warning(f"Модель {model_id} недоступна, ответ получен от резервной модели {completion.model_id}.")
+
+def get_ai_response(prompt: str, system_prompt: str = "You are a helpful assistant.",
+                    model_id: str = None, stage: str = None, hedge: bool = None,
+                    max_tokens: int = None) -> str:
     """
     Получает ответ от выбранной AI модели.
+    Фактически использованную модель можно узнать через get_last_served_model().
 
     Args:
         prompt (str): Основной запрос к модели.
         system_prompt (str): Системная инструкция для модели.
-        model_id (str, optional): ID модели для использования. Если None, используется модель из session_state.
+        model_id (str, optional): ID модели для использования. Если None, используется модель этапа (get_stage_config).
+        stage (str, optional): Этап анализа для выбора модели, лимита ответа и резервных моделей.
+        hedge (bool, optional): Хеджировать медленные запросы. Если None, берется settings.HEDGING_ENABLED.
+        max_tokens (int, optional): Лимит токенов ответа. Если None, берется из настроек этапа.
 
     Returns:
         str: Ответ модели.
     """
-    if model_id is None:
-        model_id = st.session_state.get("selected_model", list(settings.AVAILABLE_MODELS.values())[0])
-    
-    # Убираем замену модели Claude 3.7 Sonnet
-    # Claude 3.7 Sonnet существует и должен использоваться без замены
+    model_id, max_tokens, latency_slo = _resolve_stage_request(model_id, stage, max_tokens)
+    _last_completion.value = None
 
     try:
-        if "gpt" in model_id and openai_client:
-            response = openai_client.chat.completions.create(
-                model=model_id,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1 # Низкая температура для более предсказуемого извлечения
-            )
-            return response.choices[0].message.content
-        elif "claude" in model_id and anthropic_client:
-            response = anthropic_client.messages.create(
-                model=model_id,
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=4000, # Увеличим лимит для ответа
-                temperature=0.1
-            )
-            # Убедимся, что извлекаем текст правильно
-            if response.content and isinstance(response.content, list) and hasattr(response.content[0], 'text'):
-                return response.content[0].text
-            else:
-                 print(f"Unexpected Anthropic response format: {response}")
-                 return "Error: Could not parse Anthropic response."
-        else:
-            return f"Error: Model '{model_id}' is not supported or its client is not configured."
+        completion = run_sync(get_ai_completion_async(prompt, system_prompt, model_id, stage, hedge,
+                                                      max_tokens=max_tokens, latency_slo=latency_slo))
+    except admission.AdmissionRejected as e:
+        st.warning(str(e))
+        return f"Error: {e}"
     except Exception as e:
         st.error(f"Ошибка при вызове AI модели ({model_id}): {e}")
         return f"Error: Exception during AI call - {e}"
+    _last_completion.value = completion
+    _warn_failover(completion, model_id)
+    return completion.text
+
+def stream_ai_response(prompt: str, system_prompt: str = "You are a helpful assistant.",
+                       model_id: str = None, stage: str = None, max_tokens: int = None):
+    """
+    Получает ответ модели по мере генерации (генератор для вывода длинных отчетов).
+    Запрос проходит тот же путь, что и get_ai_response (резервные модели, планировщик допуска,
+    учет расхода), но без хеджирования: дублирующий запрос писал бы в тот же поток.
+
+    Args:
+        prompt (str): Основной запрос к модели.
+        system_prompt (str): Системная инструкция для модели.
+        model_id (str, optional): ID модели. Если None, используется модель этапа.
+        stage (str, optional): Этап анализа для выбора модели, лимита ответа и резервных моделей.
+        max_tokens (int, optional): Лимит токенов ответа. Если None, берется из настроек этапа.
+
+    Yields:
+        str: Накопленный текст ответа. Последнее значение - полный ответ модели или строка,
+        начинающаяся с "Error:", в случае ошибки. При переключении на резервную модель текст начинается заново.
+    """
+    model_id, max_tokens, latency_slo = _resolve_stage_request(model_id, stage, max_tokens)
+    _last_completion.value = None
+    if threading.current_thread() is _async_loop_thread:
+        raise RuntimeError("stream_ai_response() нельзя вызывать из общего event loop.")
+
+    chunks = queue.Queue()
+    done = object()
+
+    async def _streamed_completion():
+        _text_sink.set(chunks.put)
+        return await get_ai_completion_async(prompt, system_prompt, model_id, stage, hedge=False,
+                                             max_tokens=max_tokens, latency_slo=latency_slo)
+
+    loop = _get_async_loop()
+    admission.bind_session()
+    future = asyncio.run_coroutine_threadsafe(_streamed_completion(), loop)
+    future.add_done_callback(lambda _: chunks.put(done))
+
+    text = ""
+    while True:
+        chunk = chunks.get()
+        if chunk is done:
+            break
+        text = "" if chunk is None else text + chunk
+        if text:
+            yield text
+
+    try:
+        completion = future.result()
+    except admission.AdmissionRejected as e:
+        st.warning(str(e))
+        yield f"Error: {e}"
+        return
+    except Exception as e:
+        st.error(f"Ошибка при вызове AI модели ({model_id}): {e}")
+        yield f"Error: Exception during AI call - {e}"
+        return
+    _last_completion.value = completion
+    _warn_failover(completion, model_id)
+    yield completion.text
+
+async def get_structured_response_async(prompt: str, system_prompt: str, schema_cls, model_id: str = None,
+                                        stage: str = None, hedge: bool = None, max_tokens: int = None,
+                                        latency_slo: float = None):
+    """
+    Запрашивает у модели ответ по схеме и проверяет его.
+
+    Ответ разбирается терпимо (обертки ```json, текст вокруг объекта, оборванный по лимиту JSON).
+    Если часть полей отсутствует или не проходит проверку, модели отправляется короткий
+    дополнительный запрос только за этими полями (до settings.STRUCTURED_REPAIR_ATTEMPTS раз):
+    уже полученные поля, схема недостающих и фрагмент исходного запроса не больше
+    settings.STRUCTURED_REPAIR_CONTEXT_TOKENS, а не весь исходный запрос.
+
+    Args:
+        prompt (str): Основной запрос к модели.
+        system_prompt (str): Системная инструкция для модели.
+        schema_cls: Pydantic-модель ответа из src.models.schemas.
+        model_id (str, optional): ID модели. Если None, используется модель этапа.
+        stage (str, optional): Этап анализа для выбора модели, резервных моделей и бюджета токенов.
+        hedge (bool, optional): Хеджировать медленные запросы.
+        max_tokens (int, optional): Лимит токенов ответа. Если None, берется из настроек этапа.
+        latency_slo (float, optional): Целевая задержка этапа, сек.
+
+    Returns:
+        tuple: (словарь валидных полей, список полей, которые получить не удалось, AICompletion основного запроса)
+
+    Raises:
+        Exception: Ошибка основного запроса, если ни одна модель не ответила.
+    """
+    json_schema = structured_output.build_json_schema(schema_cls)
+    completion = await get_ai_completion_async(prompt, system_prompt, model_id, stage, hedge, max_tokens,
+                                               json_schema=json_schema, latency_slo=latency_slo)
+    data, missing = structured_output.validate_fields(structured_output.parse_json_tolerant(completion.text), schema_cls)
+
+    for _ in range(settings.STRUCTURED_REPAIR_ATTEMPTS):
+        if not missing:
+            break
+        print(f"Ответ модели {completion.model_id} неполный (поля: {', '.join(missing)}), дозапрос недостающих полей")
+        try:
+            repair = await get_ai_completion_async(
+                structured_output.build_repair_prompt(
+                    prompt.replace(CACHE_BREAKPOINT, ""), data, schema_cls, missing,
+                    settings.STRUCTURED_REPAIR_CONTEXT_TOKENS, completion.model_id
+                ),
+                system_prompt,
+                completion.model_id,
+                stage,
+                hedge,
+                max_tokens,
+                json_schema=structured_output.build_repair_schema(schema_cls, missing),
+                latency_slo=latency_slo
+            )
+        except Exception as e:
+            print(f"Ошибка при дозапросе полей ({completion.model_id}): {e}")
+            break
+        repaired, _ = structured_output.validate_fields(
+            {**data, **(structured_output.parse_json_tolerant(repair.text) or {})}, schema_cls
+        )
+        data = repaired
+        missing = [name for name in schema_cls.model_fields if name not in data]
+    return data, missing, completion
+
+def get_structured_response(prompt: str, system_prompt: str, schema_cls, model_id: str = None,
+                            stage: str = None, hedge: bool = None, max_tokens: int = None):
+    """
+    Синхронная обертка над get_structured_response_async для вызова из сессии Streamlit.
+    Модель, лимит ответа и SLO задержки по умолчанию берутся из настроек этапа (get_stage_config).
+
+    Returns:
+        tuple: (словарь валидных полей, список полей, которые получить не удалось).
+        При ошибке вызова модели возвращается (None, все поля схемы).
+    """
+    model_id, max_tokens, latency_slo = _resolve_stage_request(model_id, stage, max_tokens)
+    _last_completion.value = None
+
+    try:
+        data, missing, completion = run_sync(
+            get_structured_response_async(prompt, system_prompt, schema_cls, model_id, stage, hedge,
+                                          max_tokens, latency_slo)
+        )
+    except admission.AdmissionRejected as e:
+        st.warning(str(e))
+        return None, list(schema_cls.model_fields)
+    except Exception as e:
+        st.error(f"Ошибка при вызове AI модели ({model_id}): {e}")
+        return None, list(schema_cls.model_fields)
+    _last_completion.value = completion
+    _warn_failover(completion, model_id)
+    return data, missing
+
+def gather_ai_responses(requests: list) -> list:
+    """
+    Параллельно выполняет несколько запросов к моделям в общем event loop.
+
+    Args:
+        requests (list): Список словарей с ключами prompt, system_prompt, model_id, stage и max_tokens
+            (все, кроме prompt, опциональны).
+
+    Returns:
+        list: Ответы моделей в том же порядке, что и запросы.
+    """
+    async def _gather():
+        return await asyncio.gather(*[
+            get_ai_response_async(
+                req["prompt"],
+                req.get("system_prompt", "You are a helpful assistant."),
+                model_id=req["model_id"],
+                stage=req.get("stage"),
+                max_tokens=req["max_tokens"],
+                latency_slo=req["latency_slo"]
+            )
+            for req in requests
+        ])
+
+    # Настройки этапов определяем в потоке вызывающей сессии, где доступен session_state
+    resolved = []
+    for req in requests:
+        model_id, max_tokens, latency_slo = _resolve_stage_request(req.get("model_id"), req.get("stage"), req.get("max_tokens"))
+        resolved.append({**req, "model_id": model_id, "max_tokens": max_tokens, "latency_slo": latency_slo})
+    requests = resolved
+    return run_sync(_gather())
 
 def analyze_with_claude(text, prompt, max_tokens=4000):
     """
@@ -93,6 +863,7 @@ def analyze_with_claude(text, prompt, max_tokens=4000):
     Returns:
         str: Результат анализа или None в случае ошибки
     """
+    anthropic_client = _get_sync_client("anthropic")
     if not anthropic_client:
         print("Ошибка: API ключ для Claude не настроен")
         return None
@@ -128,6 +899,7 @@ def generate_with_gpt(prompt, data, max_tokens=4000):
     Returns:
         str: Сгенерированный текст или None в случае ошибки
     """
+    openai_client = _get_sync_client("openai")
     if not openai_client:
         print("Ошибка: API ключ для OpenAI не настроен")
         return None
@@ -148,11 +920,70 @@ def generate_with_gpt(prompt, data, max_tokens=4000):
         print(f"Ошибка при обращении к API OpenAI: {e}")
         return None
 
-def extract_kp_summary_data(kp_text: str) -> dict:
+# Схемы ответов и значения по умолчанию для полей, которые модель не вернула
+STAGE_SCHEMAS = {
+    "summary": schemas.KPSummary,
+    "comparison": schemas.TZKPComparison,
+    "recommendation": schemas.Recommendation,
+}
+
+STAGE_DEFAULTS = {
+    "summary": {
+        "company_name": "Unknown Company",
+        "tech_stack": "Not specified",
+        "pricing": "Not specified",
+        "timeline": "Not specified"
+    },
+    "comparison": {
+        "compliance_score": 0,
+        "missing_requirements": [],
+        "additional_features": []
+    },
+    "recommendation": {
+        "strength": [],
+        "weakness": [],
+        "summary": "Could not generate summary."
+    },
+}
+
+# Результаты этапов, если модель не ответила совсем
+STAGE_ERRORS = {
+    "summary": {
+        "company_name": "Error Parsing AI Response",
+        "tech_stack": "Error",
+        "pricing": "Error",
+        "timeline": "Error"
+    },
+    "comparison": {"compliance_score": 0, "missing_requirements": ["Error parsing AI response"], "additional_features": []},
+    "recommendation": {"strength": ["Error parsing AI response"], "weakness": [], "summary": "Error"},
+}
+
+def apply_stage_defaults(stage: str, data: dict) -> dict:
     """
-    Извлекает основные данные из текста КП с помощью AI.
-    Возвращает словарь с ключами: company_name, tech_stack, pricing, timeline.
-    Ответ должен быть на русском языке.
+    Дополняет проверенный ответ этапа значениями по умолчанию.
+
+    Args:
+        stage (str): summary, comparison или recommendation.
+        data (dict | None): Валидные поля ответа; None, если модель не ответила.
+
+    Returns:
+        dict: Полный результат этапа.
+    """
+    if data is None:
+        return {key: (list(value) if isinstance(value, list) else value) for key, value in STAGE_ERRORS[stage].items()}
+    result = {key: (list(value) if isinstance(value, list) else value) for key, value in STAGE_DEFAULTS[stage].items()}
+    # Обновляем значения по умолчанию только непустыми значениями, прошедшими проверку схемы
+    for key, value in data.items():
+        if value or value == 0:
+            result[key] = value
+    return result
+
+def build_kp_summary_request(kp_text: str):
+    """
+    Формирует запрос на извлечение ключевых данных из КП.
+
+    Returns:
+        tuple: (системная инструкция, запрос)
     """
     system_prompt = (
         "Ты — эксперт-аналитик, специализирующийся на извлечении ключевой информации из коммерческих предложений (КП) "
@@ -168,57 +999,14 @@ def extract_kp_summary_data(kp_text: str) -> dict:
     )
     
     prompt = f"Проанализируй следующий текст коммерческого предложения и извлеки требуемую информацию в формате JSON (на русском языке):\n\n---\n{kp_text}\n---"
-    
-    response_text = get_ai_response(prompt, system_prompt)
-    
-    # Попытка распарсить JSON
-    try:
-        # Иногда модели добавляют ```json ... ```, удалим это
-        if response_text.strip().startswith("```json"):
-             response_text = response_text.strip()[7:-3].strip()
-        elif response_text.strip().startswith("```"):
-             response_text = response_text.strip()[3:-3].strip()
-             
-        extracted_data = json.loads(response_text)
-        # Проверяем наличие ключей, добавляем значения по умолчанию если отсутствуют
-        default_data = {
-            "company_name": "Unknown Company",
-            "tech_stack": "Not specified",
-            "pricing": "Not specified",
-            "timeline": "Not specified"
-        }
-        # Обновляем default_data только теми ключами, что есть в extracted_data
-        # и имеют непустые значения
-        for key in default_data.keys():
-            if key in extracted_data and extracted_data[key]:
-                default_data[key] = extracted_data[key]
-                
-        return default_data
-        
-    except json.JSONDecodeError as e:
-        st.error(f"Не удалось распознать JSON от AI: {e}\nОтвет модели:\n{response_text}")
-        # Возвращаем структуру по умолчанию в случае ошибки парсинга
-        return {
-            "company_name": "Error Parsing AI Response",
-            "tech_stack": "Error",
-            "pricing": "Error",
-            "timeline": "Error"
-        }
-    except Exception as e:
-        st.error(f"Неожиданная ошибка при обработке ответа AI: {e}")
-        return {
-            "company_name": "Unexpected Error",
-            "tech_stack": "Error",
-            "pricing": "Error",
-            "timeline": "Error"
-        }
-        
+    return system_prompt, prompt
 
-def compare_tz_kp(tz_text: str, kp_text: str) -> dict:
+def build_comparison_request(tz_text: str, kp_text: str):
     """
-    Сравнивает ТЗ и КП с помощью AI, возвращает оценку соответствия, 
-    списки пропущенных и добавленных требований.
-    Ответ должен быть на русском языке.
+    Формирует запрос на сравнение ТЗ и КП.
+
+    Returns:
+        tuple: (системная инструкция, запрос)
     """
     system_prompt = (
         "Ты — AI-ассистент, специализирующийся на сравнении технических заданий (ТЗ) с коммерческими предложениями (КП) "
@@ -237,45 +1025,16 @@ def compare_tz_kp(tz_text: str, kp_text: str) -> dict:
         f"=== КП (Commercial Proposal) ===\n{kp_text}\n\n"
         f"Верни ТОЛЬКО JSON-объект."
     )
-    
-    response_text = get_ai_response(prompt, system_prompt)
-    
-    try:
-        # Очистка от ```json ... ```
-        if response_text.strip().startswith("```json"):
-            response_text = response_text.strip()[7:-3].strip()
-        elif response_text.strip().startswith("```"):
-             response_text = response_text.strip()[3:-3].strip()
-             
-        comparison_data = json.loads(response_text)
-        
-        # Проверка и установка значений по умолчанию
-        default_data = {
-            "compliance_score": 0,
-            "missing_requirements": [],
-            "additional_features": []
-        }
-        # Обновление значений, если они есть и корректны
-        if isinstance(comparison_data.get("compliance_score"), int):
-             default_data["compliance_score"] = comparison_data["compliance_score"]
-        if isinstance(comparison_data.get("missing_requirements"), list):
-             default_data["missing_requirements"] = [str(item) for item in comparison_data["missing_requirements"]]
-        if isinstance(comparison_data.get("additional_features"), list):
-             default_data["additional_features"] = [str(item) for item in comparison_data["additional_features"]]
-             
-        return default_data
-        
-    except json.JSONDecodeError as e:
-        st.error(f"Не удалось распознать JSON сравнения от AI: {e}\nОтвет модели:\n{response_text}")
-        return {"compliance_score": 0, "missing_requirements": ["Error parsing AI response"], "additional_features": []}
-    except Exception as e:
-        st.error(f"Неожиданная ошибка при обработке ответа сравнения AI: {e}")
-        return {"compliance_score": 0, "missing_requirements": ["Unexpected error"], "additional_features": []}
+    return system_prompt, prompt
 
-def generate_recommendation(comparison_result: dict, kp_summary: dict) -> dict:
+def build_recommendation_request(comparison_result: dict, kp_summary: dict, additional_info: dict = None):
     """
-    Генерирует предварительную рекомендацию на основе результатов сравнения и обзора КП.
-    Ответ должен быть на русском языке.
+    Формирует запрос на предварительную рекомендацию по результатам сравнения и обзору КП.
+    additional_info - срез дайджеста дополнительных файлов для этого КП (tender_digest.vendor_slice):
+    в запрос попадают только выводы об этом участнике и общие выводы тендера, а не тексты файлов.
+
+    Returns:
+        tuple: (системная инструкция, запрос)
     """
     system_prompt = (
         "Ты — AI-аналитик, предоставляющий предварительные рекомендации по коммерческим предложениям (КП), основываясь на их сравнении с техническими заданиями (ТЗ) и кратком обзоре КП. "
@@ -298,37 +1057,43 @@ def generate_recommendation(comparison_result: dict, kp_summary: dict) -> dict:
         f"Упущенные требования: {'; '.join(comparison_result.get('missing_requirements', [])) if comparison_result.get('missing_requirements') else 'Нет'}\n"
         f"Дополнительные функции: {'; '.join(comparison_result.get('additional_features', [])) if comparison_result.get('additional_features') else 'Нет'}\n"
     )
+    if additional_info and additional_info.get("key_findings"):
+        findings = "\n".join(f"- {finding}" for finding in additional_info["key_findings"])
+        prompt += f"\n=== Сведения из дополнительных файлов тендера ===\n{findings}\n"
+    return system_prompt, prompt
 
-    response_text = get_ai_response(prompt, system_prompt)
+def extract_kp_summary_data(kp_text: str) -> dict:
+    """
+    Извлекает основные данные из текста КП с помощью AI.
+    Возвращает словарь с ключами: company_name, tech_stack, pricing, timeline.
+    Ответ должен быть на русском языке.
+    """
+    system_prompt, prompt = build_kp_summary_request(kp_text)
+    extracted_data, missing = get_structured_response(prompt, system_prompt, schemas.KPSummary, stage="summary")
+    if extracted_data is not None and missing:
+        st.warning(f"AI не вернул часть данных КП: {', '.join(missing)}")
+    return apply_stage_defaults("summary", extracted_data)
 
-    try:
-        # Очистка от ```json ... ```
-        if response_text.strip().startswith("```json"):
-            response_text = response_text.strip()[7:-3].strip()
-        elif response_text.strip().startswith("```"):
-             response_text = response_text.strip()[3:-3].strip()
-             
-        recommendation_data = json.loads(response_text)
-        
-        # Проверка и установка значений по умолчанию
-        default_data = {
-            "strength": [],
-            "weakness": [],
-            "summary": "Could not generate summary."
-        }
-        # Обновление значений
-        if isinstance(recommendation_data.get("strength"), list):
-            default_data["strength"] = [str(item) for item in recommendation_data["strength"]]
-        if isinstance(recommendation_data.get("weakness"), list):
-            default_data["weakness"] = [str(item) for item in recommendation_data["weakness"]]
-        if isinstance(recommendation_data.get("summary"), str):
-            default_data["summary"] = recommendation_data["summary"]
-            
-        return default_data
-
-    except json.JSONDecodeError as e:
-        st.error(f"Не удалось распознать JSON рекомендации от AI: {e}\nОтвет модели:\n{response_text}")
-        return {"strength": ["Error parsing AI response"], "weakness": [], "summary": "Error"}
-    except Exception as e:
-        st.error(f"Неожиданная ошибка при обработке ответа рекомендации AI: {e}")
-        return {"strength": [], "weakness": ["Unexpected error"], "summary": "Error"} 
+def compare_tz_kp(tz_text: str, kp_text: str) -> dict:
+    """
+    Сравнивает ТЗ и КП с помощью AI, возвращает оценку соответствия, 
+    списки пропущенных и добавленных требований.
+    Ответ должен быть на русском языке.
+    """
+    system_prompt, prompt = build_comparison_request(tz_text, kp_text)
+    comparison_data, missing = get_structured_response(prompt, system_prompt, schemas.TZKPComparison, stage="comparison")
+    if comparison_data is not None and missing:
+        st.warning(f"AI не вернул часть результатов сравнения: {', '.join(missing)}")
+    return apply_stage_defaults("comparison", comparison_data)
+
+def generate_recommendation(comparison_result: dict, kp_summary: dict, additional_info: dict = None) -> dict:
+    """
+    Генерирует предварительную рекомендацию на основе результатов сравнения, обзора КП
+    и среза дайджеста дополнительных файлов для этого КП (если есть).
+    Ответ должен быть на русском языке.
+    """
+    system_prompt, prompt = build_recommendation_request(comparison_result, kp_summary, additional_info)
+    recommendation_data, missing = get_structured_response(prompt, system_prompt, schemas.Recommendation, stage="recommendation")
+    if recommendation_data is not None and missing:
+        st.warning(f"AI не вернул часть рекомендации: {', '.join(missing)}")
+    return apply_stage_defaults("recommendation", recommendation_data)
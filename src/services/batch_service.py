@@ -0,0 +1,343 @@
+"""
+Пакетный режим анализа тендеров через Batch API провайдеров (Anthropic Message Batches, OpenAI Batch)
+
+Для ночной переоценки больших архивов задержка не важна, а пакетные запросы стоят дешевле
+и не упираются в лимиты интерактивных вызовов. Задание выполняется в две фазы: сначала
+извлечение данных КП и сравнение с ТЗ, затем рекомендации (им нужны результаты первой фазы).
+Состояние задания сохраняется в settings.BATCH_DIR, поэтому опрос продолжается после перезапуска.
+
+Запуск из командной строки:
+    python -m src.services.batch_service submit ТЗ.pdf КП1.pdf КП2.docx --model claude-3-5-sonnet-20240620
+    python -m src.services.batch_service resume <job_id>
+    python -m src.services.batch_service status [<job_id>]
+
+Для проверки без обращения к провайдерам используется fake_llm_server.py
+(ANTHROPIC_BASE_URL / OPENAI_BASE_URL указывают на него).
+"""
+
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from src.config import settings
+from src.utils import file_utils
+from src.services import ai_service, model_router, structured_output, token_budget, export_service
+
+# Фазы задания: analysis (этапы summary и comparison), затем recommendation
+PHASE_ORDER = ["analysis", "recommendation", "done"]
+
+# Статусы OpenAI Batch, после которых результаты больше не изменятся
+_OPENAI_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def _job_path(job_id: str) -> Path:
+    return Path(settings.BATCH_DIR) / f"{job_id}.json"
+
+def save_job(job: dict):
+    """Сохраняет состояние задания (запись через временный файл, чтобы не повредить его при сбое)."""
+    path = _job_path(job["job_id"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(job, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp_path.replace(path)
+
+def load_job(job_id: str) -> dict:
+    """Загружает сохраненное состояние задания."""
+    return json.loads(_job_path(job_id).read_text(encoding="utf-8"))
+
+def list_jobs() -> list:
+    """Возвращает состояния всех сохраненных заданий, начиная с последних."""
+    batch_dir = Path(settings.BATCH_DIR)
+    if not batch_dir.exists():
+        return []
+    jobs = [json.loads(path.read_text(encoding="utf-8")) for path in batch_dir.glob("*.json")]
+    return sorted(jobs, key=lambda job: job["created"], reverse=True)
+
+def create_job(tz_file: dict, kp_files: list, model_id: str = None) -> dict:
+    """
+    Создает пакетное задание для анализа всех КП тендера.
+
+    Args:
+        tz_file (dict): Файл ТЗ ({"original_name", "file_path"}, как в session_state.uploaded_files).
+        kp_files (list): Файлы КП в том же формате.
+        model_id (str, optional): Модель для всех этапов. По умолчанию первая из settings.AVAILABLE_MODELS.
+
+    Returns:
+        dict: Состояние задания.
+
+    Raises:
+        ValueError: Если провайдер модели не поддерживает пакетный режим.
+    """
+    model_id = model_id or list(settings.AVAILABLE_MODELS.values())[0]
+    provider = model_router.detect_provider(model_id)
+    if provider not in ("openai", "anthropic"):
+        raise ValueError(f"Model '{model_id}' does not support batch mode.")
+    job = {
+        "job_id": datetime.now().strftime("%Y%m%d_%H%M%S_") + uuid.uuid4().hex[:6],
+        "created": datetime.now().isoformat(),
+        "model_id": model_id,
+        "provider": provider,
+        "tender_id": tz_file["file_path"],
+        "tz": tz_file,
+        "kps": kp_files,
+        "phase": "analysis",
+        "batch_id": None,
+        "results": {str(index): {} for index in range(len(kp_files))},
+        "errors": [],
+    }
+    save_job(job)
+    return job
+
+def _build_phase_requests(job: dict) -> list:
+    """Формирует запросы текущей фазы: [{"custom_id", "params"}] в формате API провайдера."""
+    model_id = job["model_id"]
+    requests = []
+    tz_text = None
+    if job["phase"] == "analysis":
+        tz_text = file_utils.extract_text_from_file(Path(job["tz"]["file_path"])) or ""
+        tz_text, _ = token_budget.truncate_for_stage(tz_text, "comparison", model_id, share=0.5)
+
+    for index, kp_file in enumerate(job["kps"]):
+        results = job["results"][str(index)]
+        if job["phase"] == "analysis":
+            kp_text = file_utils.extract_text_from_file(Path(kp_file["file_path"]))
+            if not kp_text:
+                job["errors"].append(f"Не удалось извлечь текст из КП: {kp_file['original_name']}")
+                continue
+            kp_summary_text, _ = token_budget.truncate_for_stage(kp_text, "summary", model_id)
+            kp_comparison_text, _ = token_budget.truncate_for_stage(kp_text, "comparison", model_id, share=0.5)
+            stage_requests = {
+                "summary": ai_service.build_kp_summary_request(kp_summary_text),
+                "comparison": ai_service.build_comparison_request(tz_text, kp_comparison_text),
+            }
+        else:
+            if "summary" not in results or "comparison" not in results:
+                continue
+            stage_requests = {
+                "recommendation": ai_service.build_recommendation_request(results["comparison"], results["summary"]),
+            }
+        for stage, (system_prompt, prompt) in stage_requests.items():
+            params = ai_service.build_request_params(
+                prompt,
+                system_prompt,
+                model_id,
+                token_budget.get_stage_budget(stage)["output"],
+                structured_output.build_json_schema(ai_service.STAGE_SCHEMAS[stage])
+            )
+            requests.append({"custom_id": f"{index}-{stage}", "params": params})
+    return requests
+
+def _anthropic_batches():
+    client = ai_service._get_sync_client("anthropic")
+    if client is None:
+        raise ValueError("Anthropic API key is not configured.")
+    # В старых версиях SDK Message Batches доступны только через beta
+    return client.messages.batches if hasattr(client.messages, "batches") else client.beta.messages.batches
+
+def _submit_anthropic(requests: list) -> str:
+    batch = _anthropic_batches().create(requests=requests)
+    return batch.id
+
+def _collect_anthropic(batch_id: str, model_id: str):
+    """Возвращает {custom_id: AICompletion | str с ошибкой} или None, если пакет еще обрабатывается."""
+    batches = _anthropic_batches()
+    if batches.retrieve(batch_id).processing_status != "ended":
+        return None
+    results = {}
+    for entry in batches.results(batch_id):
+        if entry.result.type == "succeeded":
+            results[entry.custom_id] = ai_service.completion_from_response(entry.result.message, model_id)
+        else:
+            results[entry.custom_id] = f"Error: {entry.result.type}"
+    return results
+
+def _openai_client():
+    client = ai_service._get_sync_client("openai")
+    if client is None:
+        raise ValueError("OpenAI API key is not configured.")
+    return client
+
+def _submit_openai(requests: list) -> str:
+    client = _openai_client()
+    lines = [
+        json.dumps({"custom_id": req["custom_id"], "method": "POST", "url": "/v1/chat/completions", "body": req["params"]}, ensure_ascii=False)
+        for req in requests
+    ]
+    input_file = client.files.create(file=("batch_input.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    return batch.id
+
+def _collect_openai(batch_id: str, model_id: str):
+    """Возвращает {custom_id: AICompletion | str с ошибкой} или None, если пакет еще обрабатывается."""
+    from openai.types.chat import ChatCompletion
+
+    client = _openai_client()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status not in _OPENAI_TERMINAL_STATUSES:
+        return None
+    results = {}
+    # У истекшего или отмененного пакета часть ответов все равно может быть готова
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            response = entry.get("response") or {}
+            if response.get("status_code") == 200:
+                completion = ChatCompletion.model_validate(response["body"])
+                results[entry["custom_id"]] = ai_service.completion_from_response(completion, model_id)
+            else:
+                results[entry["custom_id"]] = f"Error: {entry.get('error') or response.get('body')}"
+    if not results and batch.status != "completed":
+        raise ValueError(f"OpenAI batch {batch_id} finished with status '{batch.status}'.")
+    return results
+
+_PROVIDERS = {
+    "anthropic": (_submit_anthropic, _collect_anthropic),
+    "openai": (_submit_openai, _collect_openai),
+}
+
+def submit_phase(job: dict) -> dict:
+    """Отправляет запросы текущей фазы одним пакетом и сохраняет ID пакета в состоянии задания."""
+    requests = _build_phase_requests(job)
+    if not requests:
+        job["phase"] = PHASE_ORDER[PHASE_ORDER.index(job["phase"]) + 1]
+        save_job(job)
+        return job
+    submit, _ = _PROVIDERS[job["provider"]]
+    job["batch_id"] = submit(requests)
+    job["submitted"] = datetime.now().isoformat()
+    job["request_count"] = len(requests)
+    save_job(job)
+    print(f"Задание {job['job_id']}: фаза '{job['phase']}' отправлена пакетом {job['batch_id']} ({len(requests)} запросов)")
+    return job
+
+def _store_results(job: dict, results: dict):
+    """Разбирает ответы пакета по схемам этапов и учитывает расход токенов тендера."""
+    for custom_id, completion in results.items():
+        index, stage = custom_id.rsplit("-", 1)
+        if isinstance(completion, str):
+            job["errors"].append(f"{job['kps'][int(index)]['original_name']} ({stage}): {completion}")
+            data = None
+        else:
+            data, missing = structured_output.validate_fields(
+                structured_output.parse_json_tolerant(completion.text), ai_service.STAGE_SCHEMAS[stage]
+            )
+            if missing:
+                job["errors"].append(f"{job['kps'][int(index)]['original_name']} ({stage}): нет полей {', '.join(missing)}")
+            token_budget.record_usage(
+                completion.model_id, stage, completion.input_tokens, completion.output_tokens, 0.0,
+                tender_id=job["tender_id"], cost_factor=settings.BATCH_COST_FACTOR
+            )
+        job["results"][index][stage] = ai_service.apply_stage_defaults(stage, data)
+
+def poll_job(job: dict) -> bool:
+    """
+    Проверяет пакет текущей фазы; если он завершен, сохраняет результаты и переходит к следующей фазе.
+
+    Returns:
+        bool: True, если задание полностью завершено.
+    """
+    if job["phase"] == "done":
+        return True
+    if not job.get("batch_id"):
+        submit_phase(job)
+        return job["phase"] == "done"
+    _, collect = _PROVIDERS[job["provider"]]
+    results = collect(job["batch_id"], job["model_id"])
+    if results is None:
+        return False
+    _store_results(job, results)
+    job["phase"] = PHASE_ORDER[PHASE_ORDER.index(job["phase"]) + 1]
+    job["batch_id"] = None
+    save_job(job)
+    if job["phase"] != "done":
+        submit_phase(job)
+    return job["phase"] == "done"
+
+def build_analysis_results(job: dict) -> list:
+    """
+    Преобразует результаты задания в список результатов анализа КП
+    (тот же формат, что st.session_state.all_analysis_results).
+    """
+    from src.components.analysis import build_analysis_output
+
+    outputs = []
+    for index, kp_file in enumerate(job["kps"]):
+        results = job["results"][str(index)]
+        if not results:
+            continue
+        # Этапы, по которым провайдер не вернул ответ, заполняются результатами ошибки
+        stage_results = {
+            stage: results.get(stage) or ai_service.apply_stage_defaults(stage, None)
+            for stage in ai_service.STAGE_SCHEMAS
+        }
+        outputs.append(build_analysis_output(
+            job["tz"]["original_name"],
+            kp_file["original_name"],
+            stage_results["summary"],
+            stage_results["comparison"],
+            stage_results["recommendation"],
+            served_models={stage: job["model_id"] for stage in results}
+        ))
+    return outputs
+
+def run_job(job: dict, poll_interval: float = None) -> list:
+    """
+    Выполняет задание до конца, опрашивая провайдера с интервалом poll_interval.
+    Можно вызывать повторно для задания, загруженного после перезапуска.
+
+    Returns:
+        list: Результаты анализа КП.
+    """
+    poll_interval = settings.BATCH_POLL_INTERVAL_SEC if poll_interval is None else poll_interval
+    while not poll_job(job):
+        time.sleep(poll_interval)
+    outputs = build_analysis_results(job)
+    result_path = Path(settings.RESULT_DIR) / f"batch_{job['job_id']}.json"
+    result_path.parent.mkdir(parents=True, exist_ok=True)
+    result_path.write_text(json.dumps(outputs, ensure_ascii=False, indent=2), encoding="utf-8")
+    export_service.append_history(outputs, job["tz"].get("file_path"))
+    print(f"Задание {job['job_id']} завершено, результаты: {result_path}")
+    for error in job["errors"]:
+        print(f"  - {error}")
+    return outputs
+
+def main(argv: list = None):
+    """Командная строка пакетного режима."""
+    parser = argparse.ArgumentParser(description="Пакетный анализ тендера через Batch API провайдеров")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit", help="Создать задание и дождаться результатов")
+    submit_parser.add_argument("tz", help="Файл ТЗ")
+    submit_parser.add_argument("kp", nargs="+", help="Файлы КП")
+    submit_parser.add_argument("--model", default=None, help="ID модели (по умолчанию первая из AVAILABLE_MODELS)")
+    submit_parser.add_argument("--no-wait", action="store_true", help="Только отправить первую фазу")
+    submit_parser.add_argument("--poll-interval", type=float, default=None, help="Интервал опроса, сек")
+
+    resume_parser = subparsers.add_parser("resume", help="Продолжить опрос сохраненного задания")
+    resume_parser.add_argument("job_id")
+    resume_parser.add_argument("--poll-interval", type=float, default=None, help="Интервал опроса, сек")
+
+    status_parser = subparsers.add_parser("status", help="Показать состояние заданий")
+    status_parser.add_argument("job_id", nargs="?")
+
+    args = parser.parse_args(argv)
+    if args.command == "submit":
+        to_file = lambda path: {"original_name": Path(path).name, "file_path": str(Path(path).resolve())}
+        job = create_job(to_file(args.tz), [to_file(path) for path in args.kp], args.model)
+        submit_phase(job)
+        if not args.no_wait:
+            run_job(job, args.poll_interval)
+    elif args.command == "resume":
+        run_job(load_job(args.job_id), args.poll_interval)
+    else:
+        jobs = [load_job(args.job_id)] if args.job_id else list_jobs()
+        for job in jobs:
+            print(f"{job['job_id']}  {job['model_id']}  фаза: {job['phase']}  пакет: {job.get('batch_id') or '-'}  КП: {len(job['kps'])}  ошибок: {len(job['errors'])}")
+
+if __name__ == "__main__":
+    main()
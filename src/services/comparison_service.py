@@ -2,124 +2,316 @@
 Модуль для сравнения ТЗ и КП
 """
 
+import re
 import json
-from src.services import ai_service
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+from pathlib import Path
+import streamlit as st
+from src.config import settings
+from src.models import schemas
+from src.services import ai_service, token_budget, tender_digest, scoring
+
+# Заголовки разделов ТЗ: markdown (# ...), "Раздел 3 ...", нумерованные ("2.", "2.1 ...") и строки ПРОПИСНЫМИ
+_MARKDOWN_HEADING_RE = re.compile(r"^(#{1,6})\s+(\S.*)$")
+_WORD_HEADING_RE = re.compile(r"^(?:Раздел|РАЗДЕЛ|Глава|ГЛАВА|Часть|ЧАСТЬ)\s+\d+.*$")
+_NUMBERED_HEADING_RE = re.compile(r"^(\d{1,2}(?:\.\d{1,2}){0,2})\.?\s+([А-ЯЁA-Z].*)$")
+_UPPERCASE_HEADING_RE = re.compile(r"^[А-ЯЁA-Z][А-ЯЁA-Z0-9 ,.\-–«»\"()]{3,}$")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+def _heading_level(line: str):
+    """Уровень заголовка (1 - верхний) для строки или None, если это не заголовок."""
+    line = line.strip()
+    if not line or len(line) > 120 or line.endswith((";", ",", ":")):
+        return None
+    match = _MARKDOWN_HEADING_RE.match(line)
+    if match:
+        return len(match.group(1))
+    if _WORD_HEADING_RE.match(line):
+        return 1
+    match = _NUMBERED_HEADING_RE.match(line)
+    if match:
+        return match.group(1).count(".") + 1
+    if _UPPERCASE_HEADING_RE.match(line) and any(c.isalpha() for c in line):
+        return 1
+    return None
+
+def _split_by_tokens(name: str, text: str, max_tokens: int) -> list:
+    """Делит слишком длинный раздел по абзацам на части не больше max_tokens."""
+    if token_budget.estimate_tokens(text) <= max_tokens:
+        return [{"name": name, "text": text}]
+    parts, current = [], ""
+    for paragraph in _PARAGRAPH_RE.split(text):
+        candidate = f"{current}\n\n{paragraph}" if current else paragraph
+        if current and token_budget.estimate_tokens(candidate) > max_tokens:
+            parts.append(current)
+            current = paragraph
+        else:
+            current = candidate
+    if current:
+        parts.append(current)
+    # Абзацы длиннее бюджета обрезаются: раздел все равно оценивается по своему началу
+    parts = [token_budget.truncate_to_tokens(part, max_tokens)[0] for part in parts]
+    return [{"name": f"{name} (часть {i})", "text": part} for i, part in enumerate(parts, 1)]
+
+def split_tz_sections(tz_text: str) -> list:
+    """
+    Делит ТЗ на разделы по заголовкам верхнего уровня.
+
+    Если заголовков верхнего уровня меньше двух, используется следующий уровень. Короткие разделы
+    (меньше settings.COMPARISON_MIN_SECTION_TOKENS) присоединяются к предыдущему, соседние разделы
+    объединяются, пока их не станет не больше settings.COMPARISON_MAX_SECTIONS, а слишком длинные
+    делятся по абзацам под входной бюджет этапа сравнения.
+
+    Args:
+        tz_text (str): Текст ТЗ.
+
+    Returns:
+        list: Разделы {"name": заголовок, "text": текст раздела вместе с заголовком}.
+    """
+    lines = tz_text.splitlines()
+    headings = [(i, level) for i, level in ((i, _heading_level(line)) for i, line in enumerate(lines)) if level]
+    sections = []
+    for level in sorted({level for _, level in headings}):
+        starts = [i for i, heading_level in headings if heading_level <= level]
+        if len(starts) >= 2:
+            if starts[0] > 0:
+                sections.append({"name": "Вводная часть", "text": "\n".join(lines[:starts[0]])})
+            for start, end in zip(starts, starts[1:] + [len(lines)]):
+                sections.append({"name": lines[start].strip().lstrip("#").strip(), "text": "\n".join(lines[start:end])})
+            break
+    if not sections:
+        sections = [{"name": "Документ целиком", "text": tz_text}]
+
+    # Короткие фрагменты (заголовок без текста, вводный текст) не стоят отдельного запроса
+    merged = []
+    for section in sections:
+        if not section["text"].strip():
+            continue
+        if not merged:
+            merged.append(section)
+            continue
+        previous_tokens = token_budget.estimate_tokens(merged[-1]["text"])
+        current_tokens = token_budget.estimate_tokens(section["text"])
+        if min(previous_tokens, current_tokens) < settings.COMPARISON_MIN_SECTION_TOKENS:
+            # Объединенный раздел называется по более содержательной части
+            name = section["name"] if current_tokens > previous_tokens else merged[-1]["name"]
+            merged[-1] = {"name": name, "text": f"{merged[-1]['text']}\n{section['text']}"}
+        else:
+            merged.append(section)
+    while len(merged) > settings.COMPARISON_MAX_SECTIONS:
+        # Объединяем самую короткую пару соседних разделов
+        sizes = [token_budget.estimate_tokens(a["text"] + b["text"]) for a, b in zip(merged, merged[1:])]
+        i = sizes.index(min(sizes))
+        merged[i:i + 2] = [{"name": f"{merged[i]['name']}; {merged[i + 1]['name']}", "text": f"{merged[i]['text']}\n{merged[i + 1]['text']}"}]
+
+    max_tokens = int(token_budget.get_stage_budget("comparison")["input"] * 0.5)
+    result = []
+    for section in merged:
+        result.extend(_split_by_tokens(section["name"], section["text"], max_tokens))
+    return result
+
+def build_section_request(section: dict, kp_text: str):
+    """
+    Формирует запрос на сравнение одного раздела ТЗ с КП.
+    КП идет в начале запроса и отделен меткой ai_service.CACHE_BREAKPOINT: у всех запросов по разделам
+    он одинаковый, и провайдер берет его из кеша промптов (Anthropic - по отметке cache_control).
+
+    Returns:
+        tuple: (системная инструкция, запрос)
+    """
+    system_prompt = (
+        "Ты — AI-ассистент, специализирующийся на сравнении технических заданий (ТЗ) с коммерческими предложениями (КП) "
+        "для разработки ПО. Тебе дается полный текст КП и ОДИН раздел ТЗ. Оцени, насколько КП покрывает требования "
+        "именно этого раздела. Верни результат ТОЛЬКО в виде валидного JSON-объекта со следующими ключами:\n"
+        "- compliance: Целочисленная оценка в процентах (0-100), насколько КП соответствует требованиям раздела.\n"
+        "- details: Краткий (1-3 предложения) комментарий на русском языке: что покрыто, что нет.\n"
+        "- missing_requirements: Список строк (на русском языке) с требованиями раздела, которые НЕ рассмотрены в КП.\n"
+        "- additional_features: Список строк (на русском языке) с предложениями КП по теме раздела сверх его требований.\n"
+        "Не добавляй никаких пояснений вне JSON-объекта. Все текстовые значения должны быть на русском языке."
+    )
+    prompt = (
+        f"=== КП (Commercial Proposal) ===\n{kp_text}\n\n{ai_service.CACHE_BREAKPOINT}"
+        f"=== Раздел ТЗ: {section['name']} ===\n{section['text']}\n\n"
+        f"Оцени соответствие КП требованиям этого раздела ТЗ. Верни ТОЛЬКО JSON-объект."
+    )
+    return system_prompt, prompt
+
+class SectionCache:
+    """
+    Кеш результатов сравнения разделов: ключ - хеш модели, запроса и текстов раздела и КП.
+    При изменении одного раздела ТЗ повторно оценивается только он. Результаты хранятся
+    в памяти процесса и в файлах settings.SECTION_CACHE_DIR (переживают перезапуск).
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_id: str, system_prompt: str, prompt: str) -> str:
+        payload = json.dumps([model_id, system_prompt, prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Возвращает сохраненный результат раздела или None."""
+        with self._lock:
+            if key in self._memory:
+                return dict(self._memory[key])
+        path = self.cache_dir / f"{key}.json"
+        if not path.exists():
+            return None
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._memory[key] = data
+        return dict(data)
+
+    def set(self, key: str, data: dict):
+        """Сохраняет результат раздела (запись через временный файл)."""
+        with self._lock:
+            self._memory[key] = dict(data)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_dir / f"{key}.tmp"
+            tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            tmp_path.replace(self.cache_dir / f"{key}.json")
+        except OSError as e:
+            print(f"Не удалось сохранить кеш сравнения раздела: {e}")
+
+# Общий для процесса кеш результатов по разделам
+section_cache = SectionCache(settings.SECTION_CACHE_DIR)
+
+def _unique(items: list) -> list:
+    """Убирает повторы (без учета регистра), сохраняя порядок."""
+    seen, result = set(), []
+    for item in items:
+        normalized = item.strip().lower()
+        if normalized and normalized not in seen:
+            seen.add(normalized)
+            result.append(item.strip())
+    return result
 
 def compare_tz_and_kp(tz_text, kp_text):
     """
-    Сравнивает текст ТЗ и КП и возвращает результаты анализа
-    
+    Сравнивает текст ТЗ и КП по разделам ТЗ и возвращает результаты анализа.
+
+    ТЗ делится на разделы (split_tz_sections), каждый раздел сравнивается с КП отдельным запросом
+    к модели этапа comparison; запросы выполняются параллельно в общем event loop ai_service.
+    Результаты разделов кешируются (section_cache), поэтому после правки одного раздела ТЗ
+    к модели уходит только он. Общая оценка - среднее оценок разделов, взвешенное по их объему;
+    разделы, которые не удалось оценить, в нее не входят и считаются в failed_sections.
+
     Args:
         tz_text (str): Текст Технического Задания
         kp_text (str): Текст Коммерческого Предложения
-        
+
     Returns:
-        dict: Результаты сравнения в структурированном виде
+        dict: compliance_score, sections (name, compliance, details, missing_requirements, model, cached),
+        missing_requirements, additional_features и failed_sections (число неоцененных разделов:
+        если оно больше нуля, общая оценка неполная).
     """
-    # Заглушка для демонстрации - в реальности здесь будет код, использующий AI-сервисы
-    # В полноценной реализации здесь будет вызов Claude 3.5 Sonnet через ai_service.analyze_with_claude()
-    
-    # Формируем prompt для Claude
-    prompt = """
-    Ты — эксперт по анализу технических документов. Твоя задача — сравнить Техническое Задание (ТЗ) и Коммерческое Предложение (КП) 
-    и определить, насколько КП соответствует требованиям ТЗ.
-    
-    Проведи детальный анализ по следующим пунктам:
-    1. Общий процент соответствия КП требованиям ТЗ (число от 0 до 100)
-    2. Анализ по разделам документа (процент соответствия и комментарии)
-    3. Перечень требований из ТЗ, которые не учтены в КП
-    4. Дополнительные функции/предложения в КП, не требуемые в ТЗ
-    
-    Верни результаты в формате JSON:
-    {
-      "compliance_score": число,
-      "sections": [
-        {"name": "название раздела", "compliance": число, "details": "комментарий"},
-        ...
-      ],
-      "missing_requirements": ["требование 1", "требование 2", ...],
-      "additional_features": ["функция 1", "функция 2", ...]
-    }
-    """
-    
-    # В реальной системе будет вызов AI API
-    # result_json = ai_service.analyze_with_claude(tz_text + "\n\n" + kp_text, prompt)
-    # return json.loads(result_json)
-    
-    # Заглушка для демонстрации
-    comparison_result = {
-        "compliance_score": 75,  # Процент соответствия (0-100)
-        "sections": [
-            {"name": "Общие требования", "compliance": 90, "details": "Предложение соответствует большинству общих требований, но не указаны детали по совместимости с существующими системами."},
-            {"name": "Функциональные требования", "compliance": 85, "details": "Предложение охватывает основные функциональные требования, но некоторые второстепенные функции не упомянуты."},
-            {"name": "Нефункциональные требования", "compliance": 65, "details": "Недостаточно проработаны требования по производительности и масштабируемости."},
-            {"name": "Технические требования", "compliance": 70, "details": "Технические спецификации в целом соответствуют, но есть расхождения в версиях используемых технологий."},
-            {"name": "Сроки и этапы", "compliance": 60, "details": "Предложенные сроки превышают указанные в ТЗ на 2 недели."}
-        ],
-        "missing_requirements": [
-            "Требование по масштабируемости до 10000 пользователей",
-            "Интеграция с системой учета рабочего времени",
-            "Детальный план обучения персонала"
-        ],
-        "additional_features": [
-            "Предложена дополнительная аналитическая панель",
-            "Расширенные возможности экспорта данных"
-        ]
+    sections = split_tz_sections(tz_text)
+    # Настройки этапа определяем в потоке сессии, где доступен session_state
+    config = ai_service.get_stage_config("comparison")
+    requests = [build_section_request(section, kp_text) for section in sections]
+    keys = [section_cache.make_key(config["model"], system_prompt, prompt) for system_prompt, prompt in requests]
+    cached = {i: section_cache.get(key) for i, key in enumerate(keys)}
+    pending = [i for i, data in cached.items() if data is None]
+
+    async def _compare_pending():
+        return await asyncio.gather(*[
+            ai_service.get_structured_response_async(
+                requests[i][1], requests[i][0], schemas.SectionComparison,
+                config["model"], "comparison",
+                max_tokens=config["max_tokens"], latency_slo=config["latency_slo_sec"]
+            )
+            for i in pending
+        ], return_exceptions=True)
+
+    responses = dict(zip(pending, ai_service.run_sync(_compare_pending()))) if pending else {}
+
+    results, incomplete = [], []
+    for i, section in enumerate(sections):
+        data = cached[i]
+        if data is None:
+            response = responses[i]
+            if isinstance(response, Exception):
+                print(f"Ошибка при сравнении раздела ТЗ «{section['name']}»: {response}")
+                results.append({
+                    "name": section["name"], "compliance": None, "model": None, "cached": False,
+                    "details": f"Раздел не удалось оценить: {response}",
+                    "missing_requirements": [], "additional_features": [],
+                })
+                continue
+            fields, missing, completion = response
+            data = {
+                "compliance": fields.get("compliance"),
+                "details": fields.get("details") or "Комментарий не получен",
+                "missing_requirements": fields.get("missing_requirements", []),
+                "additional_features": fields.get("additional_features", []),
+                "model": completion.model_id,
+            }
+            if missing:
+                incomplete.append(section["name"])
+            elif completion.model_id == config["model"]:
+                # В кеш попадают только полные ответы запрошенной модели
+                section_cache.set(keys[i], data)
+            results.append({"name": section["name"], "cached": False, **data})
+        else:
+            results.append({"name": section["name"], "cached": True, **data})
+
+    if incomplete:
+        st.warning(f"AI не вернул часть результатов сравнения по разделам: {', '.join(incomplete)}")
+
+    scored = [(section, result) for section, result in zip(sections, results) if result["compliance"] is not None]
+    failed_sections = len(results) - len(scored)
+    if failed_sections:
+        st.warning(f"Не удалось оценить разделов ТЗ: {failed_sections} из {len(results)}. Общая оценка соответствия неполная.")
+    if not scored:
+        return {**ai_service.apply_stage_defaults("comparison", None), "sections": results, "failed_sections": failed_sections}
+    weights = [token_budget.estimate_tokens(section["text"]) for section, _ in scored]
+    compliance_score = round(sum(w * r["compliance"] for w, (_, r) in zip(weights, scored)) / sum(weights))
+    return {
+        "compliance_score": compliance_score,
+        "sections": results,
+        "missing_requirements": _unique([item for r in results for item in r["missing_requirements"]]),
+        "additional_features": _unique([item for r in results for item in r["additional_features"]]),
+        "failed_sections": failed_sections,
     }
-    
-    return comparison_result
 
-def analyze_additional_info(additional_texts, tz_text, kp_text):
+def served_model(comparison_result: dict):
+    """Модель, ответившая на большинство запросов по разделам (None, если ни один раздел не оценен)."""
+    models = Counter(section.get("model") for section in comparison_result.get("sections", []) if section.get("model"))
+    return models.most_common(1)[0][0] if models else None
+
+def analyze_additional_info(additional_texts, tz_text, kp_text, vendor_names=()):
     """
-    Анализирует дополнительную информацию и определяет её влияние на оценку КП
-    
+    Анализирует дополнительную информацию и определяет её влияние на оценку КП.
+
+    Тексты разбираются через дайджест тендера (tender_digest): выжимка каждого текста сохраняется
+    по его хешу, поэтому при анализе следующих КП того же тендера модель повторно не вызывается.
+    ТЗ и КП для разбора дополнительных файлов не нужны и оставлены для совместимости вызова.
+
     Args:
         additional_texts (list): Список текстов дополнительной информации
         tz_text (str): Текст Технического Задания
         kp_text (str): Текст Коммерческого Предложения
-        
+        vendor_names: Названия участника (компания из КП, имя файла КП) для выбора его выводов
+
     Returns:
-        dict: Результаты анализа дополнительной информации
+        dict: key_findings, impact, rating_impact и sources или None, если текстов нет
     """
-    # Заглушка для демонстрации - в реальности здесь будет код, использующий AI-сервисы
-    # В полноценной реализации здесь будет вызов Claude 3.5 Sonnet через ai_service.analyze_with_claude()
-    
-    # Формируем prompt для Claude
-    prompt = """
-    Ты — эксперт по анализу бизнес-документации. Ты получил Техническое Задание (ТЗ), Коммерческое Предложение (КП) 
-    и дополнительную информацию (протоколы встреч, письма, отчеты и т.д.).
-    
-    Твоя задача — проанализировать дополнительную информацию и определить, как она влияет на оценку соответствия КП требованиям ТЗ.
-    
-    Обрати внимание на:
-    1. Дополнительные требования, которые могли быть обсуждены на встречах, но не отражены в ТЗ
-    2. Информацию о компетенциях исполнителя, которая может повлиять на оценку
-    3. Риски, которые можно выявить из дополнительной информации
-    
-    Верни результаты в формате JSON:
-    {
-      "key_findings": ["вывод 1", "вывод 2", ...],
-      "impact": "описание влияния на общую оценку КП"
-    }
-    """
-    
-    # В реальной системе будет вызов AI API
-    # combined_text = tz_text + "\n\n" + kp_text + "\n\n" + "\n\n".join(additional_texts)
-    # result_json = ai_service.analyze_with_claude(combined_text, prompt)
-    # return json.loads(result_json)
-    
-    # Заглушка для демонстрации
-    additional_info_analysis = {
-        "key_findings": [
-            "Из протоколов встреч выявлены дополнительные требования, не указанные в ТЗ",
-            "Участник ранее успешно реализовал два похожих проекта",
-            "Есть риски с соблюдением заявленных сроков на основе истории компании"
-        ],
-        "impact": "Положительное влияние на общую оценку предложения благодаря предыдущему опыту, но есть риски по срокам.",
-        "rating_impact": 2.0  # Добавляем значимый положительный модификатор к рейтингу (2 из 10)
-    }
-    
-    return additional_info_analysis
+    documents = [
+        {"name": f"Документ {i}", "hash": hashlib.sha256(text.encode("utf-8")).hexdigest(), "text": text}
+        for i, text in enumerate(additional_texts, 1) if text and text.strip()
+    ]
+    return tender_digest.vendor_slice(tender_digest.build_digest(documents), vendor_names)
 
 def generate_final_recommendation(analysis_results):
     """
@@ -165,16 +357,13 @@ def generate_final_recommendation(analysis_results):
     Учитывая дополнительную информацию о предыдущем успешном опыте реализации подобных проектов, которая положительно влияет на общую оценку, а также высокие оценки по большинству критериев, данное коммерческое предложение может быть рекомендовано к дальнейшему рассмотрению после уточнения условий по срокам выполнения и масштабируемости системы.
     """
     
-    # Определение итоговой рекомендации
-    avg_rating = sum(analysis_results.get("ratings", {0: 0}).values()) / len(analysis_results.get("ratings", {0: 0}))
-    compliance_score = analysis_results["comparison_result"]["compliance_score"]
-    
-    overall_score = (avg_rating * 10 + compliance_score) / 2
+    # Определение итоговой рекомендации по общей оценке (scoring)
+    level = scoring.score_of(analysis_results)["level"]
     
-    if overall_score >= 75:
+    if level == "recommend":
         recommendation = "✅ РЕКОМЕНДОВАТЬ К ДАЛЬНЕЙШЕМУ РАССМОТРЕНИЮ"
         details = "Коммерческое предложение соответствует большинству требований ТЗ и получило высокие оценки по ключевым критериям."
-    elif overall_score >= 60:
+    elif level == "conditional":
         recommendation = "⚠️ РЕКОМЕНДОВАТЬ С ОГОВОРКАМИ"
         details = "Коммерческое предложение имеет существенные достоинства, но требуется уточнение деталей по ряду вопросов."
     else:
@@ -0,0 +1,317 @@
+"""
+История анализов КП и потоковая выгрузка результатов в Parquet, XLSX и JSONL
+
+Каждый проанализированный КП дописывается строкой в историю (settings.HISTORY_PATH). Выгрузка
+раскладывает результаты по нормализованным таблицам, связанным полем analysis_id:
+    analyses - одна строка на КП (условия, оценки по критериям, модели этапов);
+    sections - оценки соответствия по разделам ТЗ;
+    requirements - пропущенные требования (missing) и дополнительные функции (additional);
+    findings - сильные (strength) и слабые (weakness) стороны.
+Результаты читаются и записываются генераторами: в памяти одновременно находится один КП
+и не больше settings.EXPORT_CHUNK_ROWS строк на таблицу, поэтому объем истории не ограничен памятью.
+pyarrow (Parquet) и openpyxl (XLSX) импортируются только при выгрузке в эти форматы.
+
+Запуск из командной строки:
+    python -m src.services.export_service --format parquet xlsx
+    python -m src.services.export_service --format jsonl --out data/exports/tender data/results/batch_<id>.json
+"""
+
+import argparse
+import json
+import hashlib
+import threading
+import zipfile
+from io import BytesIO
+from datetime import datetime
+from pathlib import Path
+from src.config import settings
+from src.utils import normalization
+
+CRITERIA_IDS = [criterion["id"] for criterion in settings.EVALUATION_CRITERIA]
+
+# Колонки таблиц выгрузки и их типы (string, float, int)
+TABLES = {
+    "analyses": {
+        "analysis_id": "string", "analyzed_at": "string", "tender_id": "string", "tz_name": "string",
+        "kp_name": "string", "company_name": "string", "tech_stack": "string", "pricing": "string", "timeline": "string",
+        "price_amount": "float", "currency": "string", "vat": "string", "price_period": "string",
+        "pricing_model": "string", "timeline_days": "float", "compliance_score": "float",
+        "missing_count": "int", "additional_count": "int", "summary": "string", "rating_impact": "float",
+        **{f"rating_{criterion_id}": "float" for criterion_id in CRITERIA_IDS},
+        "served_models": "string",
+    },
+    "sections": {"analysis_id": "string", "position": "int", "name": "string", "compliance": "float", "details": "string"},
+    "requirements": {"analysis_id": "string", "kind": "string", "position": "int", "text": "string"},
+    "findings": {"analysis_id": "string", "kind": "string", "position": "int", "text": "string"},
+}
+
+_history_lock = threading.Lock()
+
+def append_history(results: list, tender_id: str = None):
+    """
+    Дописывает результаты анализа КП в историю (строка JSON на КП).
+
+    Args:
+        results (list): Результаты анализа КП (формат st.session_state.all_analysis_results).
+        tender_id (str, optional): Тендер, к которому относятся результаты.
+    """
+    analyzed_at = datetime.now().isoformat(timespec="seconds")
+    lines = "".join(
+        json.dumps({"analyzed_at": analyzed_at, "tender_id": tender_id, **result}, ensure_ascii=False, default=str) + "\n"
+        for result in results
+    )
+    path = Path(settings.HISTORY_PATH)
+    try:
+        with _history_lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as history:
+                history.write(lines)
+    except OSError as e:
+        print(f"Не удалось сохранить историю анализа: {e}")
+
+def iter_results(paths: list = None):
+    """
+    Результаты анализа КП из файлов по одному.
+
+    Args:
+        paths (list, optional): Файлы JSONL (история, строка на КП) или JSON (список результатов,
+            например, итог пакетного задания). По умолчанию - история settings.HISTORY_PATH.
+
+    Yields:
+        dict: Результат анализа КП.
+    """
+    for path in map(Path, paths or [settings.HISTORY_PATH]):
+        if not path.exists():
+            print(f"Файл результатов не найден: {path}")
+            continue
+        if path.suffix == ".jsonl":
+            with open(path, encoding="utf-8") as lines:
+                for number, line in enumerate(lines, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        print(f"Пропущена поврежденная строка {number} в {path}")
+        else:
+            data = json.loads(path.read_text(encoding="utf-8"))
+            yield from (data if isinstance(data, list) else [data])
+
+def analysis_id(result: dict) -> str:
+    """Идентификатор результата в таблицах выгрузки: хеш его содержимого."""
+    payload = json.dumps(result, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def _items(kind: str, items: list, result_id: str):
+    for position, text in enumerate(items or [], 1):
+        yield {"analysis_id": result_id, "kind": kind, "position": position, "text": str(text)}
+
+def iter_rows(results):
+    """
+    Раскладывает результаты по таблицам выгрузки.
+
+    Args:
+        results: Итерируемые результаты анализа КП (список или генератор iter_results).
+
+    Yields:
+        tuple: (имя таблицы из TABLES, строка-словарь)
+    """
+    for result in results:
+        result_id = analysis_id(result)
+        comparison = result.get("comparison_result") or {}
+        recommendation = result.get("preliminary_recommendation") or {}
+        terms = normalization.terms_of(result)
+        ratings = result.get("ratings") or {}
+        row = {
+            "analysis_id": result_id,
+            "analyzed_at": result.get("analyzed_at"),
+            "tender_id": result.get("tender_id"),
+            **{column: result.get(column) for column in ("tz_name", "kp_name", "company_name", "tech_stack", "pricing", "timeline")},
+            **{column: terms.get(column) for column in normalization.TERMS_COLUMNS},
+            "compliance_score": comparison.get("compliance_score"),
+            "missing_count": len(comparison.get("missing_requirements") or []),
+            "additional_count": len(comparison.get("additional_features") or []),
+            "summary": recommendation.get("summary"),
+            "rating_impact": (result.get("additional_info_analysis") or {}).get("rating_impact"),
+            **{f"rating_{criterion_id}": ratings.get(criterion_id) for criterion_id in CRITERIA_IDS},
+            "served_models": json.dumps(result.get("served_models") or {}, ensure_ascii=False),
+        }
+        yield "analyses", row
+        for position, section in enumerate(comparison.get("sections") or [], 1):
+            yield "sections", {
+                "analysis_id": result_id, "position": position, "name": section.get("name"),
+                "compliance": section.get("compliance"), "details": section.get("details"),
+            }
+        for kind, items in (("missing", comparison.get("missing_requirements")), ("additional", comparison.get("additional_features"))):
+            for item in _items(kind, items, result_id):
+                yield "requirements", item
+        for kind, items in (("strength", recommendation.get("strength")), ("weakness", recommendation.get("weakness"))):
+            for item in _items(kind, items, result_id):
+                yield "findings", item
+
+def _cast(value, column_type: str):
+    """Значение колонки в типе таблицы (None - пустое или не приводимое значение)."""
+    if value is None or value == "":
+        return None
+    try:
+        if column_type == "float":
+            return float(value)
+        if column_type == "int":
+            return int(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+class _JsonlWriter:
+    """Таблицы в файлы <target>/<таблица>.jsonl."""
+
+    def __init__(self, target: Path):
+        target.mkdir(parents=True, exist_ok=True)
+        self.files = {table: open(target / f"{table}.jsonl", "w", encoding="utf-8") for table in TABLES}
+
+    def write(self, table: str, row: dict):
+        self.files[table].write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+class _ParquetWriter:
+    """Таблицы в файлы <target>/<таблица>.parquet; строки пишутся группами по settings.EXPORT_CHUNK_ROWS."""
+
+    def __init__(self, target: Path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Для выгрузки в Parquet установите пакет pyarrow.")
+        types = {"string": pa.string(), "float": pa.float64(), "int": pa.int64()}
+        target.mkdir(parents=True, exist_ok=True)
+        self.pa = pa
+        self.schemas = {
+            table: pa.schema([(column, types[column_type]) for column, column_type in columns.items()])
+            for table, columns in TABLES.items()
+        }
+        self.writers = {table: pq.ParquetWriter(target / f"{table}.parquet", schema) for table, schema in self.schemas.items()}
+        self.buffers = {table: [] for table in TABLES}
+
+    def write(self, table: str, row: dict):
+        buffer = self.buffers[table]
+        buffer.append(row)
+        if len(buffer) >= settings.EXPORT_CHUNK_ROWS:
+            self._flush(table)
+
+    def _flush(self, table: str):
+        if self.buffers[table]:
+            self.writers[table].write_table(self.pa.Table.from_pylist(self.buffers[table], schema=self.schemas[table]))
+            self.buffers[table] = []
+
+    def close(self):
+        for table, writer in self.writers.items():
+            self._flush(table)
+            writer.close()
+
+# Строк данных на листе Excel (плюс строка заголовка); продолжение таблицы уходит на следующий лист
+XLSX_MAX_ROWS = 1048575
+
+class _XlsxWriter:
+    """
+    Таблицы на листы книги <target>.xlsx (режим write_only: строки сразу уходят в файл).
+    Таблица длиннее листа Excel продолжается на листах <таблица>_2, <таблица>_3 и т.д.
+    """
+
+    def __init__(self, target: Path):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError("Для выгрузки в XLSX установите пакет openpyxl.")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        self.path = target
+        self.workbook = Workbook(write_only=True)
+        self.sheets, self.rows, self.parts = {}, {}, {}
+        for table in TABLES:
+            self._add_sheet(table, table)
+
+    def _add_sheet(self, table: str, title: str):
+        sheet = self.workbook.create_sheet(title)
+        sheet.append(list(TABLES[table]))
+        self.sheets[table] = sheet
+        self.rows[table] = 0
+        self.parts[table] = self.parts.get(table, 0) + 1
+
+    def write(self, table: str, row: dict):
+        if self.rows[table] >= XLSX_MAX_ROWS:
+            self._add_sheet(table, f"{table}_{self.parts[table] + 1}")
+        self.sheets[table].append(list(row.values()))
+        self.rows[table] += 1
+
+    def close(self):
+        self.workbook.save(self.path)
+
+_WRITERS = {"parquet": _ParquetWriter, "xlsx": _XlsxWriter, "jsonl": _JsonlWriter}
+
+def export_path(base: Path, fmt: str) -> Path:
+    """Путь выгрузки формата: файл <base>.xlsx или каталог <base>_<формат> с файлом на таблицу."""
+    base = Path(base)
+    return base.with_name(base.name + ".xlsx") if fmt == "xlsx" else base.with_name(f"{base.name}_{fmt}")
+
+def export_results(results, formats: list, base: Path) -> dict:
+    """
+    Выгружает результаты в несколько форматов за один проход.
+
+    Args:
+        results: Итерируемые результаты анализа КП (список или генератор iter_results).
+        formats (list): Форматы из settings.EXPORT_FORMATS.
+        base (Path): Базовый путь выгрузки (см. export_path).
+
+    Returns:
+        dict: {"paths": {формат: путь}, "rows": {таблица: число строк}}
+
+    Raises:
+        RuntimeError: Не установлен пакет, нужный для формата.
+    """
+    paths = {fmt: export_path(base, fmt) for fmt in formats}
+    writers = []
+    try:
+        for fmt, path in paths.items():
+            writers.append(_WRITERS[fmt](path))
+        counts = {table: 0 for table in TABLES}
+        for table, row in iter_rows(results):
+            row = {column: _cast(row.get(column), column_type) for column, column_type in TABLES[table].items()}
+            counts[table] += 1
+            for writer in writers:
+                writer.write(table, row)
+    finally:
+        for writer in writers:
+            writer.close()
+    return {"paths": paths, "rows": counts}
+
+def pack_export(path: Path) -> bytes:
+    """Файл выгрузки для скачивания: XLSX как есть, каталог с таблицами - ZIP-архивом."""
+    path = Path(path)
+    if path.is_file():
+        return path.read_bytes()
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for file in sorted(path.iterdir()):
+            archive.write(file, file.name)
+    return buffer.getvalue()
+
+def default_base() -> Path:
+    """Базовый путь новой выгрузки в settings.EXPORT_DIR."""
+    return Path(settings.EXPORT_DIR) / f"analyses_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Выгрузка результатов анализа КП в Parquet, XLSX и JSONL")
+    parser.add_argument("inputs", nargs="*", help="Файлы результатов (JSONL или JSON). По умолчанию - история анализов")
+    parser.add_argument("--format", nargs="+", choices=settings.EXPORT_FORMATS, default=["parquet"], help="Форматы выгрузки")
+    parser.add_argument("--out", default=None, help="Базовый путь выгрузки (по умолчанию в settings.EXPORT_DIR)")
+    args = parser.parse_args(argv)
+
+    summary = export_results(iter_results(args.inputs), args.format, Path(args.out) if args.out else default_base())
+    print("Строк в таблицах: " + ", ".join(f"{table} - {count}" for table, count in summary["rows"].items()))
+    for fmt, path in summary["paths"].items():
+        print(f"{fmt}: {path}")
+
+if __name__ == "__main__":
+    main()
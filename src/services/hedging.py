@@ -0,0 +1,125 @@
+"""
+Политика хеджирования запросов к AI моделям для сокращения хвостовых задержек
+"""
+
+import time
+import itertools
+import threading
+from collections import OrderedDict, deque
+from src.config import settings
+
+class HedgePolicy:
+    """
+    Решает, когда отправлять дублирующий (хеджирующий) запрос, и ограничивает его стоимость.
+
+    Порог ожидания - перцентиль (по умолчанию p95) недавних задержек модели. Доля хеджированных
+    запросов ограничена settings.HEDGE_MAX_RATE в скользящем окне, а оценка дополнительных
+    токенов - settings.HEDGE_MAX_EXTRA_TOKENS за окно settings.HEDGE_BUDGET_WINDOW_SEC.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        # Последние запросы окна доли хеджирования: номер запроса -> был ли он хеджирован
+        self._recent = OrderedDict()
+        self._sequence = itertools.count(1)
+        self._budget_started = time.monotonic()
+        self._budget_used = 0
+        self._stats = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "skipped_by_rate_cap": 0,
+            "skipped_by_token_cap": 0,
+            "extra_tokens": 0,
+        }
+
+    def record_latency(self, model_id: str, latency: float):
+        """Добавляет задержку успешного ответа модели в историю для расчета порога."""
+        with self._lock:
+            self._latencies.setdefault(model_id, deque(maxlen=settings.HEDGE_LATENCY_HISTORY)).append(latency)
+
+    def threshold(self, model_id: str):
+        """
+        Возвращает время ожидания (сек) до отправки хеджирующего запроса
+        или None, если истории задержек пока недостаточно.
+        """
+        with self._lock:
+            samples = sorted(self._latencies.get(model_id, ()))
+        if len(samples) < settings.HEDGE_MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * settings.HEDGE_PERCENTILE))
+        return max(settings.HEDGE_MIN_DELAY_SEC, samples[index])
+
+    def start_request(self) -> int:
+        """
+        Учитывает новый запрос в статистике и окне доли хеджирования.
+
+        Returns:
+            int: Номер запроса для try_acquire (одновременно идущие запросы хеджируются по своему номеру).
+        """
+        with self._lock:
+            self._stats["requests"] += 1
+            slot = next(self._sequence)
+            self._recent[slot] = False
+            while len(self._recent) > settings.HEDGE_RATE_WINDOW:
+                self._recent.popitem(last=False)
+            return slot
+
+    def try_acquire(self, slot: int, estimated_tokens: int) -> bool:
+        """
+        Проверяет лимиты и резервирует бюджет под хеджирующий запрос.
+
+        Args:
+            slot (int): Номер запроса из start_request.
+            estimated_tokens (int): Оценка токенов дополнительного запроса (вход + выход).
+
+        Returns:
+            bool: True, если хеджирование разрешено.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._budget_started >= settings.HEDGE_BUDGET_WINDOW_SEC:
+                self._budget_started = now
+                self._budget_used = 0
+            hedge_rate = sum(self._recent.values()) / len(self._recent) if self._recent else 0.0
+            if hedge_rate >= settings.HEDGE_MAX_RATE:
+                self._stats["skipped_by_rate_cap"] += 1
+                return False
+            if self._budget_used + estimated_tokens > settings.HEDGE_MAX_EXTRA_TOKENS:
+                self._stats["skipped_by_token_cap"] += 1
+                return False
+            self._budget_used += estimated_tokens
+            self._stats["hedged"] += 1
+            self._stats["extra_tokens"] += estimated_tokens
+            # Запрос, вытесненный из окна более новыми, в долю уже не входит
+            if slot in self._recent:
+                self._recent[slot] = True
+            return True
+
+    def record_win(self, hedge_won: bool):
+        """Учитывает, какой из запросов (основной или хеджирующий) ответил первым."""
+        if hedge_won:
+            with self._lock:
+                self._stats["hedge_wins"] += 1
+
+    def stats(self) -> dict:
+        """Сводная статистика хеджирования для отчетов."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hedge_rate"] = stats["hedged"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+def pick_hedge_model(model_id: str, candidates: list) -> str:
+    """
+    Выбирает модель для хеджирующего запроса: та же модель или следующая здоровая
+    резервная (settings.HEDGE_TARGET = "same" | "alternate").
+    """
+    if settings.HEDGE_TARGET == "alternate":
+        for candidate in candidates:
+            if candidate != model_id:
+                return candidate
+    return model_id
+
+# Общая для процесса политика хеджирования
+policy = HedgePolicy()
@@ -0,0 +1,152 @@
+"""
+Маршрутизатор AI моделей с автоматическим переключением на резервные модели
+"""
+
+import os
+import time
+import threading
+from src.config import settings
+
+# Провайдер определяется по префиксу идентификатора модели
+PROVIDER_PREFIXES = {
+    "openai": ("gpt", "o1", "o3"),
+    "anthropic": ("claude",),
+}
+
+PROVIDER_API_KEYS = {
+    "openai": "OPENAI_API_KEY",
+    "anthropic": "ANTHROPIC_API_KEY",
+}
+
+def detect_provider(model_id: str):
+    """Возвращает имя провайдера ("openai", "anthropic") для модели или None, если он неизвестен."""
+    for provider, prefixes in PROVIDER_PREFIXES.items():
+        if model_id.startswith(prefixes):
+            return provider
+    return None
+
+def build_provider_table() -> dict:
+    """
+    Строит таблицу провайдеров по settings.AVAILABLE_MODELS.
+
+    Returns:
+        dict: {model_id: {"name": отображаемое имя, "provider": провайдер}}
+    """
+    table = {}
+    for name, model_id in settings.AVAILABLE_MODELS.items():
+        table[model_id] = {"name": name, "provider": detect_provider(model_id)}
+    return table
+
+class ModelRouter:
+    """
+    Выбирает модель для запроса с учетом состояния провайдеров.
+
+    Для каждой модели хранится сглаженная задержка и история ошибок. Модель после
+    нескольких ошибок подряд или со слишком большой задержкой считается деградировавшей
+    и уходит в конец очереди кандидатов, пока не восстановится (по успешному ответу или пробе).
+    """
+
+    def __init__(self):
+        self.providers = build_provider_table()
+        self._health = {}
+        self._lock = threading.Lock()
+        # Первая проба - через интервал после старта, до этого состояние набирается по реальным запросам
+        self._last_probe = time.monotonic()
+
+    def _state(self, model_id: str) -> dict:
+        return self._health.setdefault(model_id, {
+            "latency": None,
+            "consecutive_failures": 0,
+            "last_failure": 0.0,
+            "last_error": None,
+        })
+
+    def is_configured(self, model_id: str) -> bool:
+        """Проверяет, что провайдер модели известен и для него задан API-ключ."""
+        provider = self.providers.get(model_id, {}).get("provider") or detect_provider(model_id)
+        return provider is not None and bool(os.getenv(PROVIDER_API_KEYS[provider]))
+
+    def is_healthy(self, model_id: str) -> bool:
+        """Модель здорова, если не находится в паузе после ошибок и отвечает не медленнее порога."""
+        with self._lock:
+            state = self._state(model_id)
+            in_cooldown = (
+                state["consecutive_failures"] >= settings.ROUTER_MAX_CONSECUTIVE_FAILURES
+                and time.monotonic() - state["last_failure"] < settings.ROUTER_FAILURE_COOLDOWN_SEC
+            )
+            too_slow = state["latency"] is not None and state["latency"] > settings.ROUTER_SLOW_LATENCY_SEC
+        return not in_cooldown and not too_slow
+
+    def meets_slo(self, model_id: str, latency_slo: float) -> bool:
+        """Сглаженная задержка модели не превышает SLO этапа (модель без замеров считается подходящей)."""
+        with self._lock:
+            latency = self._state(model_id)["latency"]
+        return latency is None or latency <= latency_slo
+
+    def candidates(self, model_id: str, stage: str = None, latency_slo: float = None) -> list:
+        """
+        Возвращает упорядоченный список моделей для запроса: выбранная модель,
+        затем резервные модели этапа. Здоровые модели идут первыми, порядок внутри групп сохраняется.
+        Если задан SLO задержки этапа, среди здоровых первыми идут модели, укладывающиеся в него.
+
+        Args:
+            model_id (str): Основная (выбранная пользователем) модель.
+            stage (str, optional): Этап анализа из settings.STAGE_FALLBACKS.
+            latency_slo (float, optional): Целевая задержка этапа в секундах (settings.STAGE_MODELS).
+        """
+        ordered = [model_id]
+        for fallback in settings.STAGE_FALLBACKS.get(stage, settings.STAGE_FALLBACKS["default"]):
+            if fallback not in ordered:
+                ordered.append(fallback)
+        configured = [m for m in ordered if self.is_configured(m)]
+        if not configured:
+            # Ни один провайдер не настроен - оставляем выбранную модель, чтобы вызов вернул понятную ошибку
+            return [model_id]
+        healthy = [m for m in configured if self.is_healthy(m)]
+        degraded = [m for m in configured if m not in healthy]
+        if latency_slo is not None:
+            # Сортировка устойчива: внутри групп сохраняется порядок резервных моделей
+            healthy.sort(key=lambda m: not self.meets_slo(m, latency_slo))
+        return healthy + degraded
+
+    def record_success(self, model_id: str, latency: float):
+        """Учитывает успешный ответ модели и ее задержку (экспоненциальное сглаживание)."""
+        with self._lock:
+            state = self._state(model_id)
+            alpha = settings.ROUTER_LATENCY_SMOOTHING
+            state["latency"] = latency if state["latency"] is None else alpha * latency + (1 - alpha) * state["latency"]
+            state["consecutive_failures"] = 0
+
+    def record_failure(self, model_id: str, error):
+        """Учитывает ошибку модели."""
+        with self._lock:
+            state = self._state(model_id)
+            state["consecutive_failures"] += 1
+            state["last_failure"] = time.monotonic()
+            state["last_error"] = str(error)
+
+    def probe_due(self) -> bool:
+        """Возвращает True (и отмечает время), если пора повторно измерить задержку провайдеров."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_probe < settings.ROUTER_PROBE_INTERVAL_SEC:
+                return False
+            self._last_probe = now
+            return True
+
+    def probe_targets(self) -> list:
+        """Модели, участвующие в маршрутизации и доступные для проб."""
+        targets = []
+        for models in settings.STAGE_FALLBACKS.values():
+            for model_id in models:
+                if model_id not in targets and self.is_configured(model_id):
+                    targets.append(model_id)
+        return targets
+
+    def snapshot(self) -> dict:
+        """Текущее состояние моделей для отображения и диагностики."""
+        with self._lock:
+            return {model_id: dict(state) for model_id, state in self._health.items()}
+
+# Общий для процесса маршрутизатор
+router = ModelRouter()
@@ -0,0 +1,164 @@
+"""
+Сравнительные отчеты по большим тендерам: шорт-лист и сводки групп КП
+
+Сравнительный анализ и аналитический отчет передают модели данные всех КП одним запросом,
+и с ростом числа КП запрос перестает укладываться в контекст. Если данные всех КП не входят
+во входной бюджет этапа comparative_report, лучшие КП по общей оценке (шорт-лист,
+settings.REPORT_SHORTLIST_K) передаются целиком, а остальные делятся на группы, которые
+параллельно сворачиваются в короткие сводки моделью этапа report_group. Если сводок слишком
+много, они сворачиваются повторно (дерево), поэтому размер итогового запроса и число
+последовательных шагов ограничены при любом числе КП.
+"""
+
+from src.config import settings
+from src.services import ai_service, token_budget
+
+GROUP_SYSTEM_PROMPT = (
+    "Ты - аналитик тендерных процессов. Тебе даны данные группы коммерческих предложений (КП) одного тендера. "
+    "Составь сжатую сводку группы для итогового сравнительного отчета (не более 200 слов, Markdown):\n"
+    "- 2-3 сильнейших КП группы с названиями компаний и причинами;\n"
+    "- диапазон стоимости и сроков в группе;\n"
+    "- типичные пропущенные требования и слабые стороны;\n"
+    "- заметные риски конкретных компаний.\n"
+    "Названия компаний и числа приводи точно как в данных. Не придумывай сведений, которых нет в данных."
+)
+
+MERGE_SYSTEM_PROMPT = (
+    "Ты - аналитик тендерных процессов. Тебе даны сводки нескольких групп коммерческих предложений одного тендера. "
+    "Объедини их в одну сжатую сводку (не более 250 слов, Markdown): сильнейшие КП с названиями компаний, "
+    "диапазоны стоимости и сроков, типичные недостатки и риски. Названия компаний и числа приводи точно как в сводках."
+)
+
+def _pack_groups(blocks: list, model_id: str) -> list:
+    """Делит блоки на группы не больше settings.REPORT_GROUP_SIZE и входного бюджета этапа report_group."""
+    budget = token_budget.get_stage_budget("report_group")["input"]
+    groups, current, current_tokens = [], [], 0
+    for block in blocks:
+        block, _ = token_budget.truncate_to_tokens(block, budget, model_id)
+        tokens = token_budget.estimate_tokens(block, model_id)
+        if current and (len(current) >= settings.REPORT_GROUP_SIZE or current_tokens + tokens > budget):
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(block)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def summarize_groups(blocks: list, merge: bool = False) -> list:
+    """
+    Сворачивает блоки (данные КП или сводки групп) в сводки групп параллельными запросами.
+
+    Args:
+        blocks (list): Текстовые блоки в порядке общей оценки КП.
+        merge (bool): Блоки - сводки предыдущего уровня (повторная свертка).
+
+    Returns:
+        list: Сводки групп в исходном порядке. Если модель не ответила, сводкой группы
+        становятся первые строки ее блоков, чтобы ни одно КП не выпало из отчета.
+    """
+    model_id = ai_service.get_stage_config("report_group")["model"]
+    groups = _pack_groups(blocks, model_id)
+    requests = [
+        {
+            "prompt": f"# {'Сводки групп' if merge else 'Данные группы КП'} ({index} из {len(groups)})\n\n" + "\n".join(group),
+            "system_prompt": MERGE_SYSTEM_PROMPT if merge else GROUP_SYSTEM_PROMPT,
+            "stage": "report_group",
+        }
+        for index, group in enumerate(groups, 1)
+    ]
+    responses = ai_service.gather_ai_responses(requests)
+
+    summaries = []
+    for group, response in zip(groups, responses):
+        if not response or response.startswith("Error:"):
+            print(f"Сводка группы КП не получена: {response}")
+            response = "\n".join(block.strip().splitlines()[0] for block in group if block.strip())
+        summaries.append(response.strip())
+    return summaries
+
+def build_report_prompt(header: str, blocks: list, overall_scores: list, model_id: str = None):
+    """
+    Запрос сравнительного отчета, который укладывается во входной бюджет этапа comparative_report.
+
+    Если данные всех КП укладываются в бюджет, запрос совпадает с прежним (все КП целиком).
+    Иначе в запрос попадают шорт-лист КП целиком и сводки групп остальных КП.
+
+    Args:
+        header (str): Заголовок запроса.
+        blocks (list): Данные КП (по блоку Markdown на КП).
+        overall_scores (list): Общие оценки КП (scoring) в порядке blocks.
+        model_id (str, optional): Модель отчета для оценки токенов.
+
+    Returns:
+        tuple: (запрос, {"mode": "flat" | "hierarchical", "total", "shortlist", "groups", "levels"})
+    """
+    budget = token_budget.get_stage_budget("comparative_report")["input"]
+    info = {"mode": "flat", "total": len(blocks), "shortlist": len(blocks), "groups": 0, "levels": 0}
+    prompt = header + "".join(blocks)
+    if token_budget.estimate_tokens(prompt, model_id) <= budget:
+        return prompt, info
+
+    # Шорт-лист: лучшие КП по общей оценке, пока они укладываются в свою долю бюджета
+    order = sorted(range(len(blocks)), key=lambda i: overall_scores[i], reverse=True)
+    shortlist_budget = budget * settings.REPORT_SHORTLIST_SHARE - token_budget.estimate_tokens(header, model_id)
+    shortlist, shortlist_blocks, used = [], [], 0
+    for i in order[:settings.REPORT_SHORTLIST_K]:
+        block = blocks[i]
+        tokens = token_budget.estimate_tokens(block, model_id)
+        if used + tokens > shortlist_budget:
+            if shortlist:
+                break
+            # Даже лучший КП не укладывается в долю шорт-листа: в отчет идет начало его данных
+            block, _ = token_budget.truncate_to_tokens(block, max(int(shortlist_budget), 0), model_id)
+            if not block:
+                break
+            tokens = token_budget.estimate_tokens(block, model_id)
+        shortlist.append(i)
+        shortlist_blocks.append(block)
+        used += tokens
+    rest = [blocks[i] for i in order if i not in shortlist]
+
+    # Свертка остальных КП: группы параллельно, затем сводки сводок, пока не уложатся в остаток бюджета
+    intro = (
+        f"Всего КП в тендере: {len(blocks)}. Данные {len(shortlist)} лучших КП по общей оценке приведены целиком, "
+        f"остальные {len(rest)} КП - в виде сводок по группам.\n\n"
+    )
+    shortlist_text = "## Шорт-лист: лучшие КП по общей оценке (полные данные)\n\n" + "".join(shortlist_blocks)
+    rest_heading = "## Остальные КП (сводки по группам)\n\n"
+    rest_budget = budget - token_budget.estimate_tokens(header + intro + shortlist_text + rest_heading + "\n", model_id)
+    summaries = summarize_groups(rest)
+    info.update(mode="hierarchical", shortlist=len(shortlist), groups=len(summaries), levels=1)
+    while len(summaries) > 1 and token_budget.estimate_tokens("\n\n".join(summaries), model_id) > rest_budget:
+        merged = summarize_groups(summaries, merge=True)
+        if len(merged) >= len(summaries):
+            break
+        summaries = merged
+        info["levels"] += 1
+    summaries_text = "\n\n".join(summaries)
+    while True:
+        summaries_text, _ = token_budget.truncate_to_tokens(summaries_text, max(rest_budget, 0), model_id)
+        prompt = f"{header}{intro}{shortlist_text}{rest_heading}{summaries_text}\n"
+        # Оценка склеенного текста может немного отличаться от суммы оценок частей
+        overflow = token_budget.estimate_tokens(prompt, model_id) - budget
+        if overflow <= 0 or not summaries_text:
+            break
+        rest_budget -= overflow
+    # Сводок уже нет, а запрос все еще не укладывается (длинный заголовок или шорт-лист):
+    # обрезаем сам запрос, чтобы он не был отклонен моделью
+    if token_budget.estimate_tokens(prompt, model_id) > budget:
+        print("Запрос сравнительного отчета превышает входной бюджет этапа и обрезан")
+    max_tokens = budget
+    while max_tokens > 0 and token_budget.estimate_tokens(prompt, model_id) > budget:
+        prompt, _ = token_budget.truncate_to_tokens(prompt, max_tokens, model_id)
+        max_tokens -= max(token_budget.estimate_tokens(prompt, model_id) - budget, 1)
+    return prompt, info
+
+def describe_mode(info: dict):
+    """Текстовое пояснение к отчету, составленному по шорт-листу и сводкам групп, или None."""
+    if info["mode"] != "hierarchical":
+        return None
+    return (
+        f"КП в тендере: {info['total']}. В отчет целиком переданы {info['shortlist']} лучших КП по общей оценке, "
+        f"остальные - сводками {info['groups']} групп (уровней свертки: {info['levels']})."
+    )
@@ -0,0 +1,61 @@
+"""
+Объединение одинаковых одновременных запросов к AI моделям (single-flight)
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+
+def make_cache_key(model_id: str, system_prompt: str, prompt: str, max_tokens: int = None, json_schema: dict = None) -> str:
+    """Ключ запроса: хеш всех параметров, влияющих на ответ модели."""
+    payload = json.dumps(
+        [model_id, system_prompt, prompt, max_tokens, json_schema],
+        ensure_ascii=False,
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class RequestCoalescer:
+    """
+    Объединяет одновременные запросы с одинаковым ключом: к провайдеру уходит только первый,
+    остальные ждут его результата (или ошибки). Работает в общем event loop ai_service,
+    поэтому запросы из разных сессий Streamlit (два аналитика, двойной клик) тоже объединяются.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "coalesced": 0}
+
+    async def run(self, key: str, factory):
+        """
+        Выполняет запрос или присоединяется к уже выполняющемуся с тем же ключом.
+
+        Args:
+            key (str): Ключ запроса (make_cache_key).
+            factory: Функция без аргументов, возвращающая корутину запроса.
+
+        Returns:
+            Результат запроса и True, если он получен от чужого (уже выполнявшегося) запроса.
+        """
+        task = self._in_flight.get(key)
+        joined = task is not None
+        with self._lock:
+            self._stats["requests"] += 1
+            if joined:
+                self._stats["coalesced"] += 1
+        if not joined:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # shield: отмена одного из ожидающих не должна отменять общий запрос для остальных
+        return await asyncio.shield(task), joined
+
+    def stats(self) -> dict:
+        """Сколько запросов прошло через объединение и сколько дублей не ушло к провайдеру."""
+        with self._lock:
+            return dict(self._stats)
+
+# Общий для процесса объединитель запросов (используется только из потока event loop)
+coalescer = RequestCoalescer()
@@ -0,0 +1,121 @@
+"""
+Оценка КП тендера: рейтинг по критериям, общая оценка и итоговая рекомендация
+
+Все представления (сравнительная таблица, аналитический отчет, графики, PDF и отчет по КП)
+берут оценки из одной таблицы score_results, а не пересчитывают их каждое по-своему.
+Таблица строится за один проход по всем КП (матрица рейтингов NumPy) и кешируется
+по версии набора результатов, поэтому повторные отрисовки страницы ее не пересчитывают.
+"""
+
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from src.config import settings
+
+# Уровни итоговой рекомендации (подписи задает каждое представление)
+LEVELS = ("recommend", "conditional", "reject")
+
+CRITERIA_IDS = [criterion["id"] for criterion in settings.EVALUATION_CRITERIA]
+CRITERIA_WEIGHTS = np.array([criterion["weight"] for criterion in settings.EVALUATION_CRITERIA], dtype=float)
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def _scoring_inputs(result: dict) -> list:
+    comparison = result.get("comparison_result") or {}
+    return [
+        result.get("kp_name"),
+        result.get("company_name"),
+        comparison.get("compliance_score"),
+        result.get("ratings") or {},
+        len(comparison.get("missing_requirements") or []),
+        len(comparison.get("additional_features") or []),
+        result.get("additional_info_analysis") is not None,
+    ]
+
+def results_version(results: list) -> str:
+    """Версия набора результатов: хеш данных, от которых зависят оценки."""
+    payload = json.dumps([_scoring_inputs(result) for result in results], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _build_frame(results: list) -> pd.DataFrame:
+    count = len(results)
+    ratings = np.full((count, len(CRITERIA_IDS)), np.nan)
+    for row, result in enumerate(results):
+        result_ratings = result.get("ratings") or {}
+        for column, criterion_id in enumerate(CRITERIA_IDS):
+            value = result_ratings.get(criterion_id)
+            if value is not None:
+                ratings[row, column] = value
+    compliance = np.array(
+        [(result.get("comparison_result") or {}).get("compliance_score") or 0 for result in results], dtype=float
+    )
+
+    # Взвешенное среднее по критериям, для которых есть оценка (КП без оценок получает 0, как раньше)
+    present = ~np.isnan(ratings)
+    weight_sums = (present * CRITERIA_WEIGHTS).sum(axis=1)
+    weighted = np.nan_to_num(ratings) @ CRITERIA_WEIGHTS
+    rating = np.divide(weighted, weight_sums, out=np.zeros(count), where=weight_sums > 0)
+
+    share = settings.SCORING_COMPLIANCE_SHARE
+    overall = rating * 10 * (1 - share) + compliance * share
+    level = np.select(
+        [overall >= settings.SCORING_THRESHOLDS["recommend"], overall >= settings.SCORING_THRESHOLDS["conditional"]],
+        ["recommend", "conditional"],
+        default="reject",
+    )
+
+    frame = pd.DataFrame(ratings, columns=CRITERIA_IDS)
+    frame.insert(0, "kp_name", [result.get("kp_name") for result in results])
+    frame.insert(1, "company_name", [result.get("company_name", result.get("kp_name")) for result in results])
+    frame["compliance"] = compliance
+    frame["rating"] = rating
+    frame["overall"] = overall
+    frame["level"] = level
+    frame["rank"] = frame["overall"].rank(ascending=False, method="first").astype(int)
+    frame["missing_count"] = [len((r.get("comparison_result") or {}).get("missing_requirements") or []) for r in results]
+    frame["additional_count"] = [len((r.get("comparison_result") or {}).get("additional_features") or []) for r in results]
+    frame["has_additional_info"] = [r.get("additional_info_analysis") is not None for r in results]
+    return frame
+
+def score_results(results: list) -> pd.DataFrame:
+    """
+    Таблица оценок всех КП (строки в порядке results).
+
+    Args:
+        results (list): Результаты анализа КП (st.session_state.all_analysis_results).
+
+    Returns:
+        pd.DataFrame: kp_name, company_name, оценки по критериям (id из settings.EVALUATION_CRITERIA),
+        compliance, rating (взвешенный рейтинг 1-10), overall (0-100), level (LEVELS), rank (1 - лучшее КП),
+        missing_count, additional_count, has_additional_info.
+    """
+    version = results_version(results)
+    with _lock:
+        frame = _cache.get(version)
+        if frame is not None:
+            _cache.move_to_end(version)
+    if frame is None:
+        frame = _build_frame(results)
+        with _lock:
+            _cache[version] = frame
+            while len(_cache) > settings.SCORING_CACHE_SIZE:
+                _cache.popitem(last=False)
+    # Копия: представления могут менять свою таблицу, не затрагивая кеш
+    return frame.copy()
+
+def score_of(result: dict, results: list = None) -> pd.Series:
+    """
+    Оценки одного КП. Если КП входит в results, берется строка общей таблицы тендера
+    (с местом среди всех КП), иначе КП оценивается отдельно.
+    """
+    results = results or []
+    position = next((i for i, item in enumerate(results) if item is result), None)
+    if position is None:
+        position = next((i for i, item in enumerate(results) if item.get("kp_name") == result.get("kp_name")), None)
+    if position is None:
+        return score_results([result]).iloc[0]
+    return score_results(results).iloc[position]
@@ -0,0 +1,201 @@
+"""
+Поиск почти одинаковых КП (MinHash по шинглам слов) для повторного использования анализа
+
+Поставщики часто присылают КП повторно, изменив только сопроводительное письмо или дату.
+Для каждого ТЗ хранится индекс проанализированных КП: MinHash-подпись текста и результат анализа.
+Если новое КП почти совпадает с уже проанализированным (оценка сходства Жаккара по подписям
+не ниже settings.DEDUP_THRESHOLD), прежний результат можно использовать вместо трех запросов к моделям.
+"""
+
+import re
+import copy
+import json
+import zlib
+import hashlib
+import threading
+from pathlib import Path
+from datetime import datetime
+import numpy as np
+from src.config import settings
+
+_WORD_RE = re.compile(r"\w+")
+# Простое число больше 2^32: хеши шинглов (crc32) и коэффициенты перестановок меньше 2^32,
+# поэтому a * x + b помещается в uint64 без переполнения
+_HASH_PRIME = np.uint64(4294967311)
+
+def _permutations(num_perm: int, seed: int):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 32, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 2 ** 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+_PERM_A, _PERM_B = _permutations(settings.DEDUP_NUM_PERM, settings.DEDUP_SEED)
+
+def text_hash(text: str) -> str:
+    """Хеш текста без учета регистра, пунктуации и пробелов."""
+    return hashlib.sha256(" ".join(_WORD_RE.findall(text.lower())).encode("utf-8")).hexdigest()
+
+def shingles(text: str, size: int = None) -> set:
+    """
+    Шинглы текста: последовательности из size слов (без учета регистра и пунктуации).
+
+    Args:
+        text (str): Текст документа.
+        size (int, optional): Длина шингла в словах. По умолчанию settings.DEDUP_SHINGLE_SIZE.
+
+    Returns:
+        set: Множество шинглов (короткий текст дает один шингл из всех слов).
+    """
+    size = size or settings.DEDUP_SHINGLE_SIZE
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def minhash_signature(text: str) -> np.ndarray:
+    """
+    MinHash-подпись текста: для каждой из settings.DEDUP_NUM_PERM хеш-перестановок -
+    минимальное значение по всем шинглам. Доля совпадающих позиций двух подписей
+    оценивает сходство Жаккара множеств шинглов.
+
+    Returns:
+        np.ndarray: Подпись (uint64) длины settings.DEDUP_NUM_PERM.
+    """
+    values = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text)),
+        dtype=np.uint64
+    )
+    if values.size == 0:
+        return np.full(_PERM_A.size, _HASH_PRIME, dtype=np.uint64)
+    hashed = (np.outer(values, _PERM_A) + _PERM_B) % _HASH_PRIME
+    return hashed.min(axis=0)
+
+def estimate_similarity(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    """Оценка сходства Жаккара по двум MinHash-подписям (0..1)."""
+    return float(np.mean(signature_a == signature_b))
+
+class ProposalIndex:
+    """
+    Индекс проанализированных КП по ТЗ. Для каждого ТЗ (по хешу его текста) хранится файл
+    в settings.DEDUP_DIR со списком КП: подпись, хеш текста, результат анализа и время анализа.
+    """
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def _path(self, tz_key: str) -> Path:
+        return self.index_dir / f"{tz_key}.json"
+
+    def _entries(self, tz_key: str) -> list:
+        if tz_key not in self._cache:
+            path = self._path(tz_key)
+            entries = []
+            if path.exists():
+                try:
+                    data = json.loads(path.read_text(encoding="utf-8"))
+                    # Подписи с другими параметрами MinHash несравнимы с текущими
+                    if data.get("num_perm") == settings.DEDUP_NUM_PERM and data.get("shingle_size") == settings.DEDUP_SHINGLE_SIZE:
+                        entries = data["entries"]
+                except (OSError, ValueError) as e:
+                    print(f"Не удалось прочитать индекс похожих КП {path}: {e}")
+            for entry in entries:
+                entry["signature"] = np.array(entry["signature"], dtype=np.uint64)
+            self._cache[tz_key] = entries
+        return self._cache[tz_key]
+
+    def _save(self, tz_key: str):
+        """Сохраняет индекс ТЗ (запись через временный файл, чтобы не повредить его при сбое)."""
+        path = self._path(tz_key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "num_perm": settings.DEDUP_NUM_PERM,
+            "shingle_size": settings.DEDUP_SHINGLE_SIZE,
+            "entries": [{**entry, "signature": entry["signature"].tolist()} for entry in self._cache[tz_key]],
+        }
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp_path.replace(path)
+
+    def find(self, tz_text: str, kp_text: str, threshold: float = None):
+        """
+        Ищет ранее проанализированное КП, почти совпадающее с kp_text, для того же ТЗ.
+
+        Args:
+            tz_text (str): Текст ТЗ.
+            kp_text (str): Текст нового КП.
+            threshold (float, optional): Минимальное сходство. По умолчанию settings.DEDUP_THRESHOLD.
+
+        Returns:
+            dict: {"kp_name", "similarity", "analyzed_at", "result"} самого похожего КП или None.
+        """
+        threshold = settings.DEDUP_THRESHOLD if threshold is None else threshold
+        kp_key = text_hash(kp_text)
+        signature = minhash_signature(kp_text)
+        best = None
+        with self._lock:
+            for entry in self._entries(text_hash(tz_text)):
+                similarity = 1.0 if entry["kp_hash"] == kp_key else estimate_similarity(signature, entry["signature"])
+                if similarity >= threshold and (best is None or similarity > best[0]):
+                    best = (similarity, entry)
+        if best is None:
+            return None
+        similarity, entry = best
+        return {
+            "kp_name": entry["kp_name"],
+            "similarity": similarity,
+            "analyzed_at": entry["analyzed_at"],
+            "result": copy.deepcopy(entry["result"]),
+        }
+
+    def add(self, tz_text: str, kp_text: str, kp_name: str, result: dict):
+        """Добавляет проанализированное КП в индекс ТЗ (запись с тем же текстом КП заменяется)."""
+        tz_key = text_hash(tz_text)
+        kp_key = text_hash(kp_text)
+        entry = {
+            "kp_name": kp_name,
+            "kp_hash": kp_key,
+            "signature": minhash_signature(kp_text),
+            "analyzed_at": datetime.now().isoformat(timespec="seconds"),
+            "result": copy.deepcopy(result),
+        }
+        with self._lock:
+            entries = [e for e in self._entries(tz_key) if e["kp_hash"] != kp_key]
+            entries.append(entry)
+            self._cache[tz_key] = entries[-settings.DEDUP_MAX_ENTRIES:]
+            try:
+                self._save(tz_key)
+            except OSError as e:
+                print(f"Не удалось сохранить индекс похожих КП: {e}")
+
+def reuse_result(match: dict, kp_name: str) -> dict:
+    """
+    Результат анализа нового КП на основе найденного похожего КП с отметкой о происхождении.
+
+    Args:
+        match (dict): Результат ProposalIndex.find.
+        kp_name (str): Имя файла нового КП.
+    """
+    result = match["result"]
+    result.pop("provenance", None)
+    result["kp_name"] = kp_name
+    result["provenance"] = {
+        "reused_from": match["kp_name"],
+        "similarity": match["similarity"],
+        "analyzed_at": match["analyzed_at"],
+    }
+    return result
+
+def describe_provenance(result: dict):
+    """Текстовая отметка о повторном использовании анализа или None, если КП анализировалось заново."""
+    provenance = result.get("provenance")
+    if not provenance:
+        return None
+    return (
+        f"♻️ Использован анализ почти совпадающего КП «{provenance['reused_from']}» "
+        f"(сходство {provenance['similarity']:.0%}, анализ от {provenance['analyzed_at'].replace('T', ' ')})"
+    )
+
+# Общий для процесса индекс проанализированных КП
+index = ProposalIndex(settings.DEDUP_DIR)
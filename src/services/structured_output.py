@@ -0,0 +1,202 @@
+"""
+Разбор и проверка структурированных (JSON) ответов AI моделей
+"""
+
+import json
+import re
+from typing import Annotated
+from pydantic import TypeAdapter, ValidationError
+from src.services import token_budget
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_WORD_RE = re.compile(r"\w{4,}")
+
+def build_json_schema(model_cls) -> dict:
+    """
+    Возвращает описание схемы для JSON/tool-use режимов провайдеров.
+
+    Returns:
+        dict: {"name": имя схемы, "description": описание, "schema": JSON Schema}
+    """
+    return {
+        "name": model_cls.__name__,
+        "description": (model_cls.__doc__ or "").strip(),
+        "schema": model_cls.model_json_schema(),
+    }
+
+def _close_truncated_json(text: str) -> str:
+    """
+    Достраивает оборванный JSON: закрывает незавершенную строку и открытые скобки,
+    отбрасывая недописанную последнюю пару ключ-значение.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    last_complete = 0  # Позиция после последнего завершенного элемента верхнего уровня вложенности
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            last_complete = index + 1
+        elif char == ",":
+            last_complete = index
+
+    if not stack:
+        return text
+    # Если строка оборвана внутри значения массива строк, ее можно закрыть без потери структуры
+    if in_string and stack[-1] == "]":
+        repaired = text + '"'
+    else:
+        repaired = text[:last_complete]
+        stack = []
+        # Пересчитываем открытые скобки для обрезанного префикса
+        in_string = False
+        escaped = False
+        for char in repaired:
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+                continue
+            if char == '"':
+                in_string = True
+            elif char in "{[":
+                stack.append("}" if char == "{" else "]")
+            elif char in "}]" and stack:
+                stack.pop()
+    repaired = repaired.rstrip().rstrip(",")
+    return repaired + "".join(reversed(stack))
+
+def parse_json_tolerant(text: str):
+    """
+    Извлекает JSON-объект из ответа модели: убирает обертку ```json, пояснения вокруг объекта,
+    висячие запятые и достраивает ответ, оборванный по лимиту токенов.
+
+    Returns:
+        dict | None: Разобранный объект или None, если восстановить JSON не удалось.
+    """
+    if not text:
+        return None
+    cleaned = _FENCE_RE.sub("", text.strip())
+    start = cleaned.find("{")
+    if start == -1:
+        return None
+    cleaned = cleaned[start:]
+    end = cleaned.rfind("}")
+    candidates = [cleaned[:end + 1]] if end != -1 else []
+    candidates.append(_close_truncated_json(cleaned))
+    for candidate in candidates:
+        for variant in (candidate, _TRAILING_COMMA_RE.sub(r"\1", candidate)):
+            try:
+                data = json.loads(variant)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, dict):
+                return data
+    return None
+
+def validate_fields(data: dict, model_cls):
+    """
+    Проверяет данные по схеме поле за полем.
+
+    Returns:
+        tuple: (словарь валидных полей в нормализованном виде, список отсутствующих или невалидных полей)
+    """
+    data = data or {}
+    try:
+        return model_cls.model_validate(data).model_dump(), []
+    except ValidationError as e:
+        invalid = sorted({str(error["loc"][0]) for error in e.errors() if error["loc"]})
+    valid = {}
+    for name, field in model_cls.model_fields.items():
+        if name in invalid or name not in data:
+            continue
+        # Приводим валидное поле к типу схемы и выгружаем так же, как при полной проверке ("85" -> 85,
+        # вложенные модели -> словари), чтобы частичный результат был сериализуем в JSON
+        annotation = Annotated[(field.annotation, *field.metadata)] if field.metadata else field.annotation
+        adapter = TypeAdapter(annotation)
+        valid[name] = adapter.dump_python(adapter.validate_python(data[name]))
+    return valid, [name for name in model_cls.model_fields if name not in valid]
+
+def build_repair_schema(model_cls, fields: list) -> dict:
+    """Схема, содержащая только поля, которые нужно дозапросить у модели."""
+    schema = build_json_schema(model_cls)
+    full = schema["schema"]
+    schema["name"] = f"{model_cls.__name__}Repair"
+    schema["schema"] = {
+        **full,
+        "title": schema["name"],
+        "properties": {name: full["properties"][name] for name in fields},
+        "required": list(fields),
+    }
+    return schema
+
+def _stems(text: str) -> set:
+    """Грубые основы слов (первые 5 букв) для сопоставления полей схемы с абзацами запроса."""
+    return {word[:5] for word in _WORD_RE.findall(text.lower())}
+
+def source_excerpt(prompt: str, hint: str, max_tokens: int, model_id: str = None) -> str:
+    """
+    Фрагмент исходного запроса для дозапроса полей: если запрос не укладывается в max_tokens,
+    берутся абзацы, больше всего похожие на описание недостающих полей (hint), в исходном порядке.
+    """
+    if token_budget.estimate_tokens(prompt, model_id) <= max_tokens:
+        return prompt
+    paragraphs = [paragraph for paragraph in _PARAGRAPH_RE.split(prompt) if paragraph.strip()]
+    keywords = _stems(hint)
+    # При равном сходстве предпочтение - началу документа (название компании, реквизиты, цены)
+    ranked = sorted(range(len(paragraphs)), key=lambda i: len(keywords & _stems(paragraphs[i])), reverse=True)
+    chosen, used = [], 0
+    for i in ranked:
+        tokens = token_budget.estimate_tokens(paragraphs[i], model_id)
+        if used + tokens <= max_tokens:
+            chosen.append(i)
+            used += tokens
+    if not chosen:
+        return token_budget.truncate_to_tokens(prompt, max_tokens, model_id)[0]
+    return "\n\n".join(paragraphs[i] for i in sorted(chosen))
+
+def build_repair_prompt(prompt: str, data: dict, model_cls, fields: list, max_tokens: int, model_id: str = None) -> str:
+    """
+    Компактный запрос на дозаполнение отдельных полей вместо повторения всего вызова: уже полученные
+    поля, описание недостающих и только подходящий к ним фрагмент исходного запроса (source_excerpt).
+
+    Args:
+        prompt (str): Исходный запрос.
+        data (dict): Валидные поля, полученные в предыдущем ответе.
+        model_cls: Pydantic-модель ответа.
+        fields (list): Поля, которые нужно дозапросить.
+        max_tokens (int): Бюджет токенов на фрагмент исходного запроса.
+        model_id (str, optional): Модель для оценки токенов.
+
+    Returns:
+        str: Запрос на дозаполнение.
+    """
+    descriptions = "\n".join(
+        f"- {name}: {model_cls.model_fields[name].description or name}" for name in fields
+    )
+    excerpt = source_excerpt(prompt, descriptions, max_tokens, model_id)
+    return (
+        f"Предыдущий ответ был неполным или некорректным. Уже получено (не повторяй):\n"
+        f"{json.dumps(data, ensure_ascii=False)}\n\n"
+        f"Верни ТОЛЬКО JSON-объект с полями:\n{descriptions}\n"
+        f"Другие поля не включай.\n\n"
+        f"=== Фрагмент исходных данных ===\n{excerpt}"
+    )
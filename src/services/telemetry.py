@@ -0,0 +1,218 @@
+"""
+Телеметрия вызовов AI моделей и этапов анализа
+
+Каждый вызов модели записывается (этап, модель, задержка, время до первого токена, токены,
+повторы, попадания в кеш), а этапы конвейера оформляются как спаны. Данные доступны в процессе
+(recent_calls, summary) и, если установлены соответствующие пакеты, экспортируются:
+- prometheus_client - метрики на HTTP-эндпоинте settings.PROMETHEUS_PORT (0 - выключено);
+- opentelemetry - спаны через глобальный TracerProvider (настраивается стандартно, например OTEL_* переменными).
+Пакеты импортируются при первой записи, чтобы не увеличивать время холодного старта.
+"""
+
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from src.config import settings
+
+# Счетчик HTTP-попыток текущего запроса к модели (включая повторы SDK после 429/5xx)
+_http_attempts = contextvars.ContextVar("http_attempts", default=None)
+
+_lock = threading.Lock()
+_calls = deque(maxlen=settings.TELEMETRY_HISTORY)
+_spans = deque(maxlen=settings.TELEMETRY_HISTORY)
+_metrics = None
+_metrics_ready = False
+_tracer = None
+_tracer_ready = False
+
+@dataclass
+class CallRecord:
+    """Запись об одном вызове модели."""
+    timestamp: float
+    stage: str
+    model_id: str
+    requested_model_id: str
+    status: str                # ok | error
+    latency: float
+    ttft: float = None         # Время до первого токена (для потоковых ответов)
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0     # Входные токены, прочитанные из кеша провайдера
+    retries: int = 0           # Повторные HTTP-попытки SDK
+    failovers: int = 0         # Переключения на резервные модели
+    cache_hit: bool = False    # Ответ получен без отдельного вызова провайдера
+    cost: float = 0.0
+    tender_id: str = None
+    error: str = None
+
+def track_http_attempts() -> list:
+    """
+    Начинает подсчет HTTP-попыток для текущего запроса (в текущем контексте asyncio-задачи).
+
+    Returns:
+        list: Счетчик [число попыток], обновляемый хуком count_http_attempt.
+    """
+    counter = [0]
+    _http_attempts.set(counter)
+    return counter
+
+async def count_http_attempt(request):
+    """Хук HTTP-клиента SDK: вызывается перед каждой попыткой отправки запроса."""
+    counter = _http_attempts.get()
+    if counter is not None:
+        counter[0] += 1
+
+def _get_metrics():
+    """Создает метрики Prometheus и запускает эндпоинт при первом обращении (если пакет установлен)."""
+    global _metrics, _metrics_ready
+    if _metrics_ready:
+        return _metrics
+    with _lock:
+        if _metrics_ready:
+            return _metrics
+        try:
+            import prometheus_client as prom
+        except ImportError:
+            prom = None
+        if prom is not None:
+            labels = ("stage", "model")
+            _metrics = {
+                "calls": prom.Counter("llm_calls_total", "Вызовы AI моделей", labels + ("status",)),
+                "latency": prom.Histogram("llm_request_duration_seconds", "Задержка вызова модели", labels,
+                                          buckets=settings.TELEMETRY_LATENCY_BUCKETS),
+                "ttft": prom.Histogram("llm_time_to_first_token_seconds", "Время до первого токена", labels,
+                                       buckets=settings.TELEMETRY_LATENCY_BUCKETS),
+                "tokens": prom.Counter("llm_tokens_total", "Токены вызовов моделей", labels + ("kind",)),
+                "cost": prom.Counter("llm_cost_usd_total", "Стоимость вызовов моделей, USD", labels),
+                "retries": prom.Counter("llm_retries_total", "Повторные HTTP-попытки SDK", labels),
+                "failovers": prom.Counter("llm_failovers_total", "Переключения на резервные модели", labels),
+                "cache_hits": prom.Counter("llm_cache_hits_total", "Ответы без отдельного вызова провайдера", labels),
+                "spans": prom.Histogram("pipeline_span_duration_seconds", "Длительность этапов конвейера", ("span",),
+                                        buckets=settings.TELEMETRY_LATENCY_BUCKETS),
+            }
+            if settings.PROMETHEUS_PORT:
+                try:
+                    prom.start_http_server(settings.PROMETHEUS_PORT)
+                except OSError as e:
+                    # Порт уже занят (например, другим воркером) - метрики собираются, но не публикуются
+                    print(f"Не удалось запустить эндпоинт Prometheus на порту {settings.PROMETHEUS_PORT}: {e}")
+        _metrics_ready = True
+    return _metrics
+
+def _get_tracer():
+    """Возвращает трассировщик OpenTelemetry или None, если пакет не установлен."""
+    global _tracer, _tracer_ready
+    if not _tracer_ready:
+        try:
+            from opentelemetry import trace
+            _tracer = trace.get_tracer(settings.OTEL_SERVICE_NAME)
+        except ImportError:
+            _tracer = None
+        _tracer_ready = True
+    return _tracer
+
+def record_call(record: CallRecord):
+    """Сохраняет запись о вызове модели и обновляет метрики."""
+    with _lock:
+        _calls.append(record)
+    metrics = _get_metrics()
+    if metrics is None:
+        return
+    labels = {"stage": record.stage or "other", "model": record.model_id}
+    metrics["calls"].labels(status=record.status, **labels).inc()
+    if record.cache_hit:
+        metrics["cache_hits"].labels(**labels).inc()
+        return
+    metrics["latency"].labels(**labels).observe(record.latency)
+    if record.ttft is not None:
+        metrics["ttft"].labels(**labels).observe(record.ttft)
+    for kind in ("input", "output", "cached"):
+        value = getattr(record, f"{kind}_tokens")
+        if value:
+            metrics["tokens"].labels(kind=kind, **labels).inc(value)
+    if record.cost:
+        metrics["cost"].labels(**labels).inc(record.cost)
+    if record.retries:
+        metrics["retries"].labels(**labels).inc(record.retries)
+    if record.failovers:
+        metrics["failovers"].labels(**labels).inc(record.failovers)
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Отмечает этап конвейера (извлечение текста, этапы LLM, отрисовка): длительность попадает
+    в метрики и историю спанов, а при наличии OpenTelemetry создается вложенный спан.
+
+    Args:
+        name (str): Имя этапа, например "extraction" или "stage.summary".
+        **attributes: Атрибуты спана (имя файла, модель и т.п.).
+    """
+    tracer = _get_tracer()
+    started = time.monotonic()
+    status = "ok"
+    otel_span = tracer.start_as_current_span(name, attributes={k: str(v) for k, v in attributes.items()}) if tracer else None
+    try:
+        if otel_span is not None:
+            with otel_span:
+                yield
+        else:
+            yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        duration = time.monotonic() - started
+        with _lock:
+            _spans.append({"name": name, "duration": duration, "status": status, "timestamp": time.time(), **attributes})
+        metrics = _get_metrics()
+        if metrics is not None:
+            metrics["spans"].labels(span=name).observe(duration)
+
+def recent_calls(limit: int = None) -> list:
+    """Последние записи о вызовах моделей (словари), начиная с самых старых."""
+    with _lock:
+        calls = list(_calls)
+    return [asdict(call) for call in (calls[-limit:] if limit else calls)]
+
+def recent_spans(limit: int = None) -> list:
+    """Последние завершенные спаны этапов конвейера."""
+    with _lock:
+        spans = list(_spans)
+    return spans[-limit:] if limit else spans
+
+def _percentile(values: list, share: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+def summary() -> dict:
+    """
+    Сводка по сохраненным вызовам в разрезе этапов.
+
+    Returns:
+        dict: {stage: {"calls", "errors", "cache_hits", "p50", "p95", "ttft_p95", "tokens", "cost"}}
+    """
+    result = {}
+    for call in recent_calls():
+        stats = result.setdefault(call["stage"] or "other", {
+            "calls": 0, "errors": 0, "cache_hits": 0, "latencies": [], "ttfts": [], "tokens": 0, "cost": 0.0,
+        })
+        stats["calls"] += 1
+        stats["errors"] += call["status"] != "ok"
+        stats["cache_hits"] += call["cache_hit"]
+        if call["status"] == "ok" and not call["cache_hit"]:
+            stats["latencies"].append(call["latency"])
+            if call["ttft"] is not None:
+                stats["ttfts"].append(call["ttft"])
+        stats["tokens"] += call["input_tokens"] + call["output_tokens"]
+        stats["cost"] += call["cost"]
+    for stats in result.values():
+        latencies, ttfts = stats.pop("latencies"), stats.pop("ttfts")
+        stats["p50"] = _percentile(latencies, 0.5)
+        stats["p95"] = _percentile(latencies, 0.95)
+        stats["ttft_p95"] = _percentile(ttfts, 0.95)
+    return result
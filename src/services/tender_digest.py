@@ -0,0 +1,273 @@
+"""
+Дайджест дополнительных файлов тендера (протоколы встреч, письма, отчеты)
+
+Дополнительные файлы общие для всех КП тендера, поэтому разбираются один раз: каждый файл -
+отдельный параллельный запрос к модели этапа digest. Выжимка файла сохраняется по хешу его
+содержимого (settings.DIGEST_DIR), и при повторном анализе тендера файл не извлекается и не
+отправляется модели заново. Выводы о конкретных участниках группируются по названию компании,
+а анализ каждого КП получает только свой срез дайджеста (vendor_slice).
+"""
+
+import re
+import json
+import asyncio
+import hashlib
+import threading
+from pathlib import Path
+from pydantic import ValidationError
+import streamlit as st
+from src.config import settings
+from src.models import schemas
+from src.utils import file_utils
+from src.services import ai_service, token_budget
+
+_WORD_RE = re.compile(r"\w+")
+# Организационно-правовые формы и общие слова, не различающие компании
+_VENDOR_STOP_WORDS = {
+    "ооо", "оао", "зао", "пао", "ао", "ип", "нко", "гк", "группа", "компаний", "компания",
+    "llc", "ltd", "inc", "gmbh", "corp", "company", "kp", "кп",
+}
+
+SYSTEM_PROMPT = (
+    "Ты — эксперт по анализу тендерной документации. Тебе дается дополнительный документ тендера "
+    "(протокол встречи, переписка, отчет, отзыв). Выдели из него сведения, важные для оценки "
+    "коммерческих предложений участников. Верни результат ТОЛЬКО в виде валидного JSON-объекта:\n"
+    "- summary: Краткое (1-2 предложения) содержание документа.\n"
+    "- general_findings: Список строк с выводами, относящимися ко всем участникам: уточненные или новые "
+    "требования, изменения сроков, бюджета, условий тендера.\n"
+    "- vendor_findings: Список объектов {vendor, finding, impact} с выводами о конкретных компаниях: "
+    "vendor - название компании, как оно указано в документе; finding - вывод в одном предложении; "
+    "impact - целое число от -2 до 2, влияние на оценку компании (опыт, репутация, риски, договоренности).\n"
+    "Не придумывай сведений, которых нет в документе. Все текстовые значения должны быть на русском языке."
+)
+
+def file_hash(path: Path) -> str:
+    """SHA-256 содержимого файла."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def normalize_vendor(name: str) -> str:
+    """Название компании без регистра, кавычек и организационно-правовой формы."""
+    words = _WORD_RE.findall((name or "").lower().replace("ё", "е").replace("_", " "))
+    return " ".join(word for word in words if word not in _VENDOR_STOP_WORDS)
+
+def vendor_matches(vendor: str, names) -> bool:
+    """
+    Относится ли вывод о компании vendor к участнику с одним из названий names
+    (название из КП, имя файла КП). Совпадением считается вхождение одного названия
+    в другое по словам или пересечение не меньше половины слов.
+    """
+    normalized = normalize_vendor(vendor)
+    if not normalized:
+        return False
+    words = set(normalized.split())
+    for name in names:
+        candidate = normalize_vendor(name)
+        if not candidate:
+            continue
+        if f" {normalized} " in f" {candidate} " or f" {candidate} " in f" {normalized} ":
+            return True
+        candidate_words = set(candidate.split())
+        if len(words & candidate_words) / len(words | candidate_words) >= 0.5:
+            return True
+    return False
+
+def _vendor_findings(items) -> list:
+    """
+    Выводы об участниках в виде словарей {vendor, finding, impact}. Принимаются и словари, и модели
+    VendorFinding; элементы, которые не проходят проверку схемы, пропускаются.
+    """
+    findings = []
+    for item in items or []:
+        if hasattr(item, "model_dump"):
+            item = item.model_dump()
+        try:
+            findings.append(schemas.VendorFinding.model_validate(item).model_dump())
+        except ValidationError:
+            print(f"Пропущен некорректный вывод об участнике: {item!r}")
+    return findings
+
+class DigestStore:
+    """
+    Выжимки дополнительных файлов: ключ - хеш модели, инструкции и содержимого файла.
+    Хранятся в памяти процесса и в файлах settings.DIGEST_DIR (переживают перезапуск).
+    """
+
+    def __init__(self, store_dir: Path):
+        self.store_dir = Path(store_dir)
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_id: str, content_hash: str) -> str:
+        payload = json.dumps([model_id, SYSTEM_PROMPT, content_hash], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Возвращает сохраненную выжимку файла или None."""
+        with self._lock:
+            if key in self._memory:
+                return dict(self._memory[key])
+        path = self.store_dir / f"{key}.json"
+        if not path.exists():
+            return None
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._memory[key] = data
+        return dict(data)
+
+    def set(self, key: str, data: dict):
+        """Сохраняет выжимку файла (запись через временный файл)."""
+        with self._lock:
+            self._memory[key] = dict(data)
+        try:
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.store_dir / f"{key}.tmp"
+            tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            tmp_path.replace(self.store_dir / f"{key}.json")
+        except OSError as e:
+            print(f"Не удалось сохранить выжимку дополнительного файла: {e}")
+
+# Общее для процесса хранилище выжимок файлов
+store = DigestStore(settings.DIGEST_DIR)
+
+def build_digest(documents: list) -> dict:
+    """
+    Составляет дайджест дополнительных документов тендера.
+
+    Документы без сохраненной выжимки извлекаются и отправляются модели этапа digest
+    параллельно в общем event loop ai_service. Вызывается в потоке сессии Streamlit.
+
+    Args:
+        documents (list): Документы {"name", "hash", "path"} или {"name", "hash", "text"}.
+
+    Returns:
+        dict: {"files": [{"name", "summary", "model", "cached"}],
+               "general_findings": [{"finding", "source"}],
+               "vendors": {нормализованное название: {"vendor", "findings": [{"finding", "impact", "source"}]}}}
+    """
+    # Настройки этапа определяем в потоке сессии, где доступен session_state
+    config = ai_service.get_stage_config("digest")
+    keys = [store.make_key(config["model"], document["hash"]) for document in documents]
+    cached = {i: store.get(key) for i, key in enumerate(keys)}
+    pending = [i for i, data in cached.items() if data is None]
+
+    async def _summarize(document: dict):
+        text = document.get("text")
+        if text is None:
+            # Извлечение текста (PDF, DOCX) не блокирует event loop и идет параллельно с запросами
+            text = await asyncio.to_thread(file_utils.extract_text_from_file, document["path"])
+        if not text or not text.strip():
+            raise ValueError("не удалось извлечь текст")
+        text, _ = token_budget.truncate_for_stage(text, "digest", config["model"])
+        prompt = f"=== Документ: {document['name']} ===\n{text}\n\nВерни ТОЛЬКО JSON-объект."
+        return await ai_service.get_structured_response_async(
+            prompt, SYSTEM_PROMPT, schemas.AdditionalFileDigest, config["model"], "digest",
+            max_tokens=config["max_tokens"], latency_slo=config["latency_slo_sec"]
+        )
+
+    async def _summarize_pending():
+        return await asyncio.gather(*[_summarize(documents[i]) for i in pending], return_exceptions=True)
+
+    responses = dict(zip(pending, ai_service.run_sync(_summarize_pending()))) if pending else {}
+
+    digest = {"files": [], "general_findings": [], "vendors": {}}
+    seen_general, failed = set(), []
+    for i, document in enumerate(documents):
+        data = cached[i]
+        if data is None:
+            response = responses[i]
+            if isinstance(response, Exception):
+                print(f"Ошибка при разборе дополнительного файла {document['name']}: {response}")
+                failed.append(document["name"])
+                continue
+            fields, missing, completion = response
+            data = {
+                "summary": fields.get("summary", ""),
+                "general_findings": fields.get("general_findings", []),
+                "vendor_findings": fields.get("vendor_findings", []),
+                "model": completion.model_id,
+            }
+            if not missing and completion.model_id == config["model"]:
+                # Сохраняются только полные ответы запрошенной модели
+                store.set(keys[i], data)
+        digest["files"].append({
+            "name": document["name"], "summary": data.get("summary") or "", "model": data["model"], "cached": cached[i] is not None,
+        })
+        for finding in data.get("general_findings") or []:
+            if not isinstance(finding, str) or not finding.strip():
+                continue
+            if finding.strip().lower() not in seen_general:
+                seen_general.add(finding.strip().lower())
+                digest["general_findings"].append({"finding": finding.strip(), "source": document["name"]})
+        for item in _vendor_findings(data.get("vendor_findings")):
+            vendor_key = normalize_vendor(item["vendor"])
+            if not vendor_key:
+                continue
+            vendor = digest["vendors"].setdefault(vendor_key, {"vendor": item["vendor"], "findings": []})
+            vendor["findings"].append({"finding": item["finding"], "impact": item["impact"], "source": document["name"]})
+
+    if failed:
+        st.warning(f"Не удалось разобрать дополнительные файлы: {', '.join(failed)}")
+    return digest
+
+def build_tender_digest(additional_files: list) -> dict:
+    """
+    Дайджест загруженных дополнительных файлов тендера (записи uploaded_files["additional"]).
+    Файлы, выжимка которых уже есть в хранилище, не читаются заново - достаточно хеша содержимого.
+    """
+    documents = []
+    for additional_file in additional_files:
+        path = Path(additional_file["file_path"])
+        try:
+            documents.append({"name": additional_file["original_name"], "hash": file_hash(path), "path": path})
+        except OSError as e:
+            print(f"Не удалось прочитать дополнительный файл {path}: {e}")
+            st.warning(f"Не удалось прочитать дополнительный файл: {additional_file['original_name']}")
+    return build_digest(documents)
+
+def vendor_slice(digest: dict, names) -> dict:
+    """
+    Срез дайджеста для одного КП: общие выводы тендера и выводы только об этом участнике.
+
+    Args:
+        digest (dict): Результат build_digest.
+        names: Названия участника (название компании из КП, имя файла КП).
+
+    Returns:
+        dict: {"key_findings", "impact", "rating_impact", "sources"} или None, если дайджест пуст.
+    """
+    if not digest or not digest["files"]:
+        return None
+    names = [name for name in names if name]
+    findings = [
+        finding
+        for vendor in digest["vendors"].values() if vendor_matches(vendor["vendor"], names)
+        for finding in vendor["findings"]
+    ]
+    total = sum(finding["impact"] for finding in findings)
+    rating_impact = float(max(-settings.DIGEST_MAX_RATING_IMPACT, min(settings.DIGEST_MAX_RATING_IMPACT, total)))
+
+    if not findings:
+        impact = "В дополнительных файлах нет сведений об участнике; учтены только общие выводы по тендеру."
+    else:
+        positive = sum(finding["impact"] > 0 for finding in findings)
+        negative = sum(finding["impact"] < 0 for finding in findings)
+        impact = (
+            f"Сведений об участнике в дополнительных файлах: {len(findings)} "
+            f"(положительных - {positive}, отрицательных - {negative}). "
+            f"Поправка рейтинга: {rating_impact:+.1f} балла."
+        )
+    return {
+        "key_findings": [f"{item['finding']} ({item['source']})" for item in findings]
+                        + [f"{item['finding']} ({item['source']})" for item in digest["general_findings"]],
+        "impact": impact,
+        "rating_impact": rating_impact,
+        "sources": [item["name"] for item in digest["files"]],
+    }
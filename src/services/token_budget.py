@@ -0,0 +1,206 @@
+"""
+Учет токенов: оценка размера запроса до отправки, обрезка под бюджет этапа
+и накопление фактического расхода токенов, стоимости и задержки по тендерам
+"""
+
+import re
+import threading
+import contextvars
+from contextlib import contextmanager
+from src.config import settings
+from src.services import model_router
+
+_CYRILLIC_RE = re.compile(r"[Ѐ-ӿ]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Тендер, к которому относятся текущие запросы (переносится в общий event loop вместе с контекстом)
+current_tender = contextvars.ContextVar("current_tender", default=None)
+
+_ledger_lock = threading.Lock()
+_ledger = {}
+_encoders = {}
+
+@contextmanager
+def tender_scope(tender_id: str):
+    """Относит все запросы к моделям внутри блока with к указанному тендеру."""
+    token = current_tender.set(tender_id)
+    try:
+        yield
+    finally:
+        current_tender.reset(token)
+
+def _get_encoder(model_id: str):
+    """Возвращает токенизатор tiktoken для моделей OpenAI, если пакет установлен, иначе None."""
+    if model_router.detect_provider(model_id) != "openai":
+        return None
+    if model_id not in _encoders:
+        try:
+            import tiktoken
+            try:
+                _encoders[model_id] = tiktoken.encoding_for_model(model_id)
+            except KeyError:
+                _encoders[model_id] = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoders[model_id] = None
+    return _encoders[model_id]
+
+def estimate_tokens(text: str, model_id: str = None) -> int:
+    """
+    Оценивает количество токенов текста для модели.
+
+    Для моделей OpenAI при установленном tiktoken считается точно. Иначе используется
+    эвристика: кириллица кодируется заметно плотнее латиницы (меньше символов на токен),
+    поэтому символы каждого алфавита считаются по своему коэффициенту из settings.CHARS_PER_TOKEN.
+
+    Args:
+        text (str): Текст запроса.
+        model_id (str, optional): ID модели.
+
+    Returns:
+        int: Оценка числа токенов.
+    """
+    if not text:
+        return 0
+    encoder = _get_encoder(model_id) if model_id else None
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    cyrillic = len(_CYRILLIC_RE.findall(text))
+    other = len(_WHITESPACE_RE.sub(" ", text)) - cyrillic
+    return int(cyrillic / settings.CHARS_PER_TOKEN["cyrillic"] + other / settings.CHARS_PER_TOKEN["other"]) + 1
+
+def get_stage_budget(stage: str) -> dict:
+    """
+    Возвращает бюджет токенов этапа: {"input": ..., "output": ...}.
+    Входной бюджет берется из settings.STAGE_TOKEN_BUDGETS, лимит ответа - из settings.STAGE_MODELS.
+    """
+    budget = settings.STAGE_TOKEN_BUDGETS.get(stage, settings.STAGE_TOKEN_BUDGETS["default"])
+    stage_model = settings.STAGE_MODELS.get(stage, settings.STAGE_MODELS["default"])
+    return {"input": budget["input"], "output": stage_model["max_tokens"]}
+
+def truncate_to_tokens(text: str, max_tokens: int, model_id: str = None):
+    """
+    Обрезает текст так, чтобы его оценка не превышала max_tokens.
+
+    Returns:
+        tuple: (обрезанный текст, True если текст был обрезан)
+    """
+    if estimate_tokens(text, model_id) <= max_tokens:
+        return text, False
+    # Бинарный поиск по длине: оценка монотонна по префиксу
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle], model_id) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low], True
+
+def truncate_for_stage(text: str, stage: str, model_id: str = None, share: float = 1.0):
+    """
+    Обрезает документ под входной бюджет этапа.
+
+    Args:
+        text (str): Текст документа.
+        stage (str): Этап анализа из settings.STAGE_TOKEN_BUDGETS.
+        model_id (str, optional): ID модели для точной оценки.
+        share (float): Доля бюджета для этого документа (например, 0.5 для ТЗ и КП в одном запросе).
+
+    Returns:
+        tuple: (текст, True если текст был обрезан)
+    """
+    return truncate_to_tokens(text, int(get_stage_budget(stage)["input"] * share), model_id)
+
+def calculate_cost(model_id: str, input_tokens: int, output_tokens: int, cost_factor: float = 1.0) -> float:
+    """
+    Стоимость запроса в долларах по тарифам settings.MODEL_PRICING (цена за 1 млн токенов).
+    cost_factor - множитель тарифа (например, скидка пакетного режима settings.BATCH_COST_FACTOR).
+    """
+    input_price, output_price = settings.MODEL_PRICING.get(model_id, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) * cost_factor / 1_000_000
+
+def record_usage(model_id: str, stage: str, input_tokens: int, output_tokens: int, latency: float,
+                 tender_id: str = None, cost_factor: float = 1.0, latency_slo: float = None):
+    """
+    Учитывает фактический расход токенов и задержку запроса в итогах тендера.
+    Если tender_id не указан, берется тендер из текущего контекста (tender_scope).
+    latency_slo - целевая задержка этапа: ответы медленнее нее считаются нарушениями SLO.
+    """
+    tender_id = tender_id or current_tender.get()
+    if tender_id is None:
+        return
+    cost = calculate_cost(model_id, input_tokens, output_tokens, cost_factor)
+    with _ledger_lock:
+        totals = _ledger.setdefault(tender_id, _empty_totals())
+        stage_totals = totals["by_stage"].setdefault(stage or "other", _empty_totals(with_stages=False))
+        for bucket in (totals, stage_totals):
+            bucket["calls"] += 1
+            bucket["input_tokens"] += input_tokens
+            bucket["output_tokens"] += output_tokens
+            bucket["cost"] += cost
+            bucket["latency"] += latency
+            bucket["max_latency"] = max(bucket["max_latency"], latency)
+            bucket["slo_violations"] += latency_slo is not None and latency > latency_slo
+        stage_totals["models"][model_id] = stage_totals["models"].get(model_id, 0) + 1
+        if latency_slo is not None:
+            stage_totals["latency_slo"] = latency_slo
+
+def _empty_totals(with_stages: bool = True) -> dict:
+    totals = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0, "latency": 0.0,
+              "max_latency": 0.0, "slo_violations": 0}
+    if with_stages:
+        totals["by_stage"] = {}
+    else:
+        totals["models"] = {}
+        totals["latency_slo"] = None
+    return totals
+
+def get_tender_totals(tender_id: str) -> dict:
+    """
+    Возвращает накопленные итоги по тендеру.
+
+    Returns:
+        dict: calls, input_tokens, output_tokens, cost (USD), latency (сумма секунд), max_latency,
+        slo_violations и by_stage с теми же полями, числом ответов каждой модели (models) и SLO этапа (latency_slo).
+    """
+    with _ledger_lock:
+        totals = _ledger.get(tender_id, _empty_totals())
+        return {**totals, "by_stage": {
+            stage: {**values, "models": dict(values["models"])} for stage, values in totals["by_stage"].items()
+        }}
+
+def stage_report(totals: dict, baseline_model_id: str = None) -> list:
+    """
+    Отчет о задержке и стоимости по этапам для итогов тендера (get_tender_totals).
+
+    Args:
+        totals (dict): Итоги тендера.
+        baseline_model_id (str, optional): Модель для сравнения: сколько стоил бы тот же расход
+            токенов, если бы все этапы выполняла она.
+
+    Returns:
+        list: Словари с ключами stage, models, calls, avg_latency, max_latency, latency_slo,
+        slo_violations, tokens, cost и baseline_cost (если указана baseline_model_id).
+    """
+    report = []
+    for stage, values in totals.get("by_stage", {}).items():
+        row = {
+            "stage": stage,
+            "models": dict(values["models"]),
+            "calls": values["calls"],
+            "avg_latency": values["latency"] / values["calls"] if values["calls"] else 0.0,
+            "max_latency": values["max_latency"],
+            "latency_slo": values["latency_slo"],
+            "slo_violations": values["slo_violations"],
+            "tokens": values["input_tokens"] + values["output_tokens"],
+            "cost": values["cost"],
+        }
+        if baseline_model_id:
+            row["baseline_cost"] = calculate_cost(baseline_model_id, values["input_tokens"], values["output_tokens"])
+        report.append(row)
+    return report
+
+def reset_tender(tender_id: str):
+    """Сбрасывает итоги тендера (например, перед повторным анализом)."""
+    with _ledger_lock:
+        _ledger.pop(tender_id, None)
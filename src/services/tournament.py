@@ -0,0 +1,292 @@
+"""
+Турнирный рейтинг КП: попарные сравнения моделью
+
+Просить модель упорядочить все КП одним запросом долго и ненадежно: с ростом числа КП модель
+теряет часть из них и путает порядок. В турнирном режиме лучшие КП по общей оценке (шорт-лист,
+settings.TOURNAMENT_SHORTLIST_K) упорядочиваются сортировкой слиянием, где каждое сравнение -
+короткий запрос «какое из двух КП сильнее» (этап pairwise), а половины сортируются параллельно.
+Вердикт пары хранится по хешам данных обоих КП и модели, поэтому повторный турнир по тем же КП
+не обращается к модели. Итоговые порядки тоже сохраняются: КП, добавленное к уже упорядоченному
+набору, вставляется двоичным поиском за O(log n) новых сравнений.
+"""
+
+import json
+import math
+import asyncio
+import hashlib
+import threading
+from pathlib import Path
+from src.config import settings
+from src.models import schemas
+from src.services import ai_service, scoring, token_budget
+
+PAIR_SYSTEM_PROMPT = (
+    "Ты - аналитик тендерных процессов. Тебе даны данные двух коммерческих предложений (КП) одного тендера. "
+    "Определи, какое КП сильнее для заказчика в целом: полнота покрытия требований ТЗ, технологический подход, "
+    "стоимость, реалистичность сроков и риски. Не отдавай предпочтение КП из-за его порядкового номера. "
+    "Ответь JSON-объектом с полями winner (1 или 2 - номер более сильного КП) и reason (1-2 предложения)."
+)
+
+def kp_block(result: dict) -> str:
+    """Данные КП для попарного сравнения (Markdown)."""
+    comparison = result.get("comparison_result") or {}
+    recommendation = result.get("preliminary_recommendation") or {}
+    lines = [
+        f"Компания: {result.get('company_name', result.get('kp_name'))}",
+        f"* Соответствие ТЗ: {comparison.get('compliance_score', 0)}%",
+        f"* Технологический стек: {result.get('tech_stack', 'Не указано')}",
+        f"* Стоимость: {result.get('pricing', 'Не указано')}",
+        f"* Сроки реализации: {result.get('timeline', 'Не указано')}",
+    ]
+    for title, items in (
+        ("Пропущенные требования", comparison.get("missing_requirements")),
+        ("Дополнительные функции", comparison.get("additional_features")),
+        ("Сильные стороны", recommendation.get("strength")),
+        ("Слабые стороны", recommendation.get("weakness")),
+    ):
+        lines.append(f"* {title}:")
+        lines.extend(f"  - {item}" for item in items or ["нет"])
+    return "\n".join(lines) + "\n"
+
+def kp_hash(block: str) -> str:
+    """Хеш данных КП, по которым модель выносит вердикт."""
+    return hashlib.sha256(block.encode("utf-8")).hexdigest()
+
+class TournamentStore:
+    """
+    Вердикты пар и последние итоговые порядки турниров. Хранятся в памяти процесса
+    и в файлах settings.TOURNAMENT_DIR (переживают перезапуск).
+    """
+
+    def __init__(self, store_dir: Path):
+        self.store_dir = Path(store_dir)
+        self._verdicts = {}
+        self._orders = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def pair_key(model_id: str, first: str, second: str) -> str:
+        """Ключ пары: не зависит от порядка КП."""
+        payload = json.dumps([model_id, PAIR_SYSTEM_PROMPT, sorted([first, second])], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_verdict(self, key: str):
+        """Сохраненный вердикт пары ({"winner": хеш КП, "reason": ...}) или None."""
+        with self._lock:
+            if key in self._verdicts:
+                return self._verdicts[key]
+        path = self.store_dir / "pairs" / f"{key}.json"
+        if not path.exists():
+            return None
+        try:
+            verdict = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._verdicts[key] = verdict
+        return verdict
+
+    def set_verdict(self, key: str, verdict: dict):
+        """Сохраняет вердикт пары (запись через временный файл)."""
+        with self._lock:
+            self._verdicts[key] = verdict
+        try:
+            pairs_dir = self.store_dir / "pairs"
+            pairs_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = pairs_dir / f"{key}.tmp"
+            tmp_path.write_text(json.dumps(verdict, ensure_ascii=False), encoding="utf-8")
+            tmp_path.replace(pairs_dir / f"{key}.json")
+        except OSError as e:
+            print(f"Не удалось сохранить вердикт попарного сравнения: {e}")
+
+    def _load_orders(self) -> dict:
+        if self._orders is None:
+            path = self.store_dir / "orders.json"
+            try:
+                self._orders = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+            except (OSError, ValueError):
+                self._orders = {}
+        return self._orders
+
+    def orders(self, model_id: str) -> list:
+        """Сохраненные порядки турниров модели (хеши КП от лучшего к худшему), новые в конце."""
+        with self._lock:
+            return [list(order) for order in self._load_orders().get(model_id, [])]
+
+    def add_order(self, model_id: str, order: list):
+        """Сохраняет итоговый порядок турнира (хранятся settings.TOURNAMENT_MAX_ORDERS последних)."""
+        with self._lock:
+            orders = self._load_orders()
+            history = [saved for saved in orders.get(model_id, []) if saved != order] + [list(order)]
+            orders[model_id] = history[-settings.TOURNAMENT_MAX_ORDERS:]
+            data = json.dumps(orders, ensure_ascii=False)
+        try:
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.store_dir / "orders.tmp"
+            tmp_path.write_text(data, encoding="utf-8")
+            tmp_path.replace(self.store_dir / "orders.json")
+        except OSError as e:
+            print(f"Не удалось сохранить порядок турнира: {e}")
+
+# Общее для процесса хранилище вердиктов и порядков
+store = TournamentStore(settings.TOURNAMENT_DIR)
+
+def _insertion_cost(base_size: int, new_count: int) -> int:
+    """Сравнений на вставку new_count КП двоичным поиском (худший случай)."""
+    return sum(math.ceil(math.log2(base_size + i + 1)) for i in range(new_count))
+
+def _merge_cost(base_size: int, new_count: int) -> int:
+    """Сравнений на сортировку новых КП слиянием и слияние с упорядоченными (худший случай)."""
+    sort_cost = new_count * math.ceil(math.log2(new_count)) if new_count > 1 else 0
+    return sort_cost + base_size + new_count - 1
+
+class _Tournament:
+    """Сравнения одного турнира: вердикты из хранилища или запросы к модели этапа pairwise."""
+
+    def __init__(self, blocks: dict, scores: dict, verdicts: dict, config: dict):
+        self.blocks = blocks
+        self.scores = scores
+        self.verdicts = verdicts
+        self.config = config
+        self.new_verdicts = {}
+        self.stats = {"comparisons": 0, "cached": 0, "requests": 0, "failed": 0}
+
+    async def beats(self, candidate: str, other: str) -> bool:
+        """Сильнее ли КП candidate, чем other."""
+        self.stats["comparisons"] += 1
+        first, second = sorted((candidate, other))
+        key = store.pair_key(self.config["model"], first, second)
+        verdict = self.verdicts.get(key)
+        if verdict is None:
+            verdict = await self._ask(first, second)
+            if verdict["reason"] is not None:
+                self.verdicts[key] = self.new_verdicts[key] = verdict
+        else:
+            self.stats["cached"] += 1
+        return verdict["winner"] == candidate
+
+    async def _ask(self, first: str, second: str) -> dict:
+        # КП всегда передаются в порядке хешей, чтобы вердикт пары не зависел от порядка сравнения
+        prompt = f"# КП 1\n\n{self.blocks[first]}\n# КП 2\n\n{self.blocks[second]}"
+        try:
+            data, missing, _ = await ai_service.get_structured_response_async(
+                prompt, PAIR_SYSTEM_PROMPT, schemas.PairwiseVerdict, self.config["model"], "pairwise",
+                max_tokens=self.config["max_tokens"], latency_slo=self.config["latency_slo_sec"]
+            )
+        except Exception as e:
+            print(f"Ошибка попарного сравнения КП: {e}")
+            data, missing = None, ["winner"]
+        if data is None or "winner" in missing:
+            # Без вердикта модели пара решается общей оценкой и не сохраняется
+            self.stats["failed"] += 1
+            winner = first if self.scores[first] >= self.scores[second] else second
+            return {"winner": winner, "reason": None}
+        self.stats["requests"] += 1
+        return {"winner": first if data["winner"] == 1 else second, "reason": data.get("reason", "")}
+
+    async def merge_sort(self, items: list) -> list:
+        if len(items) <= 1:
+            return list(items)
+        middle = len(items) // 2
+        left, right = await asyncio.gather(self.merge_sort(items[:middle]), self.merge_sort(items[middle:]))
+        return await self.merge(left, right)
+
+    async def merge(self, left: list, right: list) -> list:
+        merged, i, j = [], 0, 0
+        while i < len(left) and j < len(right):
+            if await self.beats(right[j], left[i]):
+                merged.append(right[j])
+                j += 1
+            else:
+                merged.append(left[i])
+                i += 1
+        return merged + left[i:] + right[j:]
+
+    async def insert(self, order: list, item: str):
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if await self.beats(item, order[middle]):
+                high = middle
+            else:
+                low = middle + 1
+        order.insert(low, item)
+
+    async def rank(self, hashes: list, base: list) -> list:
+        """
+        Порядок КП от лучшего к худшему. Если часть КП уже упорядочена прежним турниром (base),
+        остальные вставляются двоичным поиском или сортируются и сливаются с base - что дешевле.
+        """
+        new = [item for item in hashes if item not in base]
+        if len(base) < 2:
+            return await self.merge_sort(hashes)
+        if _insertion_cost(len(base), len(new)) <= _merge_cost(len(base), len(new)):
+            order = list(base)
+            for item in new:
+                await self.insert(order, item)
+            return order
+        return await self.merge(list(base), await self.merge_sort(new))
+
+def _best_base(model_id: str, hashes: list) -> list:
+    """Сохраненный порядок с наибольшим числом КП текущего шорт-листа (без выбывших КП)."""
+    current = set(hashes)
+    best = []
+    for order in store.orders(model_id):
+        kept = [item for item in order if item in current]
+        if len(kept) >= len(best):
+            best = kept
+    return best
+
+def rank_shortlist(results: list) -> dict:
+    """
+    Турнирный рейтинг лучших КП по общей оценке.
+
+    Args:
+        results (list): Результаты анализа КП (st.session_state.all_analysis_results).
+
+    Returns:
+        dict: order - индексы results от лучшего к худшему (только шорт-лист),
+        reasons - обоснование, почему КП выше следующего (None, если пара не сравнивалась моделью),
+        stats - comparisons (всего сравнений), cached (из сохраненных вердиктов),
+        requests (новых запросов к модели), failed (пары, решенные общей оценкой).
+    """
+    overall = scoring.score_results(results)["overall"].tolist()
+    shortlist = sorted(range(len(results)), key=lambda i: overall[i], reverse=True)[:settings.TOURNAMENT_SHORTLIST_K]
+
+    config = ai_service.get_stage_config("pairwise")
+    budget = token_budget.get_stage_budget("pairwise")["input"] // 2
+    blocks, scores, members = {}, {}, {}
+    for i in shortlist:
+        block, _ = token_budget.truncate_to_tokens(kp_block(results[i]), budget, config["model"])
+        item = kp_hash(block)
+        blocks[item] = block
+        scores[item] = max(scores.get(item, 0), overall[i])
+        # Одинаковые КП (тот же хеш) занимают соседние места без сравнения между собой
+        members.setdefault(item, []).append(i)
+    hashes = list(members)
+
+    # Вердикты читаются из хранилища до запуска турнира, чтобы не обращаться к диску из event loop
+    verdicts = {}
+    for position, first in enumerate(hashes):
+        for second in hashes[position + 1:]:
+            key = store.pair_key(config["model"], first, second)
+            verdict = store.get_verdict(key)
+            if verdict is not None:
+                verdicts[key] = verdict
+
+    tournament = _Tournament(blocks, scores, verdicts, config)
+    order = ai_service.run_sync(tournament.rank(hashes, _best_base(config["model"], hashes)))
+    for key, verdict in tournament.new_verdicts.items():
+        store.set_verdict(key, verdict)
+    if not tournament.stats["failed"]:
+        store.add_order(config["model"], order)
+
+    indices, reasons = [], []
+    for position, item in enumerate(order):
+        following = order[position + 1] if position + 1 < len(order) else None
+        verdict = tournament.verdicts.get(store.pair_key(config["model"], item, following)) if following else None
+        for i in members[item]:
+            indices.append(i)
+            reasons.append(None)
+        reasons[-1] = verdict["reason"] if verdict and verdict["winner"] == item else None
+    return {"order": indices, "reasons": reasons, "stats": tournament.stats}
@@ -0,0 +1,52 @@
+"""
+Кеш построенных графиков по хешу входных данных
+
+Построение фигуры Plotly для десятков КП занимает заметное время, а Streamlit перезапускает
+страницу при каждом действии пользователя. Построители графиков, обернутые memoize_figure,
+строят фигуру один раз для одинаковых данных; кеш общий для процесса и ограничен
+settings.FIGURE_CACHE_SIZE записями (давно не использованные вытесняются первыми).
+"""
+
+import json
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+from src.config import settings
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+def data_key(*args, **kwargs) -> str:
+    """Хеш входных данных построителя (списки, словари, строки и числа)."""
+    payload = json.dumps([args, kwargs], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def memoize_figure(builder):
+    """
+    Декоратор построителя графика: повторный вызов с теми же данными возвращает готовую фигуру.
+    Фигура общая для всех вызовов - ее можно отображать и экспортировать, но не изменять.
+    """
+    @wraps(builder)
+    def wrapper(*args, **kwargs):
+        key = (builder.__qualname__, data_key(*args, **kwargs))
+        with _lock:
+            figure = _cache.get(key)
+            if figure is not None:
+                _cache.move_to_end(key)
+                _stats["hits"] += 1
+                return figure
+            _stats["misses"] += 1
+        figure = builder(*args, **kwargs)
+        with _lock:
+            _cache[key] = figure
+            while len(_cache) > settings.FIGURE_CACHE_SIZE:
+                _cache.popitem(last=False)
+        return figure
+    return wrapper
+
+def stats() -> dict:
+    """Попадания и промахи кеша графиков и число сохраненных фигур."""
+    with _lock:
+        return {**_stats, "size": len(_cache)}
@@ -0,0 +1,137 @@
+"""
+Автономный HTML-отчет с графиками Plotly
+
+Отчет открывается без доступа в интернет: plotly.js (из установленного пакета plotly) встраивается
+в документ один раз, каждый график хранится компактным JSON (общий шаблон оформления Plotly тоже
+один на документ) и отрисовывается общим скриптом. Для печати графики можно дополнительно
+сохранить статическими SVG (settings.HTML_REPORT_STATIC_SVG, нужен пакет kaleido).
+"""
+
+import re
+import json
+import html
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from src.config import settings
+
+# Плейсхолдеры графиков в тексте отчета: [VISUALIZATION: Название] или [VISUALIZATION]
+PLACEHOLDER_RE = re.compile(r"\[VISUALIZATION(?::\s*([^\]]*))?\]")
+
+_FIGURE_CSS = """
+<style>
+    .plotly-figure { margin: 16px 0; }
+    .plotly-figure .static-figure { display: none; }
+    @media print {
+        .plotly-figure .static-figure { display: block; }
+        .plotly-figure.has-static .plotly-target { display: none; }
+    }
+</style>
+"""
+
+# Отрисовка всех графиков документа: JSON графика лежит рядом с контейнером, шаблон оформления - один общий
+_BOOTSTRAP_JS = """
+<script>
+(function () {
+    var shared = JSON.parse(document.getElementById("plotly-shared-template").textContent);
+    document.querySelectorAll(".plotly-figure").forEach(function (container) {
+        var spec = JSON.parse(container.querySelector("script[type='application/json']").textContent);
+        var layout = spec.layout || {};
+        if (!layout.template) { layout.template = shared; }
+        Plotly.newPlot(container.querySelector(".plotly-target"), spec.data || [], layout,
+                       {displayModeBar: false, responsive: true});
+    });
+})();
+</script>
+"""
+
+@lru_cache(maxsize=1)
+def plotly_js() -> str:
+    """Исходный код plotly.js из установленного пакета plotly (без обращения к CDN)."""
+    from plotly.offline import get_plotlyjs
+    return get_plotlyjs()
+
+@lru_cache(maxsize=1)
+def _default_template() -> dict:
+    import plotly.io as pio
+    return pio.templates[pio.templates.default].to_plotly_json()
+
+def _script_json(data) -> str:
+    """JSON для вставки в <script>: последовательность "</" экранируется, чтобы не закрыть тег."""
+    from plotly.io.json import to_json_plotly
+    return to_json_plotly(data).replace("</", "<\\/")
+
+def figure_json(fig) -> str:
+    """Компактный JSON графика без общего шаблона оформления (он встраивается в документ один раз)."""
+    spec = fig.to_plotly_json()
+    layout = dict(spec.get("layout", {}))
+    if layout.get("template") == _default_template():
+        del layout["template"]
+    return _script_json({"data": spec.get("data", []), "layout": layout})
+
+def static_svg(fig):
+    """SVG графика для печати или None, если kaleido не установлен или не смог отрисовать график."""
+    try:
+        return fig.to_image(format="svg").decode("utf-8")
+    except Exception as e:
+        print(f"Не удалось подготовить статическую версию графика: {e}")
+        return None
+
+def figure_block(fig, title: str = None, include_static: bool = None) -> str:
+    """
+    HTML-фрагмент графика для build_document: контейнер, JSON графика и при необходимости SVG.
+
+    Args:
+        fig: Фигура Plotly.
+        title (str, optional): Заголовок над графиком.
+        include_static (bool, optional): Добавить SVG для печати. По умолчанию settings.HTML_REPORT_STATIC_SVG.
+    """
+    include_static = settings.HTML_REPORT_STATIC_SVG if include_static is None else include_static
+    svg = static_svg(fig) if include_static else None
+    title_html = f'<h4 class="visualization-title">{html.escape(title)}</h4>' if title else ""
+    static_html = f'<div class="static-figure">{svg}</div>' if svg else ""
+    return (
+        f'<div class="visualization-container">{title_html}'
+        f'<div class="plotly-figure{" has-static" if svg else ""}"><div class="plotly-target"></div>'
+        f'<script type="application/json">{figure_json(fig)}</script>{static_html}</div></div>'
+    )
+
+def resolve_placeholders(report_html: str, render_placeholder, max_workers: int = None) -> str:
+    """
+    Заменяет плейсхолдеры [VISUALIZATION: Название] фрагментами графиков.
+    Каждое уникальное название строится один раз; названия обрабатываются параллельно.
+
+    Args:
+        report_html (str): HTML отчета с плейсхолдерами.
+        render_placeholder: Функция (название или "") -> HTML-фрагмент.
+        max_workers (int, optional): Число потоков. По умолчанию settings.HTML_REPORT_WORKERS.
+
+    Returns:
+        str: HTML отчета с графиками.
+    """
+    names = list(dict.fromkeys((match.group(1) or "").strip() for match in PLACEHOLDER_RE.finditer(report_html)))
+    if not names:
+        return report_html
+    with ThreadPoolExecutor(max_workers=min(len(names), max_workers or settings.HTML_REPORT_WORKERS)) as executor:
+        fragments = dict(zip(names, executor.map(render_placeholder, names)))
+    return PLACEHOLDER_RE.sub(lambda match: fragments[(match.group(1) or "").strip()], report_html)
+
+def build_document(body_html: str, title: str, css: str = "") -> str:
+    """
+    Полный HTML-документ отчета. plotly.js и общий шаблон оформления встраиваются один раз
+    и только если в отчете есть графики.
+    """
+    scripts = ""
+    if 'class="plotly-figure' in body_html:
+        scripts = (
+            f"<script>{plotly_js()}</script>"
+            f'<script type="application/json" id="plotly-shared-template">{_script_json(_default_template())}</script>'
+            f"{_BOOTSTRAP_JS}"
+        )
+    return (
+        f'<!DOCTYPE html>\n<html lang="ru">\n<head>\n<meta charset="utf-8">\n<title>{html.escape(title)}</title>\n'
+        f"{css}{_FIGURE_CSS}</head>\n<body>\n{body_html}\n{scripts}\n</body>\n</html>\n"
+    )
+
+def is_document(text: str) -> bool:
+    """Является ли текст полным HTML-документом (результат build_document)."""
+    return bool(text) and text.lstrip().startswith("<!DOCTYPE html>")
@@ -0,0 +1,241 @@
+"""
+Нормализация стоимости и сроков из текстовых описаний КП
+
+Модель возвращает стоимость и сроки свободным текстом («Фиксированная цена: 4,8 млн руб. без НДС»,
+«8-10 недель»). Здесь они один раз разбираются в типизированные поля: сумма, валюта, НДС, период
+оплаты и модель ценообразования, длительность в календарных днях. Шаблоны скомпилированы заранее,
+разбор векторизован по pandas.Series (str.extractall), поэтому таблица условий всех КП строится
+за один проход. Результат сохраняется в анализе КП (поле terms), а графики и экспорт берут
+готовые значения вместо повторного разбора текста.
+"""
+
+import re
+import numpy as np
+import pandas as pd
+from src.config import settings
+
+# Версия правил разбора: условия, сохраненные с другой версией, разбираются заново
+VERSION = 2
+
+# Перед каждым числом захватывается текст от предыдущего числа (context): по нему видно,
+# итоговая ли это сумма ("итого 2 млн руб.") или срок гарантии ("гарантия 12 месяцев")
+_CONTEXT = r"(?P<context>[^\d;\n]*?)"
+# Сумма: "4 800 000", "4,8", "1,500.50", "$ 12 000"; затем множитель, валюта и период оплаты
+PRICE_RE = re.compile(
+    _CONTEXT +
+    r"(?:(?P<pre_currency>[$€₽])\s*)?"
+    r"(?P<integer>\d+(?:[ \u00a0\u202f.,']\d{3})*)(?:[.,](?P<fraction>\d+))?(?!\d|[.,]\d|\s*%)"
+    r"(?:\s*(?P<unit>млрд|миллиард|млн|миллион|тыс|тысяч|mln|bn|k)\w*\.?)?"
+    r"(?:\s*(?P<currency>руб|р\.|₽|rub|rur|usd|долл|\$|eur|евро|€)\w*\.?)?"
+    r"(?:\s*(?:/|в|за)\s*(?P<period>час|ч\b|мес|год|ден|день|дн|сут))?",
+    re.IGNORECASE,
+)
+# Длительность: "120 рабочих дней", "8-10 недель", "6 месяцев", "1,5 года"
+DURATION_RE = re.compile(
+    _CONTEXT +
+    r"(?P<value>\d+(?:[.,]\d+)?)(?:\s*(?:-|–|—|до)\s*(?P<upper>\d+(?:[.,]\d+)?))?\s*"
+    r"(?P<unit>раб\w*\s+(?:дн|день)|дн|день|сут|нед|мес|квартал|год|лет)",
+    re.IGNORECASE,
+)
+_TOTAL_PRICE_RE = re.compile(r"итого|всего|общ\w*\s+(?:стоимость|сумма|цена|бюджет)", re.IGNORECASE)
+_TOTAL_DURATION_RE = re.compile(r"итого|всего|общ\w*\s+(?:срок|длительность|продолжительность)", re.IGNORECASE)
+_SUPPORT_RE = re.compile(r"гаранти|поддержк|сопровожд", re.IGNORECASE)
+_VAT_EXCLUDED_RE = re.compile(r"без\s+ндс|не\s+облага|ндс\s+не\s+(?:облага|предусм)", re.IGNORECASE)
+_VAT_INCLUDED_RE = re.compile(r"(?:с|вкл\w*|в\s+т\.\s*ч\.?)\s+ндс|ндс\s+вкл", re.IGNORECASE)
+
+_UNIT_MULTIPLIERS = {
+    "млрд": 1e9, "миллиард": 1e9, "bn": 1e9,
+    "млн": 1e6, "миллион": 1e6, "mln": 1e6,
+    "тыс": 1e3, "тысяч": 1e3, "k": 1e3,
+}
+_CURRENCIES = {
+    "руб": "RUB", "р.": "RUB", "₽": "RUB", "rub": "RUB", "rur": "RUB",
+    "usd": "USD", "долл": "USD", "$": "USD",
+    "eur": "EUR", "евро": "EUR", "€": "EUR",
+}
+_PERIODS = {"час": "hour", "ч": "hour", "ден": "day", "день": "day", "дн": "day", "сут": "day", "мес": "month", "год": "year"}
+# Календарных дней в единице срока (рабочие дни пересчитываются по пятидневной неделе)
+_UNIT_DAYS = {"раб": 7 / 5, "дн": 1, "день": 1, "сут": 1, "нед": 7, "мес": 30, "квартал": 91, "год": 365, "лет": 365}
+_PRICING_MODELS = (
+    ("Mixed", re.compile(r"смешанн|комбинир", re.IGNORECASE)),
+    ("Time & Materials", re.compile(r"t\s*&\s*m|time\s*(?:&|and)\s*materials?|почасов|ставк", re.IGNORECASE)),
+    ("Subscription", re.compile(r"подписк|абонент|subscription", re.IGNORECASE)),
+    ("Fixed Price", re.compile(r"фиксир|fixed", re.IGNORECASE)),
+)
+
+CURRENCY_SYMBOLS = {"RUB": "₽", "USD": "$", "EUR": "€"}
+PERIOD_LABELS = {"hour": "за час", "day": "за день", "month": "в месяц", "year": "в год"}
+
+TERMS_COLUMNS = ["price_amount", "currency", "vat", "price_period", "pricing_model", "timeline_days"]
+
+def _empty_frame(index) -> pd.DataFrame:
+    return pd.DataFrame({
+        "price_amount": pd.Series(np.nan, index=index, dtype=float),
+        "currency": pd.Series(None, index=index, dtype=object),
+        "price_period": pd.Series(None, index=index, dtype=object),
+    })
+
+def _parse_prices(texts: pd.Series) -> pd.DataFrame:
+    frame = _empty_frame(texts.index)
+    matches = texts.str.extractall(PRICE_RE)
+    if matches.empty:
+        return frame
+
+    integer = matches["integer"].str.replace("[ \u00a0\u202f.,']", "", regex=True)
+    amount = pd.to_numeric(integer + "." + matches["fraction"].fillna("0"), errors="coerce")
+    unit = matches["unit"].str.lower()
+    amount *= unit.str.rstrip(".").map(_UNIT_MULTIPLIERS).fillna(1.0)
+    currency = matches["currency"].str.lower().fillna(matches["pre_currency"]).str.rstrip(".")
+    currency = currency.where(currency != "р", "р.").map(_CURRENCIES)
+    period = matches["period"].str.lower().map(_PERIODS)
+
+    # Из нескольких чисел выбирается цена: сначала сумма с пометкой "итого"/"всего"/"общая стоимость",
+    # затем наибольшая сумма за проект (стоимость этапов и предоплата меньше итога), затем первая ставка
+    # за период; числа без валюты и множителя (номера этапов, количества) - только если другого нет
+    money = currency.notna() | unit.notna()
+    total = matches["context"].fillna("").str.contains(_TOTAL_PRICE_RE)
+    priority = np.select([money & total, money & period.isna(), money], [0, 1, 2], default=3)
+    candidates = pd.DataFrame({
+        "priority": priority, "order": np.where(priority == 1, -amount, 0.0),
+        "price_amount": amount, "currency": currency, "price_period": period,
+    }).dropna(subset=["price_amount"])
+    candidates = candidates[candidates["price_amount"] > 0]
+    # head(1), а не first(): first() берет первое непустое значение каждого столбца по отдельности
+    best = candidates.sort_values(["priority", "order"], kind="stable").groupby(level=0).head(1).droplevel(1)
+
+    frame.loc[best.index, "price_amount"] = best["price_amount"]
+    frame.loc[best.index, "currency"] = best["currency"]
+    frame.loc[best.index, "price_period"] = best["price_period"]
+    # Валюта по умолчанию - для сумм, у которых она не указана
+    frame.loc[frame["price_amount"].notna() & frame["currency"].isna(), "currency"] = settings.NORMALIZATION_DEFAULT_CURRENCY
+    return frame
+
+def _parse_durations(texts: pd.Series) -> pd.Series:
+    matches = texts.str.extractall(DURATION_RE)
+    if matches.empty:
+        return pd.Series(np.nan, index=texts.index, dtype=float)
+    # Для диапазона ("8-10 недель") берется верхняя граница
+    value = pd.to_numeric(matches["upper"].fillna(matches["value"]).str.replace(",", "."), errors="coerce")
+    unit = matches["unit"].str.lower().str.extract(r"^(раб|дн|день|сут|нед|мес|квартал|год|лет)", expand=False)
+    days = value * unit.map(_UNIT_DAYS)
+    # Сроки гарантии и поддержки - не срок выполнения; из остальных берется срок с пометкой
+    # "итого"/"всего"/"общий срок", а без нее - наибольший (сроки этапов входят в общий)
+    context = matches["context"].fillna("")
+    candidates = pd.DataFrame({
+        "priority": np.where(context.str.contains(_TOTAL_DURATION_RE), 0, 1), "days": days,
+    })[~context.str.contains(_SUPPORT_RE)].dropna(subset=["days"])
+    best = candidates.sort_values(["priority", "days"], ascending=[True, False], kind="stable").groupby(level=0)["days"].first()
+    return best.round().reindex(texts.index)
+
+def _vat(texts: pd.Series) -> pd.Series:
+    excluded = texts.str.contains(_VAT_EXCLUDED_RE)
+    included = texts.str.contains(_VAT_INCLUDED_RE)
+    return pd.Series(np.select([excluded, included], ["excluded", "included"], default=None), index=texts.index, dtype=object)
+
+def _pricing_model(texts: pd.Series) -> pd.Series:
+    conditions = [texts.str.contains(pattern) for _, pattern in _PRICING_MODELS]
+    labels = [label for label, _ in _PRICING_MODELS]
+    return pd.Series(np.select(conditions, labels, default="Unknown"), index=texts.index, dtype=object)
+
+def normalize_frame(pricing: pd.Series, timeline: pd.Series) -> pd.DataFrame:
+    """
+    Разбирает описания стоимости и сроков всех КП одним векторизованным проходом.
+
+    Args:
+        pricing (pd.Series): Описания стоимости.
+        timeline (pd.Series): Описания сроков (тот же индекс, что у pricing).
+
+    Returns:
+        pd.DataFrame: price_amount (float, NaN - сумма не найдена), currency (RUB/USD/EUR),
+        vat (included/excluded/None), price_period (hour/day/month/year или None для суммы за проект),
+        pricing_model, timeline_days (float, NaN - срок не найден).
+    """
+    pricing = pricing.fillna("").astype(str)
+    timeline = timeline.fillna("").astype(str)
+    frame = _parse_prices(pricing)
+    frame["vat"] = _vat(pricing)
+    frame["pricing_model"] = _pricing_model(pricing)
+    frame["timeline_days"] = _parse_durations(timeline)
+    return frame[TERMS_COLUMNS]
+
+def _to_terms(row) -> dict:
+    terms = {"version": VERSION}
+    for column in TERMS_COLUMNS:
+        value = row[column]
+        terms[column] = None if pd.isna(value) else value
+    if terms["price_amount"] is not None:
+        terms["price_amount"] = float(terms["price_amount"])
+    if terms["timeline_days"] is not None:
+        terms["timeline_days"] = int(terms["timeline_days"])
+    return terms
+
+def normalize_terms(pricing: str, timeline: str) -> dict:
+    """
+    Условия одного КП для сохранения в результате анализа (поле terms).
+
+    Returns:
+        dict: version и поля TERMS_COLUMNS (None вместо отсутствующих значений).
+    """
+    frame = normalize_frame(pd.Series([pricing]), pd.Series([timeline]))
+    return _to_terms(frame.iloc[0])
+
+def terms_frame(results: list) -> pd.DataFrame:
+    """
+    Таблица условий КП (строки в порядке results). Берутся условия, сохраненные в анализе;
+    результаты без них (или разобранные прежней версией правил) разбираются одним проходом.
+    """
+    stored = {i: result.get("terms") for i, result in enumerate(results)}
+    current = {i: terms for i, terms in stored.items() if terms and terms.get("version") == VERSION}
+    stale = [i for i in stored if i not in current]
+    parts = [pd.DataFrame.from_dict(current, orient="index", columns=TERMS_COLUMNS)] if current else []
+    if stale:
+        parts.append(normalize_frame(
+            pd.Series([results[i].get("pricing") for i in stale], index=stale),
+            pd.Series([results[i].get("timeline") for i in stale], index=stale),
+        ))
+    if not parts:
+        return pd.DataFrame(columns=TERMS_COLUMNS)
+    frame = pd.concat(parts).sort_index()
+    frame["price_amount"] = pd.to_numeric(frame["price_amount"], errors="coerce")
+    frame["timeline_days"] = pd.to_numeric(frame["timeline_days"], errors="coerce")
+    return frame
+
+def terms_of(result: dict) -> dict:
+    """Условия одного КП: сохраненные в анализе или разобранные заново."""
+    terms = result.get("terms")
+    if terms and terms.get("version") == VERSION:
+        return terms
+    return normalize_terms(result.get("pricing"), result.get("timeline"))
+
+def format_amount(amount: float, currency: str = None) -> str:
+    """Сумма с разделителями разрядов и символом валюты ("4 800 000 ₽")."""
+    text = f"{amount:,.2f}".rstrip("0").rstrip(".").replace(",", " ")
+    return f"{text} {CURRENCY_SYMBOLS.get(currency, currency or '')}".strip()
+
+def price_unit(currency: str, period: str = None) -> str:
+    """Единица цены для подписей ("₽", "$ в месяц")."""
+    return f"{CURRENCY_SYMBOLS.get(currency, currency or '')} {PERIOD_LABELS.get(period, '')}".strip()
+
+def comparable_prices(rows: list) -> tuple:
+    """
+    Отбирает КП с сопоставимыми ценами для графиков: суммы в разных валютах и ставки за разные
+    периоды на одной оси сравнивать нельзя, поэтому берется самая многочисленная группа
+    (валюта, период), при равенстве - группа сумм за проект.
+
+    Args:
+        rows (list): Словари с полями price_amount, currency, price_period.
+
+    Returns:
+        tuple: (единица цены группы или None, строки группы, [(строка, причина исключения), ...]).
+    """
+    groups, missing = {}, []
+    for row in rows:
+        if pd.isna(row.get("price_amount")):
+            missing.append((row, "не указано"))
+        else:
+            groups.setdefault((row.get("currency"), row.get("price_period")), []).append(row)
+    if not groups:
+        return None, [], missing
+    group = max(groups, key=lambda key: (len(groups[key]), key[1] is None))
+    excluded = [(row, price_unit(*key)) for key, members in groups.items() if key != group for row in members]
+    return price_unit(*group), groups[group], excluded + missing
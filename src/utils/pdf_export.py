@@ -0,0 +1,65 @@
+"""
+Сборка PDF из страниц Matplotlib и кеш готовых документов
+
+Страницы строятся объектным API (matplotlib.figure.Figure) без глобального состояния pyplot,
+поэтому их можно рисовать параллельно в пуле потоков и одновременно из разных сессий.
+Каждая страница сохраняется отдельным PDF, затем страницы склеиваются в порядке построителей.
+Готовый документ хранится по ключу данных (settings.PDF_CACHE_SIZE последних документов):
+повторная выгрузка того же набора результатов не рисует страницы заново.
+"""
+
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyPDF2 import PdfReader, PdfWriter
+from src.config import settings
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def _render_page(build_page) -> bytes:
+    figure = build_page()
+    buffer = BytesIO()
+    figure.savefig(buffer, format="pdf")
+    return buffer.getvalue()
+
+def render_pages(page_builders: list, max_workers: int = None) -> bytes:
+    """
+    Рисует страницы параллельно и собирает их в один PDF.
+
+    Args:
+        page_builders (list): Функции без аргументов, возвращающие matplotlib.figure.Figure (одна фигура - одна страница).
+        max_workers (int, optional): Число потоков. По умолчанию settings.PDF_EXPORT_WORKERS.
+
+    Returns:
+        bytes: PDF-документ.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or settings.PDF_EXPORT_WORKERS) as executor:
+        pages = list(executor.map(_render_page, page_builders))
+    writer = PdfWriter()
+    for page in pages:
+        for pdf_page in PdfReader(BytesIO(page)).pages:
+            writer.add_page(pdf_page)
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+def get_cached(key: str):
+    """Готовый PDF по ключу данных или None."""
+    with _lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+        return data
+
+def build_cached(key: str, page_builders: list) -> bytes:
+    """PDF по ключу данных: из кеша или отрисованный render_pages и сохраненный в кеш."""
+    data = get_cached(key)
+    if data is None:
+        data = render_pages(page_builders)
+        with _lock:
+            _cache[key] = data
+            while len(_cache) > settings.PDF_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return data
@@ -0,0 +1,73 @@
+"""
+Вывод сравнительных отчетов по разделам во время генерации и кеш готовых отчетов
+
+Отчет по всем КП модель пишет минуту и дольше. Текст приходит потоком (ai_service.stream_ai_response)
+и делится на разделы по заголовкам: раздел считается законченным, когда начался следующий, поэтому
+законченные разделы выводятся один раз и больше не перерисовываются, а обновляется только текущий.
+Готовый документ хранится по ключу входных данных (settings.REPORT_CACHE_SIZE последних отчетов):
+повторный запрос того же отчета по тем же КП не обращается к модели.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from src.config import settings
+from src.utils.html_report import PLACEHOLDER_RE
+
+# Начало раздела: заголовок HTML <h1>/<h2> или Markdown "#", "##", "###" в начале строки
+SECTION_RE = re.compile(r"<h[12][\s>]|^[ \t]*#{1,3}[ \t]", re.IGNORECASE | re.MULTILINE)
+# Плейсхолдер графика вместе с оберткой <div class="visual">, которую просит системная инструкция отчета
+FIGURE_RE = re.compile(r"(?:<div class=\"visual\">\s*)?" + PLACEHOLDER_RE.pattern + r"(?:\s*</div>)?")
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def split_sections(text: str) -> tuple:
+    """
+    Делит накопленный текст отчета на законченные разделы и текущий (еще генерируемый) раздел.
+
+    Returns:
+        tuple: (список законченных разделов, текущий раздел). Текст до первого заголовка
+        считается отдельным разделом.
+    """
+    starts = [match.start() for match in SECTION_RE.finditer(text) if match.start() > 0]
+    bounds = [0] + starts
+    sections = [text[start:end] for start, end in zip(bounds, starts)]
+    return [section for section in sections if section.strip()], text[bounds[-1]:]
+
+def split_figures(section: str) -> list:
+    """
+    Делит раздел на текст и плейсхолдеры графиков.
+
+    Returns:
+        list: Пары ("text", фрагмент) и ("figure", название графика или "") в порядке следования.
+    """
+    parts, position = [], 0
+    for match in FIGURE_RE.finditer(section):
+        if match.start() > position:
+            parts.append(("text", section[position:match.start()]))
+        parts.append(("figure", (match.group(1) or "").strip()))
+        position = match.end()
+    if position < len(section):
+        parts.append(("text", section[position:]))
+    return parts
+
+def strip_figures(text: str) -> str:
+    """Текст с пометками вместо плейсхолдеров графиков (для раздела, который еще генерируется)."""
+    return FIGURE_RE.sub(lambda match: f"*📈 {(match.group(1) or 'График').strip()}*", text)
+
+def get_cached(key: str):
+    """Готовый отчет по ключу входных данных или None."""
+    with _lock:
+        document = _cache.get(key)
+        if document is not None:
+            _cache.move_to_end(key)
+        return document
+
+def store(key: str, document: str):
+    """Сохраняет готовый отчет (вытесняются давно не использованные)."""
+    with _lock:
+        _cache[key] = document
+        _cache.move_to_end(key)
+        while len(_cache) > settings.REPORT_CACHE_SIZE:
+            _cache.popitem(last=False)
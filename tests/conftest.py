@@ -0,0 +1,43 @@
+import os
+import sys
+import threading
+import pytest
+
+# Тесты запускаются из корня репозитория: пакет src и fake_llm_server импортируются оттуда
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_llm_server
+
+@pytest.fixture(scope="session")
+def fake_llm():
+    """
+    Поддельный API провайдеров (fake_llm_server) на свободном порту. Клиенты ai_service создаются
+    лениво, поэтому адреса из окружения подхватываются при первом запросе к модели.
+    """
+    server = fake_llm_server.run_server("127.0.0.1", 0, quiet=True, latency_mean=0.01, chunk_delay=0.0, batch_delay=0.3)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    url = f"http://{host}:{port}"
+    environ = {"ANTHROPIC_BASE_URL": url, "OPENAI_BASE_URL": f"{url}/v1", "ANTHROPIC_API_KEY": "test", "OPENAI_API_KEY": "test"}
+    previous = {name: os.environ.get(name) for name in environ}
+    os.environ.update(environ)
+    yield fake_llm_server
+    server.shutdown()
+    for name, value in previous.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+@pytest.fixture
+def fake(fake_llm, monkeypatch):
+    """Сервер с обнуленными счетчиками; настройки CONFIG, измененные тестом, откатываются после него."""
+    with fake_llm.STATE["lock"]:
+        for name in fake_llm.STATE["stats"]:
+            fake_llm.STATE["stats"][name] = 0
+        fake_llm.STATE["last_repair_prompt"] = None
+    for name, value in list(fake_llm.CONFIG.items()):
+        monkeypatch.setitem(fake_llm.CONFIG, name, value)
+    monkeypatch.setitem(fake_llm.CONFIG, "model_latency", {})
+    return fake_llm
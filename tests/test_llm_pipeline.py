@@ -0,0 +1,168 @@
+"""Запросы к моделям через ai_service против fake_llm_server: дозапрос полей, хеджирование,
+объединение запросов, допуск в очередь и пакетный режим."""
+
+import asyncio
+import uuid
+import pytest
+from src.config import settings
+from src.models import schemas
+from src.services import admission, ai_service, batch_service, hedging, token_budget
+
+CLAUDE = "claude-3-5-sonnet-20240620"
+GPT = "gpt-4o"
+
+def _prompt(text: str = "Извлеки данные КП.") -> str:
+    # Уникальный запрос: одинаковые одновременные запросы разных тестов объединялись бы
+    return f"{text} [{uuid.uuid4().hex}]"
+
+@pytest.mark.parametrize("model_id", [CLAUDE, GPT])
+def test_structured_repair_sends_compact_prompt(fake, model_id):
+    fake.CONFIG["partial_rate"] = 1.0
+    source = "\n\n".join(f"Раздел {i}. Архитектура и интеграции модуля {i}." for i in range(500))
+    prompt = _prompt("Извлеки данные КП.") + "\n\n" + source + "\n\nСроки проекта: 6 месяцев."
+
+    data, missing, completion = ai_service.run_sync(ai_service.get_structured_response_async(
+        prompt, "Извлеки ключевые данные КП в JSON.", schemas.KPSummary, model_id, "summary", hedge=False
+    ))
+
+    assert missing == []
+    assert set(data) == set(schemas.KPSummary.model_fields)
+    assert fake.STATE["stats"]["partial"] == 1
+    assert fake.STATE["stats"]["repairs"] == 1
+    repair_prompt = fake.STATE["last_repair_prompt"]
+    assert "Уже получено" in repair_prompt and "timeline" in repair_prompt
+    assert token_budget.estimate_tokens(repair_prompt) < token_budget.estimate_tokens(prompt) / 2
+    assert "Сроки проекта" in repair_prompt
+
+@pytest.fixture
+def hedge_policy(monkeypatch):
+    policy = hedging.HedgePolicy()
+    for _ in range(settings.HEDGE_MIN_SAMPLES):
+        policy.record_latency(GPT, 0.05)
+    monkeypatch.setattr(hedging, "policy", policy)
+    monkeypatch.setattr(settings, "HEDGE_MIN_DELAY_SEC", 0.1)
+    monkeypatch.setattr(settings, "HEDGE_MAX_RATE", 1.0)
+    monkeypatch.setattr(settings, "HEDGE_TARGET", "alternate")
+    return policy
+
+def _hedged(tender_id: str):
+    async def _run():
+        with token_budget.tender_scope(tender_id):
+            return await ai_service._hedged_request(_prompt("Привет"), "Ответь кратко.", GPT, [GPT, CLAUDE], 200, stage="summary")
+    return ai_service.run_sync(_run())
+
+@pytest.mark.parametrize("primary_latency, hedge_latency, winner, hedge_wins", [
+    (1.0, 0.0, CLAUDE, 1),   # Основной запрос завис - отвечает дубликат на резервной модели
+    (0.3, 2.0, GPT, 0),      # Основной запрос успел раньше дубликата
+])
+def test_hedging_win_and_loss(fake, hedge_policy, primary_latency, hedge_latency, winner, hedge_wins):
+    fake.CONFIG["model_latency"] = {GPT: primary_latency, CLAUDE: hedge_latency}
+    tender_id = f"hedge-{uuid.uuid4().hex}"
+
+    completion = _hedged(tender_id)
+
+    assert completion.model_id == winner
+    stats = hedge_policy.stats()
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == hedge_wins
+    # Отмененный проигравший тоже учтен в расходе тендера
+    totals = token_budget.get_tender_totals(tender_id)
+    assert totals["calls"] == 1
+    assert totals["by_stage"]["summary"]["models"] == {GPT if winner == CLAUDE else CLAUDE: 1}
+    assert totals["input_tokens"] > 0
+
+def test_hedge_win_is_not_reported_as_outage(fake, hedge_policy, monkeypatch):
+    fake.CONFIG["model_latency"] = {GPT: 1.0, CLAUDE: 0.0}
+    warnings = []
+    monkeypatch.setattr(ai_service.st, "warning", warnings.append)
+
+    ai_service.get_ai_response(_prompt("Привет"), "Ответь кратко.", GPT, "summary", hedge=True)
+
+    completion = ai_service.get_last_completion()
+    assert completion.model_id != GPT and completion.failovers == 0
+    assert warnings == []
+
+def test_hedge_marks_its_own_request(monkeypatch):
+    monkeypatch.setattr(settings, "HEDGE_MAX_RATE", 0.5)
+    policy = hedging.HedgePolicy()
+    first = policy.start_request()
+    policy.start_request()
+    assert policy.try_acquire(first, 100)
+    # В окне два запроса, хеджирован первый: доля 50% уже не позволяет хеджировать второй
+    assert policy._recent == {first: True, first + 1: False}
+    assert not policy.try_acquire(first + 1, 100)
+
+def test_probe_does_not_inherit_stream_sink(fake, monkeypatch):
+    probed = []
+
+    async def _probe_models():
+        probed.append((ai_service._text_sink.get(), token_budget.current_tender.get()))
+
+    monkeypatch.setattr(ai_service, "_probe_models", _probe_models)
+    monkeypatch.setattr(ai_service.model_router.router, "probe_due", lambda: True)
+    *_, text = ai_service.stream_ai_response(_prompt("Привет"), "Ответь кратко.", GPT, "summary")
+
+    assert text and not text.startswith("Error:")
+    assert probed == [(None, None)]
+
+def test_identical_concurrent_requests_are_coalesced(fake):
+    fake.CONFIG["latency_mean"] = 0.3
+    prompt = _prompt("Одинаковый запрос")
+
+    async def _run():
+        return await asyncio.gather(*[
+            ai_service.get_ai_completion_async(prompt, "Ответь кратко.", GPT, "summary", hedge=False)
+            for _ in range(3)
+        ])
+
+    completions = ai_service.run_sync(_run())
+    assert fake.STATE["stats"]["requests"] == 1
+    assert sorted(completion.coalesced for completion in completions) == [False, True, True]
+    assert len({completion.text for completion in completions}) == 1
+
+def test_admission_rejects_with_eta(fake, monkeypatch):
+    fake.CONFIG["latency_mean"] = 0.3
+    monkeypatch.setattr(settings, "ADMISSION_MAX_CONCURRENT", 1)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_QUEUE", 2)
+    monkeypatch.setattr(admission, "scheduler", admission.AdmissionScheduler())
+
+    async def _run():
+        return await asyncio.gather(*[
+            ai_service.get_ai_completion_async(_prompt(), "Ответь кратко.", GPT, "summary", hedge=False)
+            for _ in range(5)
+        ], return_exceptions=True)
+
+    results = ai_service.run_sync(_run())
+    rejected = [result for result in results if isinstance(result, admission.AdmissionRejected)]
+    assert len(rejected) == 2
+    assert all(error.queued == 2 for error in rejected)
+    # Впереди два ожидающих и один выполняющийся запрос на единственном слоте
+    assert all(error.eta == 3 * settings.ADMISSION_SERVICE_TIME_SEC for error in rejected)
+    assert fake.STATE["stats"]["requests"] == 3
+    assert admission.scheduler.stats()["active"] == 0
+
+@pytest.mark.parametrize("model_id", [CLAUDE, GPT])
+def test_batch_submit_poll_resume(fake, tmp_path, monkeypatch, model_id):
+    monkeypatch.setattr(settings, "BATCH_DIR", tmp_path / "batches")
+    monkeypatch.setattr(settings, "RESULT_DIR", tmp_path / "results")
+    monkeypatch.setattr(settings, "HISTORY_PATH", tmp_path / "history" / "analyses.jsonl")
+    files = {}
+    for name, text in {"tz.txt": "# Требования\n\nСистема учета заявок.", "kp1.txt": "КП ТестСофт", "kp2.txt": "КП Альфа"}.items():
+        (tmp_path / name).write_text(text, encoding="utf-8")
+        files[name] = {"original_name": name, "file_path": str(tmp_path / name)}
+
+    job = batch_service.create_job(files["tz.txt"], [files["kp1.txt"], files["kp2.txt"]], model_id)
+    batch_service.submit_phase(job)
+    assert job["batch_id"] and job["request_count"] == 4
+    # Пакет еще обрабатывается: опрос ничего не меняет
+    assert batch_service.poll_job(job) is False and job["phase"] == "analysis"
+
+    # Продолжение после "перезапуска": состояние читается с диска
+    resumed = batch_service.load_job(job["job_id"])
+    outputs = batch_service.run_job(resumed, poll_interval=0.1)
+
+    assert batch_service.load_job(job["job_id"])["phase"] == "done"
+    assert [output["kp_name"] for output in outputs] == ["kp1.txt", "kp2.txt"]
+    assert all(output["comparison_result"]["compliance_score"] is not None for output in outputs)
+    assert resumed["errors"] == []
+    assert (tmp_path / "results" / f"batch_{job['job_id']}.json").exists()
+    assert len((tmp_path / "history" / "analyses.jsonl").read_text(encoding="utf-8").splitlines()) == 2
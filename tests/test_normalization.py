@@ -0,0 +1,76 @@
+import math
+import pytest
+from src.utils.normalization import comparable_prices, normalize_terms
+
+@pytest.mark.parametrize("text, days", [
+    ("6 месяцев", 180),
+    ("8-10 недель", 70),
+    ("120 рабочих дней", 168),
+    ("1,5 года", 548),
+    ("6 месяцев, гарантия 12 месяцев", 180),
+    ("Срок разработки 4 месяца, техническая поддержка 12 месяцев", 120),
+    ("Этап 1: 2 месяца, этап 2: 3 месяца, итого 5 месяцев", 150),
+    ("Общий срок 20 недель: анализ 4 недели, разработка 12 недель", 140),
+    ("Этап 1: 2 месяца, этап 2: 3 месяца", 90),
+    ("Гарантия 12 месяцев", None),
+    ("по согласованию", None),
+])
+def test_timeline_days(text, days):
+    assert normalize_terms("", text)["timeline_days"] == days
+
+@pytest.mark.parametrize("text, amount, currency, period", [
+    ("4 800 000 руб.", 4_800_000, "RUB", None),
+    ("Фиксированная цена: 4,8 млн руб. без НДС", 4_800_000, "RUB", None),
+    ("350 тыс. рублей", 350_000, "RUB", None),
+    ("$ 12 000", 12_000, "USD", None),
+    ("15 000 EUR", 15_000, "EUR", None),
+    ("1,500.50 USD", 1_500.5, "USD", None),
+    ("2 500 руб/час", 2_500, "RUB", "hour"),
+    ("Абонентская плата 150 000 руб. в месяц", 150_000, "RUB", "month"),
+    ("Этап 1 - 1 200 000 руб., этап 2 - 800 000 руб., итого 2 000 000 руб.", 2_000_000, "RUB", None),
+    ("Всего 3 млн руб., предоплата 30% - 900 тыс. руб.", 3_000_000, "RUB", None),
+    ("Предоплата 900 тыс. руб., полная стоимость 3 млн руб.", 3_000_000, "RUB", None),
+    ("Разработка 3 млн руб., поддержка 200 000 руб./мес", 3_000_000, "RUB", None),
+    ("5 000 000", 5_000_000, "RUB", None),
+    ("по запросу", None, None, None),
+])
+def test_price(text, amount, currency, period):
+    terms = normalize_terms(text, "")
+    if amount is None:
+        assert terms["price_amount"] is None
+    else:
+        assert math.isclose(terms["price_amount"], amount)
+    assert terms["currency"] == currency
+    assert terms["price_period"] == period
+
+@pytest.mark.parametrize("text, vat", [
+    ("4,8 млн руб. без НДС", "excluded"),
+    ("4,8 млн руб. с НДС", "included"),
+    ("4,8 млн руб., в т.ч. НДС 20%", "included"),
+    ("4,8 млн руб.", None),
+])
+def test_vat(text, vat):
+    terms = normalize_terms(text, "")
+    assert terms["vat"] == vat
+    assert math.isclose(terms["price_amount"], 4_800_000)
+
+def test_comparable_prices_keeps_majority_group():
+    rows = [
+        {"name": "A", "price_amount": 1e6, "currency": "RUB", "price_period": None},
+        {"name": "B", "price_amount": 2e6, "currency": "RUB", "price_period": None},
+        {"name": "C", "price_amount": 5e3, "currency": "USD", "price_period": None},
+        {"name": "D", "price_amount": 2.5e3, "currency": "RUB", "price_period": "hour"},
+        {"name": "E", "price_amount": None, "currency": None, "price_period": None},
+    ]
+    unit, kept, excluded = comparable_prices(rows)
+    assert unit == "₽"
+    assert [row["name"] for row in kept] == ["A", "B"]
+    assert [(row["name"], reason) for row, reason in excluded] == [("C", "$"), ("D", "₽ за час"), ("E", "не указано")]
+
+def test_comparable_prices_prefers_lump_sums_on_tie():
+    rows = [
+        {"price_amount": 150_000, "currency": "RUB", "price_period": "month"},
+        {"price_amount": 3e6, "currency": "RUB", "price_period": None},
+    ]
+    unit, kept, _ = comparable_prices(rows)
+    assert unit == "₽" and kept == rows[1:]
@@ -0,0 +1,39 @@
+import pytest
+from src.services import report_reduce, token_budget
+
+HEADER = "# Сравнительный отчет\n\n"
+
+@pytest.fixture
+def summaries(monkeypatch):
+    # Сводка группы - первая строка каждого блока (как при недоступной модели)
+    monkeypatch.setattr(report_reduce, "summarize_groups", lambda blocks, merge=False: [
+        "\n".join(block.splitlines()[0] for block in blocks[i:i + 10]) for i in range(0, len(blocks), 10)
+    ])
+
+def _block(name: str, words: int) -> str:
+    return f"### {name}\n" + "требование выполнено полностью " * words + "\n\n"
+
+def test_flat_prompt_when_everything_fits(summaries):
+    blocks = [_block(f"КП {i}", 10) for i in range(3)]
+    prompt, info = report_reduce.build_report_prompt(HEADER, blocks, [1, 2, 3])
+    assert info["mode"] == "flat"
+    assert prompt == HEADER + "".join(blocks)
+
+@pytest.mark.parametrize("top_words", [50, 20_000])
+def test_hierarchical_prompt_fits_budget(summaries, top_words):
+    budget = token_budget.get_stage_budget("comparative_report")["input"]
+    blocks = [_block("Лучший КП", top_words)] + [_block(f"КП {i}", 300) for i in range(200)]
+    prompt, info = report_reduce.build_report_prompt(HEADER, blocks, [100] + [50] * 200)
+    assert info["mode"] == "hierarchical"
+    assert info["shortlist"] >= 1
+    assert "### Лучший КП" in prompt
+    assert token_budget.estimate_tokens(prompt) <= budget
+
+def test_prompt_truncated_when_header_exceeds_budget(summaries):
+    budget = token_budget.get_stage_budget("comparative_report")["input"]
+    header = "# Сравнительный отчет\n\n" + "очень длинный заголовок " * budget
+    blocks = [_block(f"КП {i}", 300) for i in range(20)]
+    prompt, info = report_reduce.build_report_prompt(header, blocks, list(range(20)))
+    assert info["mode"] == "hierarchical"
+    assert prompt.startswith("# Сравнительный отчет")
+    assert token_budget.estimate_tokens(prompt) <= budget
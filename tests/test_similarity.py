@@ -0,0 +1,19 @@
+from src.components import analysis
+from src.services import similarity
+
+TZ = "Техническое задание на внедрение системы документооборота. " * 20
+BODY = " ".join(f"Пункт {i}: модуль {i} поставляется, настраивается и сопровождается в течение года." for i in range(200))
+
+def _kp(company: str) -> str:
+    return f"Коммерческое предложение ООО «{company}».\n\n{BODY}"
+
+def test_reuse_only_for_the_same_vendor(tmp_path, monkeypatch):
+    monkeypatch.setattr(similarity, "index", similarity.ProposalIndex(tmp_path))
+    similarity.index.add(TZ, _kp("ТестСофт"), "testsoft.pdf", {"company_name": "ООО «ТестСофт»", "kp_name": "testsoft.pdf"})
+
+    # Повторная отправка того же участника с другим сопроводительным письмом
+    match = analysis.find_reusable_match(TZ, _kp("ТестСофт") + "\nДата: 01.02.2026", "kp_v2.pdf")
+    assert match and match["kp_name"] == "testsoft.pdf"
+    # Почти такой же текст от другой компании: прежний результат с чужим названием не используется
+    assert similarity.index.find(TZ, _kp("Альфа"))
+    assert analysis.find_reusable_match(TZ, _kp("Альфа"), "alpha.pdf") is None
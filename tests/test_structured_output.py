@@ -0,0 +1,27 @@
+import json
+from src.models import schemas
+from src.services import structured_output
+
+def test_partial_nested_fields_are_plain_and_repairable():
+    answer = {
+        "summary": 123,  # Невалидное поле: число вместо строки
+        "general_findings": ["Срок сдачи перенесен на март"],
+        "vendor_findings": [{"vendor": "ТестСофт", "finding": "Сорвал сроки пилота", "impact": "-1"}],
+    }
+    data, missing = structured_output.validate_fields(answer, schemas.AdditionalFileDigest)
+
+    assert missing == ["summary"]
+    # Вложенные модели выгружаются в словари, как при полной проверке (model_dump)
+    assert data["vendor_findings"] == [{"vendor": "ТестСофт", "finding": "Сорвал сроки пилота", "impact": -1}]
+    prompt = structured_output.build_repair_prompt(
+        "Протокол встречи.\n\nТестСофт сорвал сроки пилота.", data, schemas.AdditionalFileDigest, missing, 500
+    )
+    assert "- summary:" in prompt
+    assert json.dumps(data, ensure_ascii=False) in prompt
+
+def test_full_and_partial_paths_agree():
+    answer = {"compliance": "85", "details": "Покрыто", "missing_requirements": [], "additional_features": ["SSO"]}
+    full, _ = structured_output.validate_fields(answer, schemas.SectionComparison)
+    partial, missing = structured_output.validate_fields({**answer, "compliance": 150}, schemas.SectionComparison)
+    assert missing == ["compliance"]
+    assert partial == {name: value for name, value in full.items() if name != "compliance"}
@@ -0,0 +1,32 @@
+import pytest
+from src.models import schemas
+from src.services import ai_service, tender_digest
+
+@pytest.fixture
+def digest_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(tender_digest, "store", tender_digest.DigestStore(tmp_path / "digests"))
+
+def _answer(fields: dict, missing: list):
+    async def _respond(*args, **kwargs):
+        return fields, missing, ai_service.AICompletion(text="", model_id=ai_service.get_stage_config("digest")["model"])
+    return _respond
+
+def test_partial_answer_with_model_instances(digest_store, monkeypatch):
+    # Частично валидный ответ: summary не получен, выводы об участниках - модели, а не словари
+    monkeypatch.setattr(ai_service, "get_structured_response_async", _answer({
+        "general_findings": ["Срок сдачи перенесен на март", 42],
+        "vendor_findings": [
+            schemas.VendorFinding(vendor="ООО ТестСофт", finding="Сорвал сроки пилота", impact=-1),
+            {"vendor": "Альфа", "finding": "Рекомендации заказчиков", "impact": 2},
+            {"vendor": "Бета"},
+        ],
+    }, ["summary"]))
+
+    digest = tender_digest.build_digest([{"name": "Протокол", "hash": "h1", "text": "Протокол встречи"}])
+
+    assert digest["files"][0]["summary"] == ""
+    assert [item["finding"] for item in digest["general_findings"]] == ["Срок сдачи перенесен на март"]
+    assert set(digest["vendors"]) == {"тестсофт", "альфа"}
+    sliced = tender_digest.vendor_slice(digest, ["ТестСофт"])
+    assert sliced["rating_impact"] == -1
+    assert "Сорвал сроки пилота (Протокол)" in sliced["key_findings"]